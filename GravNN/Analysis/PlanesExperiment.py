@@ -1,14 +1,12 @@
-import os
-
 import numpy as np
 import tensorflow as tf
-import trimesh
 
 from GravNN.Analysis.ExperimentBase import ExperimentBase
 from GravNN.Networks.Data import DataSet
 from GravNN.Networks.Losses import get_loss_fcn
+from GravNN.Support.MeshContainment import MeshContainment
 from GravNN.Support.PathTransformations import make_windows_path_posix
-from GravNN.Support.ProgressBar import ProgressBar
+from GravNN.Support.ShapeModelRegistry import get_shape_model
 from GravNN.Trajectories.PlanesDist import PlanesDist
 
 
@@ -129,23 +127,10 @@ class PlanesExperiment(ExperimentBase):
             # planets have shape model (sphere currently)
             self.obj_file = self.config.get("obj_file", [obj_file])[0]
             self.obj_file = make_windows_path_posix(self.obj_file)
-            filename, file_extension = os.path.splitext(self.obj_file)
-            self.obj_mesh = trimesh.load_mesh(
-                self.obj_file,
-                file_type=file_extension[1:],
-            )
+            self.obj_mesh = get_shape_model(self.obj_file).mesh
 
-            N = len(self.x_test)
-            step = 100
-            mask = np.full((N,), False)
-            pbar = ProgressBar(N, True)
-            rayObject = trimesh.ray.ray_triangle.RayMeshIntersector(self.obj_mesh)
-            for i in range(0, N, step):
-                end_idx = (i // step + 1) * step
-                position_subset = self.x_test[i:end_idx] / 1e3
-                mask[i:end_idx] = rayObject.contains_points(position_subset)
-                pbar.update(i)
-            pbar.close()
+            containment = MeshContainment(self.obj_mesh)
+            mask = containment.contains(self.x_test / 1e3)
             self.interior_mask = mask
         return self.interior_mask
 
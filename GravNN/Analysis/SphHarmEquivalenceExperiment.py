@@ -6,7 +6,7 @@ import numpy as np
 import pandas as pd
 
 import GravNN
-from GravNN.GravityModels.SphericalHarmonics import get_sh_data
+from GravNN.GravityModels.SphericalHarmonics import get_sh_shell_data
 from GravNN.Networks.Model import load_config_and_model
 from GravNN.Support.StateObject import StateObject
 from GravNN.Support.Statistics import mean_std_median, sigma_mask
@@ -142,10 +142,22 @@ class SphHarmEquivalenceExperiment:
         df_all = pd.DataFrame()
 
         altitudes = self.truth_df.index
-        for alt in altitudes:
+
+        # Every altitude shares the same Fibonacci directions, so the spherical
+        # harmonic truth is computed for all radii in one pass.
+        radii = self.planet.radius + np.array(altitudes)
+        directions = FibonacciDist(self.planet, radii[0], points).positions
+        acc_sh_shells, _ = get_sh_shell_data(
+            directions,
+            radii,
+            self.planet.sh_file,
+            **self.config,
+        )
+
+        for i, alt in enumerate(altitudes):
             trajectory = FibonacciDist(self.planet, self.planet.radius + alt, points)
-            sh_file = trajectory.celestial_body.sh_file
-            x, acc_sh, u = get_sh_data(trajectory, sh_file, **self.config)
+            x = trajectory.positions
+            acc_sh = acc_sh_shells[i]
             acc_pinn = self.model.compute_acceleration(x)
 
             state_obj_true = StateObject(trajectory=trajectory, accelerations=acc_sh)
@@ -0,0 +1,151 @@
+import dataclasses
+import hashlib
+
+import numpy as np
+
+from GravNN.GravityModels.GravityModelBase import GravityModelBase
+
+
+@dataclasses.dataclass
+class Component:
+    """Gravity model contributing scale * model(x - r_offset) to a composite.
+
+    The last results are cached with the positions and parameters they were
+    computed for, so the component is only re-evaluated when its model object,
+    the model's mu, its offset, or the positions change. Call invalidate() after
+    any other in-place change to the model."""
+
+    model: GravityModelBase
+    r_offset: np.ndarray = dataclasses.field(default_factory=lambda: np.zeros(3))
+    scale: float = 1.0
+    _key: tuple = dataclasses.field(default=None, init=False, repr=False)
+    _values: tuple = dataclasses.field(default=None, init=False, repr=False)
+
+    def signature(self):
+        return (
+            id(self.model),
+            self.model.id,
+            repr(getattr(self.model, "mu", None)),
+            tuple(np.ravel(self.r_offset).tolist()),
+        )
+
+    def invalidate(self):
+        self._key = None
+        self._values = None
+
+    def store(self, positions_digest, accelerations, potentials):
+        self._key = (positions_digest, self.signature())
+        self._values = (
+            np.array(accelerations, dtype=np.float64).reshape((-1, 3)),
+            np.array(potentials, dtype=np.float64).reshape((-1,)),
+        )
+
+    def evaluate(self, positions, positions_digest):
+        "Unscaled accelerations and potentials at positions, cached"
+        if self._key == (positions_digest, self.signature()):
+            return self._values
+
+        x = positions - np.reshape(self.r_offset, (1, 3))
+        if hasattr(self.model, "compute_batch"):
+            accelerations, potentials = self.model.compute_batch(x)
+        else:
+            accelerations = self.model.compute_acceleration(x)
+            potentials = self.model.compute_potential(x)
+        self.store(positions_digest, accelerations, potentials)
+        return self._values
+
+
+def positions_digest(positions):
+    return hashlib.sha256(np.ascontiguousarray(positions).tobytes()).hexdigest()
+
+
+class CompositeGravityModel(GravityModelBase):
+    def __init__(self, celestial_body, components, trajectory=None):
+        """Superposition of gravity models, each shifted and scaled (see
+        Component). The results of every component are cached, so changing the
+        offset or mass of one component only re-evaluates that component, e.g.
+        when sweeping point masses on top of an expensive polyhedral model.
+
+        Args:
+            celestial_body (CelestialBody): Body for gravity calc
+            components (list): Components (or bare gravity models) to sum
+            trajectory (TrajectoryBase, optional): Trajectory / distribution for which
+                the gravity measurements should be computed. Defaults to None.
+        """
+        self.planet = celestial_body
+        self.components = [
+            component if isinstance(component, Component) else Component(component)
+            for component in components
+        ]
+        super().__init__(celestial_body, self.components, trajectory=trajectory)
+        self.configure(trajectory)
+
+    def add_component(self, component):
+        if not isinstance(component, Component):
+            component = Component(component)
+        self.components.append(component)
+        return component
+
+    def generate_full_file_directory(self):
+        # Directory unique to the class, directory, offset and scale of each model
+        description = ""
+        for component in self.components:
+            model = component.model
+            description += (
+                f"{model.__class__.__name__}_{model.id}_"
+                f"{getattr(model, 'mu', None)}_{np.ravel(component.r_offset)}_"
+                f"{component.scale};"
+            )
+        digest = hashlib.sha256(description.encode()).hexdigest()[:16]
+        self.file_directory += f"{self.__class__.__name__}_{digest}/"
+
+    def load_components(self):
+        """Seed the caches of the components evaluated at the trajectory itself
+        (no offset) from their own saved data, generating it if needed"""
+        positions = self.trajectory.positions
+        digest = positions_digest(np.asarray(positions, dtype=np.float64))
+        for component in self.components:
+            if np.any(np.ravel(component.r_offset) != 0.0):
+                continue
+            model = component.model
+            model.trajectory = self.trajectory
+            model.load()
+            component.store(digest, model.accelerations, model.potentials)
+
+    def load(self, override=False, chunk_size=None, lease=None):
+        if self.trajectory is not None:
+            self.load_components()
+        return super().load(override, chunk_size, lease)
+
+    def compute_acceleration(self, positions=None):
+        "Compute the acceleration for an existing trajectory or provided positions"
+        if positions is None:
+            positions = self.trajectory.positions
+
+        self.compute_batch(positions)
+        return self.accelerations
+
+    def compute_potential(self, positions=None):
+        "Compute the potential for an existing trajectory or provided positions"
+        if positions is None:
+            positions = self.trajectory.positions
+
+        self.compute_batch(positions)
+        return self.potentials
+
+    def compute_batch(self, positions):
+        """Sum the scaled accelerations and potentials of the components,
+        re-evaluating only the components whose parameters changed"""
+        positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+        digest = positions_digest(positions)
+
+        accelerations = np.zeros(positions.shape)
+        potentials = np.zeros((len(positions),))
+        for component in self.components:
+            acc, pot = component.evaluate(positions, digest)
+            accelerations += component.scale * acc
+            potentials += component.scale * pot
+
+        self.accelerations = accelerations
+        self.potentials = potentials
+        return self.accelerations, self.potentials
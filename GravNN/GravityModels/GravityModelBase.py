@@ -1,11 +1,46 @@
+import contextlib
 import hashlib
 import inspect
 import json
 import logging
+import multiprocessing as mp
 import os
-import pickle
+import shutil
+import tempfile
+import time
 from abc import ABC, abstractmethod
 
+import numpy as np
+from numba import get_num_threads, set_num_threads
+
+from GravNN.Support.ArrayStorage import load_array, migrate_pickle, save_array
+from GravNN.Support.DataCache import canonical_hash, get_data_cache
+from GravNN.Support.FileLease import FileLease
+
+# Model generating shards in a worker of a process pool (see generate_sharded)
+_shard_model = None
+
+# Points per kernel call when computing a shard, the leases held by the process
+# are refreshed between calls (see GravityModelBase.compute_chunks)
+SHARD_CHUNK_SIZE = 10000
+
+
+def init_shard_worker(model, n_threads):
+    global _shard_model
+    _shard_model = model
+    set_num_threads(n_threads)
+
+
+def generate_shard_worker(args):
+    shard, n_shards, override, lease, chunk_size = args
+    _shard_model.generate_shard(
+        shard,
+        n_shards,
+        override,
+        lease=lease,
+        chunk_size=chunk_size,
+    )
+
 
 class SkipNonSerializable(json.JSONEncoder):
     def default(self, obj):
@@ -18,12 +53,21 @@ class SkipNonSerializable(json.JSONEncoder):
 class GravityModelBase(ABC):
     verbose = True
 
+    # Files of the generated data tracked by the data cache
+    cache_files = [
+        "acceleration.npy",
+        "potential.npy",
+        "acceleration.data",
+        "potential.data",
+    ]
+
     def __init__(self, *args, **kwargs):
         """Base class responsible for generating the accelerations for a given trajectory / distribution"""
         self._trajectory = None
         self.accelerations = None
         self.potentials = None
         self.file_directory = None
+        self.cache_name = None
         self.id = self.generate_hash(*args, **kwargs)
         return
 
@@ -55,52 +99,647 @@ class GravityModelBase(ABC):
             self.positions = trajectory.positions
         else:
             self.file_directory = (
-                os.path.splitext(__file__)[0] + "/../../Files/Trajectories/Custom/"
+                os.path.abspath(
+                    os.path.dirname(__file__) + "/../Files/Trajectories/Custom",
+                )
+                + "/"
             )
         self.generate_full_file_directory()
 
+        # Name of the model's data within the trajectory, part of the cache key
+        self.cache_name = None
+        if getattr(trajectory, "cache_key", None) is not None:
+            self.cache_name = os.path.relpath(
+                self.file_directory,
+                trajectory.file_directory,
+            )
+
+    def data_cache_key(self):
+        """Key of the generated data in the data cache, combining the trajectory
+        parameters, the model id and its directory name. None if the model is
+        not configured with a cached trajectory."""
+        if self.cache_name is None:
+            return None
+        return canonical_hash(self.trajectory.cache_key, self.id, self.cache_name)
+
+    def prefix_cache_key(self):
+        """Key shared by the data of this model on seeded trajectories that only
+        differ by their number of points (see TrajectoryBase.generate_prefix_key).
+        None if the trajectory is not seeded."""
+        prefix_key = getattr(self.trajectory, "prefix_key", None)
+        if self.cache_name is None or prefix_key is None:
+            return None
+        return canonical_hash(prefix_key, self.id, self.cache_name)
+
+    def register_cache(self):
+        key = self.data_cache_key()
+        if key is not None:
+            get_data_cache().register(
+                key,
+                self.file_directory,
+                self.cache_files,
+                parent=self.trajectory.cache_key,
+                family=self.prefix_cache_key(),
+                points=len(self.trajectory.positions),
+            )
+
+    def reuse_prefix(self, chunk_size=None):
+        """Build the values of a seeded trajectory from the cached values of the
+        same model on the largest trajectory of the same family: its first points
+        are copied and only the missing tail, if any, is computed. With
+        chunk_size, the copied prefix seeds the partial files of
+        generate_chunked, which computes the tail with the same checkpoints (an
+        interrupted generation resumes rather than reusing the prefix again).
+
+        Returns:
+            bool: True if the values were assembled and saved
+        """
+        family = self.prefix_cache_key()
+        if family is None:
+            return False
+        if chunk_size is not None and os.path.exists(self.partial_files()[2]):
+            return False
+
+        positions = self.trajectory.positions
+        N = len(positions)
+        members = get_data_cache().find_family(family, exclude=self.data_cache_key())
+        for directory, points, trajectory_directory in members:
+            K = min(points, N)
+            files = [directory + "acceleration.npy", directory + "potential.npy"]
+            if trajectory_directory is None or not all(map(os.path.exists, files)):
+                continue
+
+            # Guard against trajectories generated before seeding was deterministic
+            prefix = load_array(trajectory_directory + "positions.npy", slice(0, K))
+            if len(prefix) != K or not np.array_equal(prefix, positions[:K]):
+                continue
+
+            if self.verbose:
+                print(
+                    f"Reusing {K} of {N} points from "
+                    + os.path.relpath(directory)
+                    + f", computing the remaining {N - K}",
+                )
+            if chunk_size is not None:
+                accelerations, potentials = self.open_partial(N)
+                accelerations[:K] = load_array(files[0], slice(0, K))
+                potentials[:K] = load_array(files[1], slice(0, K))
+                accelerations.flush()
+                potentials.flush()
+                del accelerations, potentials
+                self.write_progress(
+                    self.partial_files()[2],
+                    N,
+                    int(chunk_size),
+                    0,
+                    start=K,
+                )
+                self.generate_chunked(chunk_size)
+                return True
+
+            accelerations = np.zeros((N, 3))
+            potentials = np.zeros((N,))
+            accelerations[:K] = load_array(files[0], slice(0, K))
+            potentials[:K] = load_array(files[1], slice(0, K))
+            if K < N:
+                acc, pot = self.compute_chunk(np.asarray(positions[K:]))
+                accelerations[K:] = np.reshape(acc, (-1, 3))
+                potentials[K:] = np.reshape(pot, (-1,))
+
+            self.accelerations = accelerations
+            self.potentials = potentials
+            self.save()
+            return True
+        return False
+
+    def generation_lease(self, lease=None):
+        """Lease held while generating the values of this directory, so that
+        concurrent processes requesting them (e.g. the workers of a sweep)
+        compute them once (see FileLease). lease is the number of seconds
+        without refresh after which another node takes it over."""
+        return FileLease(self.file_directory + "generation.lock", lease)
+
     def save(self):
-        # Create the directory/file and dump the acceleration and potential if computed
+        # Create the directory/file and store the acceleration and potential if computed
         if not os.path.exists(self.file_directory):
             os.makedirs(self.file_directory)
 
         if self.accelerations is not None:
-            with open(self.file_directory + "acceleration.data", "wb") as f:
-                pickle.dump(self.accelerations, f)
+            save_array(self.file_directory + "acceleration.npy", self.accelerations)
 
         if self.potentials is not None:
-            with open(self.file_directory + "potential.data", "wb") as f:
-                pickle.dump(self.potentials, f)
+            save_array(self.file_directory + "potential.npy", self.potentials)
+        self.register_cache()
         return
 
-    def load(self, override=False):
+    def saved_file(self, name):
+        """Path of the stored array name.npy, converting a name.data pickle left
+        by earlier versions on first access. None if neither exists."""
+        file = self.file_directory + name + ".npy"
+        if os.path.exists(file) or migrate_pickle(
+            self.file_directory + name + ".data",
+            [file],
+        ):
+            return file
+        return None
+
+    def saved_values(self):
+        "Whether both the accelerations and the potentials are stored"
+        return all(
+            self.saved_file(name) is not None for name in ["acceleration", "potential"]
+        )
+
+    def load_saved(self, name, rows=None, columns=None):
+        """Memory map a stored acceleration or potential array without generating
+        it, optionally restricted to a row range and / or columns (see
+        ArrayStorage.load_array)
+
+        Args:
+            name (str): "acceleration" or "potential"
+            rows (slice or array, optional): rows to load. Defaults to all.
+            columns (int, slice or array, optional): columns to load. Defaults to
+                all.
+
+        Returns:
+            np.memmap: the stored values, or None if they were never generated
+        """
+        file = self.saved_file(name)
+        if file is None:
+            return None
+        return load_array(file, rows, columns)
+
+    def load(self, override=False, chunk_size=None, lease=None):
         """Load saved acceleration and potential values for a given trajectory / distribution, or
         generate them if they dont exist
 
         Args:
             override (bool, optional): Flag determining if the acceleration and potentials should be overwritten. Defaults to False.
+            chunk_size (int, optional): Generate the values in chunks of this many
+                points, checkpointing each chunk so an interrupted generation
+                resumes where it stopped (see generate_chunked). Defaults to None
+                (all points at once).
+            lease (float, optional): seconds after which another node takes over
+                the generation lease if it was not refreshed. The lease is
+                refreshed in the background while the (nogil) kernels run, and
+                between chunks. Defaults to None (FileLease.DEFAULT_LEASE).
 
         Returns:
             GravityModelBase: self
         """
-        self.load_acceleration(override)
-        self.load_potential(override)
+        # Data cached under the same parameters is reused even if the directory
+        # name was formatted differently when it was generated
+        key = self.data_cache_key()
+        if key is not None:
+            cached_directory = get_data_cache().lookup(key)
+            if cached_directory is not None:
+                self.file_directory = cached_directory
+
+        # Missing values are generated by the first process acquiring the lease,
+        # the others find them saved once they acquire it in turn
+        generation = contextlib.nullcontext()
+        if override or not self.saved_values():
+            generation = self.generation_lease(lease)
+
+        with generation:
+            if not override and not self.saved_values():
+                self.reuse_prefix(chunk_size)
+
+            if chunk_size is not None:
+                self.generate_chunked(chunk_size, override)
+                override = False
+
+            self.load_acceleration(override)
+            self.load_potential(override)
+        self.register_cache()
         return self
 
+    def compute_chunk(self, positions):
+        "Accelerations and potentials of a subset of the trajectory positions"
+        if hasattr(self, "compute_batch"):
+            return self.compute_batch(positions)
+
+        # compute_acceleration of the remaining models stores both values
+        self.compute_acceleration(positions)
+        return self.accelerations, self.potentials
+
+    def compute_chunks(self, positions, chunk_size, start=0, first=0):
+        """Compute the values of positions[start:] in chunks of chunk_size points,
+        from chunk first on, yielding the index, rows, accelerations (n x 3) and
+        potentials (n,) of each chunk. The leases held by this process are
+        refreshed after every chunk (see FileLease.refresh_held)."""
+        N = len(positions)
+        n_chunks = (N - start + chunk_size - 1) // chunk_size
+        for i in range(first, n_chunks):
+            rows = slice(
+                start + i * chunk_size,
+                min(start + (i + 1) * chunk_size, N),
+            )
+            acc, pot = self.compute_chunk(np.asarray(positions[rows]))
+            FileLease.refresh_held()
+            yield i, rows, np.reshape(acc, (-1, 3)), np.reshape(pot, (-1,))
+
+    def partial_files(self):
+        "Partial acceleration, potential and progress files of generate_chunked"
+        return [
+            self.file_directory + "acceleration.partial.npy",
+            self.file_directory + "potential.partial.npy",
+            self.file_directory + "generation_progress.json",
+        ]
+
+    def open_partial(self, points):
+        "Create the partial acceleration and potential files for points values"
+        os.makedirs(self.file_directory, exist_ok=True)
+        acc_file, pot_file, _ = self.partial_files()
+        accelerations = np.lib.format.open_memmap(
+            acc_file,
+            mode="w+",
+            dtype="<f8",
+            shape=(points, 3),
+        )
+        potentials = np.lib.format.open_memmap(
+            pot_file,
+            mode="w+",
+            dtype="<f8",
+            shape=(points,),
+        )
+        return accelerations, potentials
+
+    def read_progress(self, points, chunk_size):
+        """Progress record of an interrupted generation of points values in chunks
+        of chunk_size, None if there is none (or it doesn't match)"""
+        acc_file, pot_file, progress_file = self.partial_files()
+        if not all(map(os.path.exists, [acc_file, pot_file, progress_file])):
+            return None
+        with open(progress_file, "r") as f:
+            progress = json.load(f)
+        if progress["points"] != points or progress["chunk_size"] != chunk_size:
+            return None
+        progress.setdefault("start", 0)
+        return progress
+
+    def generate_chunked(self, chunk_size, override=False):
+        """Generate the accelerations and potentials of the trajectory chunk by
+        chunk. Each finished chunk is written into acceleration.partial.npy /
+        potential.partial.npy and recorded in generation_progress.json, so
+        a job interrupted (e.g. by a wall-clock limit) resumes from the first
+        incomplete chunk when rerun with the same chunk_size. The partial files
+        are moved into place once every chunk is done. Rows before the start
+        recorded in the progress (e.g. a prefix copied by reuse_prefix) are
+        already filled.
+
+        Args:
+            chunk_size (int): number of points per chunk
+            override (bool, optional): Regenerate the values from scratch even if
+                they (or some of their chunks) exist. Defaults to False.
+        """
+        if not override and self.saved_values():
+            return
+
+        positions = self.trajectory.positions
+        N = len(positions)
+        chunk_size = int(chunk_size)
+        acc_file, pot_file, progress_file = self.partial_files()
+
+        progress = None if override else self.read_progress(N, chunk_size)
+        if progress is not None:
+            start, completed = progress["start"], progress["completed"]
+            accelerations = np.load(acc_file, mmap_mode="r+")
+            potentials = np.load(pot_file, mmap_mode="r+")
+        else:
+            start, completed = 0, 0
+            accelerations, potentials = self.open_partial(N)
+
+        n_chunks = (N - start + chunk_size - 1) // chunk_size
+        if completed > 0 and self.verbose:
+            print(f"Resuming generation at chunk {completed + 1}/{n_chunks}")
+
+        t_start = time.perf_counter()
+        for i, rows, acc, pot in self.compute_chunks(
+            positions,
+            chunk_size,
+            start,
+            completed,
+        ):
+            accelerations[rows] = acc
+            potentials[rows] = pot
+            accelerations.flush()
+            potentials.flush()
+            self.write_progress(progress_file, N, chunk_size, i + 1, start)
+
+            if self.verbose:
+                elapsed = time.perf_counter() - t_start
+                n_points = rows.stop - rows.start
+                print(
+                    f"Chunk {i + 1}/{n_chunks}: {n_points} points in "
+                    f"{elapsed:.2f} s ({n_points / max(elapsed, 1e-12):.1f} points/s), "
+                    f"{100.0 * rows.stop / N:.1f}% complete",
+                )
+            t_start = time.perf_counter()
+
+        del accelerations, potentials
+        os.replace(acc_file, self.file_directory + "acceleration.npy")
+        os.replace(pot_file, self.file_directory + "potential.npy")
+        os.remove(progress_file)
+        self.accelerations = load_array(self.file_directory + "acceleration.npy")
+        self.potentials = load_array(self.file_directory + "potential.npy")
+        self.register_cache()
+
+    def write_progress(self, progress_file, points, chunk_size, completed, start=0):
+        # Write to a temporary file first so a partial record is never picked up
+        progress = {
+            "points": points,
+            "chunk_size": chunk_size,
+            "completed": completed,
+            "start": start,
+        }
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(progress_file),
+            suffix=".tmp",
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, progress_file)
+
+    def shard_rows(self, shard, n_shards):
+        "Rows of the trajectory belonging to a shard (contiguous, sizes within 1)"
+        N = len(self.trajectory.positions)
+        return slice(N * shard // n_shards, N * (shard + 1) // n_shards)
+
+    def shard_files(self, shard, n_shards):
+        "Acceleration and potential files of a shard"
+        directory = self.file_directory + f"shards_{n_shards}/"
+        return [
+            directory + f"acceleration_{shard:05d}.npy",
+            directory + f"potential_{shard:05d}.npy",
+        ]
+
+    def generate_shard(
+        self,
+        shard,
+        n_shards,
+        override=False,
+        blocking=True,
+        lease=None,
+        chunk_size=None,
+    ):
+        """Compute the accelerations and potentials of one shard of the trajectory
+        (see shard_rows) and store them in the shard directory, unless they exist.
+        Any process sharing the file system can compute any shard; a lease on the
+        shard ensures only one computes it at a time. The shard is computed in
+        chunks, between which the lease is refreshed, so another process does not
+        take it over however long the shard takes.
+
+        Args:
+            shard (int): index of the shard, in [0, n_shards)
+            n_shards (int): number of shards the trajectory is split into
+            override (bool, optional): Recompute the shard even if it exists.
+                Defaults to False.
+            blocking (bool, optional): Wait for another process computing the
+                shard rather than returning. Defaults to True.
+            lease (float, optional): seconds after which another process takes
+                over the shard lease if it was not refreshed. Defaults to None
+                (FileLease.DEFAULT_LEASE).
+            chunk_size (int, optional): points per kernel call. Defaults to None
+                (SHARD_CHUNK_SIZE).
+
+        Returns:
+            bool: False if another process is computing the shard (not blocking)
+        """
+        acc_file, pot_file = self.shard_files(shard, n_shards)
+        if not override and os.path.exists(acc_file) and os.path.exists(pot_file):
+            return True
+
+        lease = FileLease(
+            os.path.dirname(acc_file) + f"/shard_{shard:05d}.lock",
+            lease,
+        )
+        if not lease.acquire(blocking):
+            return False
+        try:
+            # Computed by another process while waiting for the lease
+            if not override and os.path.exists(acc_file) and os.path.exists(pot_file):
+                return True
+
+            rows = self.shard_rows(shard, n_shards)
+            positions = self.trajectory.positions[rows]
+            accelerations = np.zeros((len(positions), 3))
+            potentials = np.zeros((len(positions),))
+            chunk_size = SHARD_CHUNK_SIZE if chunk_size is None else int(chunk_size)
+            start = time.perf_counter()
+            for _, chunk, acc, pot in self.compute_chunks(positions, chunk_size):
+                accelerations[chunk] = acc
+                potentials[chunk] = pot
+
+            # The acceleration is written last, its presence marks a complete shard
+            save_array(pot_file, potentials)
+            save_array(acc_file, accelerations)
+        finally:
+            lease.release()
+        if self.verbose:
+            elapsed = time.perf_counter() - start
+            n_points = rows.stop - rows.start
+            print(
+                f"Shard {shard + 1}/{n_shards}: {n_points} points in "
+                f"{elapsed:.2f} s ({n_points / max(elapsed, 1e-12):.1f} points/s)",
+            )
+        return True
+
+    def missing_shards(self, n_shards):
+        return [
+            shard
+            for shard in range(n_shards)
+            if not all(map(os.path.exists, self.shard_files(shard, n_shards)))
+        ]
+
+    def merge_shards(self, n_shards, lease=None):
+        """Concatenate the shards, in shard order, into the acceleration and
+        potential files once every shard exists. The result does not depend on
+        which process computed which shard or on the order they finished.
+
+        Returns:
+            bool: True if the merged values are stored
+        """
+        if self.saved_values():
+            return True
+        if self.missing_shards(n_shards):
+            return False
+
+        with self.generation_lease(lease):
+            if self.saved_values():
+                return True
+            try:
+                files = [self.shard_files(i, n_shards) for i in range(n_shards)]
+                accelerations = np.concatenate([load_array(acc) for acc, _ in files])
+                potentials = np.concatenate([load_array(pot) for _, pot in files])
+            except FileNotFoundError:
+                # Merged and removed by another process in the meantime
+                return self.saved_values()
+
+            save_array(self.file_directory + "potential.npy", potentials)
+            save_array(self.file_directory + "acceleration.npy", accelerations)
+        shutil.rmtree(self.file_directory + f"shards_{n_shards}/", ignore_errors=True)
+        self.register_cache()
+        return True
+
+    def wait_for_shards(
+        self,
+        n_shards,
+        poll_interval=10.0,
+        lease=None,
+        chunk_size=None,
+    ):
+        """Merge the shards once they all exist. Meanwhile, compute the missing
+        shards whose lease no other process holds, e.g. those of a task that has
+        not started yet or that stopped (its lease is then taken over)."""
+        while not self.merge_shards(n_shards, lease):
+            for shard in self.missing_shards(n_shards):
+                if self.saved_values():
+                    break
+                self.generate_shard(
+                    shard,
+                    n_shards,
+                    blocking=False,
+                    lease=lease,
+                    chunk_size=chunk_size,
+                )
+
+            missing = self.missing_shards(n_shards)
+            if missing and not self.saved_values():
+                if self.verbose:
+                    print(f"Waiting for shards {missing}")
+                time.sleep(poll_interval)
+
+    def discard_values(self, n_shards=None):
+        """Remove the stored accelerations and potentials, including pickles left
+        by earlier versions, and the shards of an n_shards generation"""
+        for name in ["acceleration", "potential"]:
+            for extension in [".npy", ".data"]:
+                if os.path.exists(self.file_directory + name + extension):
+                    os.remove(self.file_directory + name + extension)
+        if n_shards is not None:
+            shutil.rmtree(
+                self.file_directory + f"shards_{n_shards}/",
+                ignore_errors=True,
+            )
+
+    def override_sharded(self, n_shards, run_id=None, lease=None):
+        """Discard the stored values and shards before a sharded generation. The
+        processes of a run share its run_id, recorded in override_run, and only
+        the first of them discards anything: a process starting after the others
+        merged their shards keeps the new values.
+
+        Returns:
+            bool: True if the values were discarded by this process
+        """
+        run_file = self.file_directory + "override_run"
+        with self.generation_lease(lease):
+            if run_id is not None and os.path.exists(run_file):
+                with open(run_file, "r") as f:
+                    if f.read() == str(run_id):
+                        return False
+
+            self.discard_values(n_shards)
+            if run_id is not None:
+                fd, tmp_path = tempfile.mkstemp(dir=self.file_directory, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    f.write(str(run_id))
+                os.replace(tmp_path, run_file)
+        return True
+
+    def generate_sharded(
+        self,
+        n_shards,
+        shard=None,
+        processes=None,
+        override=False,
+        poll_interval=10.0,
+        run_id=None,
+        lease=None,
+        chunk_size=None,
+    ):
+        """Generate the accelerations and potentials of the trajectory split into
+        n_shards contiguous shards that are computed independently and merged
+        deterministically (see merge_shards).
+
+        Without shard, this process computes every missing shard, across a pool
+        of processes workers when processes > 1. With shard (e.g. the index of a
+        SLURM task, see slurm_utils.get_shard_index), it computes that shard first.
+        Either way, it then computes the shards no other process is working on
+        until every shard exists (see wait_for_shards).
+
+        Args:
+            n_shards (int): number of shards
+            shard (int, optional): the shard computed first by this process.
+                Defaults to None (all shards).
+            processes (int, optional): number of local worker processes. Defaults
+                to None (serial).
+            override (bool, optional): Discard the stored values and shards and
+                generate them again. Defaults to False.
+            poll_interval (float, optional): seconds between checks for the shards
+                of other processes. Defaults to 10.
+            run_id (str, optional): identifier shared by the processes generating
+                the shards together (e.g. slurm_utils.get_run_id), so that an
+                override only discards data once per run (see override_sharded).
+                Required to override with several processes. Defaults to None.
+            lease (float, optional): seconds after which another process takes
+                over a lease that was not refreshed. Defaults to None
+                (FileLease.DEFAULT_LEASE).
+            chunk_size (int, optional): points per kernel call within a shard,
+                the shard leases are refreshed between calls. Defaults to None
+                (SHARD_CHUNK_SIZE).
+        """
+        n_shards = int(n_shards)
+        if override:
+            self.override_sharded(n_shards, run_id, lease)
+        if self.saved_values():
+            return
+
+        if shard is not None:
+            self.generate_shard(
+                int(shard),
+                n_shards,
+                lease=lease,
+                chunk_size=chunk_size,
+            )
+            self.wait_for_shards(n_shards, poll_interval, lease, chunk_size)
+            return
+
+        shards = self.missing_shards(n_shards)
+        processes = 1 if processes is None else min(int(processes), len(shards))
+        if processes > 1:
+            # Spawned rather than forked workers, the numba threading layers are
+            # not all fork safe
+            n_threads = max(get_num_threads() // processes, 1)
+            with mp.get_context("spawn").Pool(
+                processes,
+                initializer=init_shard_worker,
+                initargs=(self, n_threads),
+            ) as pool:
+                pool.map(
+                    generate_shard_worker,
+                    [(shard, n_shards, False, lease, chunk_size) for shard in shards],
+                    chunksize=1,
+                )
+        else:
+            for shard in shards:
+                self.generate_shard(
+                    shard,
+                    n_shards,
+                    lease=lease,
+                    chunk_size=chunk_size,
+                )
+        self.wait_for_shards(n_shards, poll_interval, lease, chunk_size)
+
     def load_acceleration(self, override=False):
         # Check if the file exists and either load the acceleration or generate it
-        if (
-            os.path.exists(self.file_directory + "acceleration.data")
-            and override is False
-        ):
+        if override is False and self.saved_file("acceleration") is not None:
             if self.verbose:
                 print(
-                    "Found existing acceleration.data at "
+                    "Found existing acceleration.npy at "
                     + os.path.relpath(self.file_directory),
                 )
-            with open(self.file_directory + "acceleration.data", "rb") as f:
-                self.accelerations = pickle.load(f)
-                return self.accelerations
+            self.accelerations = self.load_saved("acceleration")
+            return self.accelerations
         else:
             if self.verbose:
                 print(
@@ -117,15 +756,14 @@ class GravityModelBase(ABC):
 
     def load_potential(self, override=False):
         # Check if the file exists and either load the potential or generate it
-        if os.path.exists(self.file_directory + "potential.data") and override is False:
+        if override is False and self.saved_file("potential") is not None:
             if self.verbose:
                 print(
-                    "Found existing potential.data at "
+                    "Found existing potential.npy at "
                     + os.path.relpath(self.file_directory),
                 )
-            with open(self.file_directory + "potential.data", "rb") as f:
-                self.potentials = pickle.load(f)
-                return self.potentials
+            self.potentials = self.load_saved("potential")
+            return self.potentials
         else:
             if self.verbose:
                 print("Generating potential at " + os.path.relpath(self.file_directory))
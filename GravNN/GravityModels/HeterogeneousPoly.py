@@ -4,14 +4,21 @@ import os
 
 import numpy as np
 
-from GravNN.GravityModels.GravityModelBase import GravityModelBase
+from GravNN.GravityModels.CompositeGravityModel import (
+    Component,
+    CompositeGravityModel,
+)
 from GravNN.GravityModels.PointMass import PointMass
 from GravNN.GravityModels.Polyhedral import Polyhedral
 from GravNN.Support.PathTransformations import make_windows_path_posix
+from GravNN.Support.slurm_utils import get_run_id, get_shard_index
 
 
 def get_hetero_poly_data(trajectory, obj_shape_file, **kwargs):
     override = bool(kwargs.get("override", [False])[0])
+    chunk_size = kwargs.get("chunk_size", [None])[0]
+    lease = kwargs.get("lease", [None])[0]
+    n_shards = kwargs.get("n_shards", [None])[0]
     remove_point_mass = bool(kwargs.get("remove_point_mass", [False])[0])
 
     obj_shape_file = make_windows_path_posix(obj_shape_file)
@@ -22,7 +29,18 @@ def get_hetero_poly_data(trajectory, obj_shape_file, **kwargs):
         trajectory=trajectory,
     )
 
-    poly_r0_gm.load(override=override)
+    if n_shards is not None:
+        poly_r0_gm.generate_sharded(
+            n_shards,
+            shard=kwargs.get("shard_index", [get_shard_index()])[0],
+            processes=kwargs.get("shard_processes", [None])[0],
+            override=override,
+            run_id=kwargs.get("shard_run_id", [get_run_id()])[0],
+            lease=lease,
+            chunk_size=chunk_size,
+        )
+        override = False
+    poly_r0_gm.load(override=override, chunk_size=chunk_size, lease=lease)
 
     x = poly_r0_gm.positions  # position (N x 3)
     a = poly_r0_gm.accelerations
@@ -116,22 +134,35 @@ class Heterogeneity:
     r_offset: np.ndarray
 
 
-class HeterogeneousPoly(GravityModelBase):
+class HeterogeneousPoly(CompositeGravityModel):
     def __init__(self, celestial_body, obj_file, heterogeneities, trajectory=None):
+        """Constant density polyhedral model plus point masses at fixed offsets.
+        The polyhedral part is cached by the composite, so changing the point
+        masses only re-evaluates the point masses.
+
+        Args:
+            celestial_body (CelestialBody): Body for gravity calc
+            obj_file (str): path to shape model of the body
+            heterogeneities (list): Heterogeneity of each point mass
+            trajectory (TrajectoryBase, optional): Trajectory / distribution for which
+                the gravity measurements should be computed. Defaults to None.
+        """
         self.homogeneous_poly = Polyhedral(celestial_body, obj_file, trajectory)
-        self.planet = celestial_body
         self.obj_file = obj_file
         self.point_mass_list = []
         self.offset_list = []
 
+        components = [Component(self.homogeneous_poly)]
         for heterogeneity in heterogeneities:
             self.point_mass_list.append(heterogeneity.model)
             self.offset_list.append(heterogeneity.r_offset)
+            components.append(Component(heterogeneity.model, heterogeneity.r_offset))
 
-        homo_id = self.homogeneous_poly.id
+        super().__init__(celestial_body, components, trajectory)
 
         # specify the lists as args to make unique hash.
-        super().__init__(
+        homo_id = self.homogeneous_poly.id
+        self.id = self.generate_hash(
             celestial_body,
             obj_file,
             homo_id,
@@ -139,11 +170,11 @@ class HeterogeneousPoly(GravityModelBase):
             self.point_mass_list,
             trajectory,
         )
-        self.configure(trajectory)
 
     def add_point_mass(self, point_mass, r_offset):
         self.point_mass_list.append(point_mass)
         self.offset_list.append(r_offset)
+        self.add_component(Component(point_mass, r_offset))
 
     def generate_full_file_directory(self):
         # unique identifier takes the mu + offset of each point mass
@@ -156,69 +187,6 @@ class HeterogeneousPoly(GravityModelBase):
             unique_str += f"{mu_str}_{offset_str}_"
         self.file_directory += f"{class_name}_{obj_file}_{unique_str}/"
 
-    def load(self, override=False):
-        # If heterogeneous model exists, load it
-        data_exists = os.path.exists(self.file_directory + "acceleration.data")
-        if data_exists:
-            # you need to load the homogeneous solution
-            self.homogeneous_poly.trajectory = self.trajectory
-            self.homogeneous_poly.configure(self.trajectory)
-            self.homogeneous_poly.load()
-
-            # now load the heterogeneous solution
-            super().load(override)
-
-        # If not, generate / load the homogeneous data first,
-        # then add point mass contributions
-        elif not data_exists:
-            data_dir = os.path.relpath(self.file_directory)
-            print(f"Generating accelerations + potentials at {data_dir}")
-
-            self.homogeneous_poly.load()
-            accelerations = self.homogeneous_poly.accelerations
-            potentials = self.homogeneous_poly.potentials
-
-            # add the point mass contributions to the homogeneous solution
-            positions = self.positions
-            for i in range(len(self.point_mass_list)):
-                r_offset = np.array(self.offset_list[i]).reshape((-1, 3))
-                x_pm = positions - r_offset
-                x_pm_2D = x_pm.reshape((-1, 3))
-                u_pm = self.point_mass_list[i].compute_potential(x_pm_2D)
-                a_pm = self.point_mass_list[i].compute_acceleration(x_pm_2D)
-                accelerations += a_pm
-                potentials += u_pm
-
-            self.accelerations = accelerations
-            self.potentials = potentials
-            self.save()
-
-    def compute_acceleration(self, positions=None):
-        if positions is None:
-            positions = self.trajectory.positions
-
-        a_poly = self.homogeneous_poly.compute_acceleration(positions.reshape((-1, 3)))
-
-        for i in range(len(self.point_mass_list)):
-            r_offset = np.array(self.offset_list[i]).reshape((-1, 3))
-            x_pm = positions - r_offset
-            a_pm = self.point_mass_list[i].compute_acceleration(x_pm.reshape((-1, 3)))
-            a_poly += a_pm
-        return a_poly
-
-    def compute_potential(self, positions=None):
-        if positions is None:
-            positions = self.trajectory.positions
-
-        u_poly = self.homogeneous_poly.compute_potential(positions)
-
-        for i in range(len(self.point_mass_list)):
-            r_offset = self.offset_list[i]
-            x_pm = positions - r_offset
-            u_pm = self.point_mass_list[i].compute_potential(x_pm)
-            u_poly += u_pm
-        return u_poly
-
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
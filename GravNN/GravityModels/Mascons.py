@@ -5,7 +5,7 @@ import numpy as np
 import GravNN
 from GravNN.CelestialBodies.Asteroids import Eros
 from GravNN.GravityModels.GravityModelBase import GravityModelBase
-from GravNN.Support.transformations import cart2sph
+from GravNN.GravityModels.PointMass import compute_point_masses
 
 
 def get_mascons_data(trajectory, gravity_file, **kwargs):
@@ -24,7 +24,7 @@ def get_mascons_data(trajectory, gravity_file, **kwargs):
 
 
 class Mascons(GravityModelBase):
-    def __init__(self, celestial_body, mass_csv, trajectory=None):
+    def __init__(self, celestial_body, mass_csv, trajectory=None, parallel=True):
         """Gravity model that only produces accelerations and potentials
         as if there were only a point mass.
 
@@ -32,11 +32,19 @@ class Mascons(GravityModelBase):
             celestial_body (CelestialBody): body used to generate gravity measurements
             trajectory (TrajectoryBase, optional): trajectory for which gravity
             measurements must be produced. Defaults to None.
+            parallel (bool, optional): Evaluate the positions across the available
+                threads rather than serially. Defaults to True.
         """
-        super().__init__(celestial_body, mass_csv, trajectory=trajectory)
+        super().__init__(
+            celestial_body,
+            mass_csv,
+            trajectory=trajectory,
+            parallel=parallel,
+        )
         self.celestial_body = celestial_body
         self.mu = celestial_body.mu
         self.mass_csv = mass_csv
+        self.parallel = parallel
         self.read_mass_csv()
         self.configure(trajectory)
 
@@ -69,10 +77,7 @@ class Mascons(GravityModelBase):
         if positions is None:
             positions = self.trajectory.positions
 
-        self.accelerations = np.zeros(positions.shape)
-        for i in range(len(self.accelerations)):
-            self.accelerations[i] = self.compute_acceleration_value(positions[i])
-
+        self.compute_batch(positions)
         return self.accelerations
 
     def compute_potential(self, positions=None):
@@ -80,13 +85,21 @@ class Mascons(GravityModelBase):
         if positions is None:
             positions = self.trajectory.positions
 
-        positions = cart2sph(positions)
-        self.potentials = np.zeros(len(positions))
-        for i in range(len(self.potentials)):
-            self.potentials[i] = self.compute_potential_value(positions[i])
-
+        self.compute_batch(positions)
         return self.potentials
 
+    def compute_batch(self, positions):
+        "Compute the accelerations and potentials of all positions in one call"
+        accelerations, potentials = compute_point_masses(
+            positions,
+            self.masses_position,
+            self.masses_mu,
+            parallel=self.parallel,
+        )
+        self.accelerations = accelerations.reshape(np.shape(positions))
+        self.potentials = potentials
+        return self.accelerations, self.potentials
+
     def compute_acceleration_value(self, position):
         # remember that a = -dU/dx
         # U = -mu/r
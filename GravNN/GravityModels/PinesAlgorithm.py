@@ -1,10 +1,13 @@
-import multiprocessing as mp
-from functools import partial
-
 import numpy as np
-from numba import njit
+from numba import get_num_threads, njit, prange
 
-from GravNN.Support.slurm_utils import get_available_cores
+from GravNN.GravityModels.SHCoefficients import (
+    as_packed,
+    lm_index,
+    n_coefficients,
+    order_index,
+    to_order_major,
+)
 
 
 def getK(x):
@@ -12,27 +15,29 @@ def getK(x):
 
 
 def compute_n_matrices(N):
-    n1 = np.ones((N + 2, N + 2)) * np.nan
-    n2 = np.ones((N + 2, N + 2)) * np.nan
-    n1q = np.ones((N + 2, N + 2)) * np.nan
-    n2q = np.ones((N + 2, N + 2)) * np.nan
+    """Normalization tables of the Pines recursion for degrees <= N+1, packed
+    lower-triangular (see SHCoefficients.lm_index). Unused entries are NaN."""
+    n1 = np.ones((n_coefficients(N + 1),)) * np.nan
+    n2 = np.ones((n_coefficients(N + 1),)) * np.nan
+    n1q = np.ones((n_coefficients(N + 1),)) * np.nan
+    n2q = np.ones((n_coefficients(N + 1),)) * np.nan
 
     for l in range(0, N + 2):  # noqa: E741
         for m in range(0, l + 1):
             if l >= m + 2:
-                n1[l][m] = np.sqrt(
+                n1[lm_index(l, m)] = np.sqrt(
                     ((2.0 * l + 1.0) * (2.0 * l - 1.0)) / ((l - m) * (l + m)),
                 )
-                n2[l][m] = np.sqrt(
+                n2[lm_index(l, m)] = np.sqrt(
                     ((l + m - 1.0) * (2.0 * l + 1.0) * (l - m - 1.0))
                     / ((l + m) * (l - m) * (2.0 * l - 3.0)),
                 )
             if l < N + 1:
                 if m < l:  # this may need to also ensure that l < N+1
-                    n1q[l][m] = np.sqrt(
+                    n1q[lm_index(l, m)] = np.sqrt(
                         ((l - m) * getK(m) * (l + m + 1.0)) / getK(m + 1),
                     )
-                n2q[l][m] = np.sqrt(
+                n2q[lm_index(l, m)] = np.sqrt(
                     ((l + m + 2.0) * (l + m + 1.0) * (2.0 * l + 1.0) * getK(m))
                     / ((2.0 * l + 3.0) * getK(m + 1.0)),
                 )
@@ -40,6 +45,7 @@ def compute_n_matrices(N):
 
 
 def compute_acceleration(positions, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
+    cbar, sbar = as_packed(cbar), as_packed(sbar)
     acc = np.zeros(positions.shape)
     for i in range(0, int(len(positions) / 3)):
         r = np.linalg.norm(positions[3 * i : 3 * (i + 1)])
@@ -66,7 +72,8 @@ def compute_acceleration(positions, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
 
         for m in range(0, N + 2):
             for l in range(m + 2, N + 2):  # noqa: E741
-                aBar[l][m] = u * n1[l][m] * aBar[l - 1][m] - n2[l][m] * aBar[l - 2][m]
+                lm = lm_index(l, m)
+                aBar[l][m] = u * n1[lm] * aBar[l - 1][m] - n2[lm] * aBar[l - 2][m]
             rE[m] = 1.0 if m == 0 else s * rE[m - 1] - t * iM[m - 1]
             iM[m] = 0.0 if m == 0 else s * iM[m - 1] + t * rE[m - 1]
 
@@ -75,16 +82,17 @@ def compute_acceleration(positions, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
             rhol[l + 1] = rho * rhol[l]
             sum_a1, sum_a2, sum_a3, sum_a4 = 0.0, 0.0, 0.0, 0.0
             for m in range(0, l + 1):
-                D = cbar[l][m] * rE[m] + sbar[l][m] * iM[m]
-                E = 0.0 if m == 0 else cbar[l][m] * rE[m - 1] + sbar[l][m] * iM[m - 1]
-                F = 0.0 if m == 0 else sbar[l][m] * rE[m - 1] - cbar[l][m] * iM[m - 1]
+                lm = lm_index(l, m)
+                D = cbar[lm] * rE[m] + sbar[lm] * iM[m]
+                E = 0.0 if m == 0 else cbar[lm] * rE[m - 1] + sbar[lm] * iM[m - 1]
+                F = 0.0 if m == 0 else sbar[lm] * rE[m - 1] - cbar[lm] * iM[m - 1]
 
                 sum_a1 += m * aBar[l][m] * E
                 sum_a2 += m * aBar[l][m] * F
 
                 if m < l:
-                    sum_a3 += n1q[l][m] * aBar[l][m + 1] * D
-                sum_a4 += n2q[l][m] * aBar[l + 1][m + 1] * D
+                    sum_a3 += n1q[lm] * aBar[l][m + 1] * D
+                sum_a4 += n2q[lm] * aBar[l + 1][m + 1] * D
             a1 += rhol[l + 1] / a * sum_a1
             a2 += rhol[l + 1] / a * sum_a2
             a3 += rhol[l + 1] / a * sum_a3
@@ -95,86 +103,11 @@ def compute_acceleration(positions, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
     return acc
 
 
-# @njit(cache=True)
-# def compute_acc(positions, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
-#     acc = np.zeros(positions.shape)
-#     N_total = int(len(positions) / 3)
-#     potential = np.zeros((N_total,))
-#     if N == -1:
-#         return (acc, potential)
-#     for i in prange(0, N_total):
-#         results = compute_acc_thread(
-#             positions[3 * i : 3 * (i + 1)],
-#             N,
-#             mu,
-#             a,
-#             n1,
-#             n2,
-#             n1q,
-#             n2q,
-#             cbar,
-#             sbar,
-#         )
-#         acc[3 * i : 3 * (i + 1)] = results[0]
-#         potential[i] = results[1]
-#     return (acc, potential)
-
-
-def compute_acc(positions, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
-    acc = np.zeros(positions.shape)
-    N_total = int(len(positions) / 3)
-    potential = np.zeros((N_total,))
-    if N == -1:
-        return (acc, potential)
-
-    compute_acc_partial = partial(
-        compute_acc_thread,
-        N=N,
-        mu=mu,
-        a=a,
-        n1=n1,
-        n2=n2,
-        n1q=n1q,
-        n2q=n2q,
-        cbar=cbar,
-        sbar=sbar,
-    )
-    positions_Nx3 = positions.reshape((-1, 3))
-    if len(positions_Nx3) == 1:
-        results = [compute_acc_partial(positions_Nx3[0])]
-    else:
-        cores = get_available_cores()
-        with mp.Pool(processes=cores) as pool:
-            results = pool.map(compute_acc_partial, positions_Nx3)
-
-    for i, result in enumerate(results):
-        acc_output = result[0]
-        pot_output = result[1]
-
-        acc[3 * i : 3 * (i + 1)] = acc_output
-        potential[i] = pot_output
-    return (acc, potential)
-
-
-@njit(cache=True, parallel=False)
-def compute_acc_thread(position, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
-    np.zeros(position.shape)
-    potential = 0.0
-    r = np.linalg.norm(position)
-    [s, t, u] = position / r
-
-    rE = np.zeros((N + 2,))
-    iM = np.zeros((N + 2,))
-
-    rhol = np.zeros((N + 2,))
-
-    aBar = np.zeros((N + 2, N + 2))
+@njit(cache=True)
+def compute_legendre(u, N, n1, n2, aBar):
+    """Fill the lower triangle of the derived Legendre matrix aBar (Pines) for
+    u = z/r. Only entries with m <= l <= N+1 are written."""
     aBar[0, 0] = 1.0
-
-    rho = a / r
-    rhol[0] = mu / r
-    rhol[1] = rhol[0] * rho
-
     for l in range(1, N + 2):  # noqa: E741
         aBar[l][l] = (
             np.sqrt(((2.0 * l + 1.0) * getK(l)) / ((2.0 * l * getK(l - 1))))
@@ -184,35 +117,86 @@ def compute_acc_thread(position, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
 
     for m in range(0, N + 2):
         for l in range(m + 2, N + 2):  # noqa: E741
-            aBar[l][m] = u * n1[l][m] * aBar[l - 1][m] - n2[l][m] * aBar[l - 2][m]
+            lm = lm_index(l, m)
+            aBar[l][m] = u * n1[lm] * aBar[l - 1][m] - n2[lm] * aBar[l - 2][m]
+
+
+@njit(cache=True)
+def compute_lon_terms(s, t, N, rE, iM):
+    """Fill the real (rE) and imaginary (iM) parts of (s + it)^m"""
+    for m in range(0, N + 2):
         rE[m] = 1.0 if m == 0 else s * rE[m - 1] - t * iM[m - 1]
         iM[m] = 0.0 if m == 0 else s * iM[m - 1] + t * rE[m - 1]
 
+
+@njit(cache=True)
+def compute_acc_point(
+    position,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    aBar,
+    rE,
+    iM,
+    rhol,
+    acc,
+    l_min,
+):
+    """Evaluate the Pines algorithm for a single position using caller supplied
+    scratch arrays (aBar, rE, iM, rhol). Only degrees l_min <= l <= N are summed.
+    The acceleration is written into acc and the potential is returned."""
+    potential = 0.0
+    r = np.sqrt(position[0] ** 2 + position[1] ** 2 + position[2] ** 2)
+    s = position[0] / r
+    t = position[1] / r
+    u = position[2] / r
+
+    rho = a / r
+    rhol[0] = mu / r
+    rhol[1] = rhol[0] * rho
+
+    compute_legendre(u, N, n1, n2, aBar)
+    compute_lon_terms(s, t, N, rE, iM)
+
     a1, a2, a3, a4 = 0.0, 0.0, 0.0, 0.0
     for l in range(1, N + 1):  # noqa: E741
         rhol[l + 1] = rho * rhol[l]
+        if l < l_min:
+            continue
         sum_a1, sum_a2, sum_a3, sum_a4 = 0.0, 0.0, 0.0, 0.0
         for m in range(0, l + 1):
-            D = cbar[l][m] * rE[m] + sbar[l][m] * iM[m]
-            E = 0.0 if m == 0 else cbar[l][m] * rE[m - 1] + sbar[l][m] * iM[m - 1]
-            F = 0.0 if m == 0 else sbar[l][m] * rE[m - 1] - cbar[l][m] * iM[m - 1]
+            lm = lm_index(l, m)
+            D = cbar[lm] * rE[m] + sbar[lm] * iM[m]
+            E = 0.0 if m == 0 else cbar[lm] * rE[m - 1] + sbar[lm] * iM[m - 1]
+            F = 0.0 if m == 0 else sbar[lm] * rE[m - 1] - cbar[lm] * iM[m - 1]
 
             sum_a1 += m * aBar[l][m] * E
             sum_a2 += m * aBar[l][m] * F
 
             if m < l:
-                sum_a3 += n1q[l][m] * aBar[l][m + 1] * D
-            sum_a4 += n2q[l][m] * aBar[l + 1][m + 1] * D
+                sum_a3 += n1q[lm] * aBar[l][m + 1] * D
+            sum_a4 += n2q[lm] * aBar[l + 1][m + 1] * D
 
             potential += rhol[l] * aBar[l][m] * D
         a1 += rhol[l + 1] / a * sum_a1
         a2 += rhol[l + 1] / a * sum_a2
         a3 += rhol[l + 1] / a * sum_a3
         a4 -= rhol[l + 1] / a * sum_a4
-    a4 -= rhol[1] / a
 
     # The prior loop doesn't account for the l=0 index
-    potential += rhol[0] * aBar[0][0] * (cbar[0][0] * rE[0] + sbar[0][0] * iM[0])
+    if l_min == 0:
+        a4 -= rhol[1] / a
+        potential += rhol[0] * aBar[0][0] * (cbar[0] * rE[0] + sbar[0] * iM[0])
+
+    acc[0] = a1 + s * a4
+    acc[1] = a2 + t * a4
+    acc[2] = a3 + u * a4
 
     # Note that the original paper computes U and F=dU (as opposed to U and F=-dU)
     # Consequently, F in the paper is actually equal to -a, but all of my calculations
@@ -220,13 +204,1384 @@ def compute_acc_thread(position, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
     # generated by -1, we multiply the potential by -1 because it is used in
     # significantly fewer places and then reconciles the relationship with the
     # produced acceleration.
-    return (np.array([a1, a2, a3]) + np.array([s, t, u]) * a4, -potential)
+    return -potential
+
+
+def compute_acc_blocks(
+    positions,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    l_min,
+    n_blocks,
+):
+    """Compute the acceleration and potential of degrees l_min..N for a flattened
+    (3N,) array of positions. The positions are split into n_blocks contiguous
+    blocks, and the scratch arrays needed by the recursion are allocated once per
+    block rather than once per point. When compiled with parallel=True, the
+    blocks are evaluated concurrently (one block per thread)."""
+    acc = np.zeros(positions.shape)
+    N_total = int(len(positions) / 3)
+    potential = np.zeros((N_total,))
+    if N == -1 or N_total == 0:
+        return (acc, potential)
+
+    n_blocks = max(min(n_blocks, N_total), 1)
+    block_size = (N_total + n_blocks - 1) // n_blocks
+    for b in prange(n_blocks):
+        rE = np.zeros((N + 2,))
+        iM = np.zeros((N + 2,))
+        rhol = np.zeros((N + 2,))
+        aBar = np.zeros((N + 2, N + 2))
+        for i in range(b * block_size, min((b + 1) * block_size, N_total)):
+            potential[i] = compute_acc_point(
+                positions[3 * i : 3 * (i + 1)],
+                N,
+                mu,
+                a,
+                n1,
+                n2,
+                n1q,
+                n2q,
+                cbar,
+                sbar,
+                aBar,
+                rE,
+                iM,
+                rhol,
+                acc[3 * i : 3 * (i + 1)],
+                l_min,
+            )
+    return (acc, potential)
+
+
+def compute_acc(
+    positions,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    parallel=True,
+    deg_removed=-1,
+    return_hessian=False,
+):
+    """Batched Pines evaluation of a flattened (3N,) array of positions.
+
+    Args:
+        n1, n2, n1q, n2q (np.array): packed normalization tables
+            (compute_n_matrices)
+        cbar, sbar (np.array): packed Stokes coefficients (see SHCoefficients).
+            Dense [l][m] arrays are also accepted and packed before evaluation.
+        parallel (bool, optional): Evaluate the positions across all numba threads
+            (one block of positions per thread) or serially. Defaults to True.
+        deg_removed (int, optional): Only sum the degrees deg_removed+1..N. This
+            yields the disturbing field of a model with the first deg_removed
+            degrees removed in a single sweep. Defaults to -1 (full model).
+        return_hessian (bool, optional): also return the analytic gravity
+            gradient tensors d(acc)/d(position) (N, 3, 3), computed in the same
+            pass. Defaults to False.
+
+    Returns:
+        tuple: accelerations (3N,) and potentials (N,) [and hessians (N, 3, 3)]
+    """
+    cbar, sbar = as_packed(cbar), as_packed(sbar)
+    positions = np.ascontiguousarray(positions, dtype=np.float64)
+    l_min = max(deg_removed + 1, 0)
+    if return_hessian:
+        # The second derivatives need the normalization tables of degree N+1
+        if len(n1) < n_coefficients(N + 2):
+            n1, n2, n1q, n2q = compute_n_matrices(N + 1)
+        compute_hessian_blocks = (
+            compute_acc_hessian_blocks_parallel
+            if parallel
+            else compute_acc_hessian_blocks_jit
+        )
+        return compute_hessian_blocks(
+            positions,
+            N,
+            mu,
+            a,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            cbar,
+            sbar,
+            l_min,
+            get_num_threads() if parallel else 1,
+        )
+    if parallel:
+        return compute_acc_blocks_parallel(
+            positions,
+            N,
+            mu,
+            a,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            cbar,
+            sbar,
+            l_min,
+            get_num_threads(),
+        )
+    return compute_acc_blocks_jit(
+        positions,
+        N,
+        mu,
+        a,
+        n1,
+        n2,
+        n1q,
+        n2q,
+        cbar,
+        sbar,
+        l_min,
+        1,
+    )
+
+
+def compute_acc_jit(positions, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
+    return compute_acc(
+        positions,
+        N,
+        mu,
+        a,
+        n1,
+        n2,
+        n1q,
+        n2q,
+        cbar,
+        sbar,
+        parallel=False,
+    )
+
+
+def compute_acc_parallel(positions, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
+    return compute_acc(
+        positions,
+        N,
+        mu,
+        a,
+        n1,
+        n2,
+        n1q,
+        n2q,
+        cbar,
+        sbar,
+        parallel=True,
+    )
+
+
+@njit(cache=True)
+def compute_acc_hessian_point(
+    position,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    aBar,
+    rE,
+    iM,
+    rhol,
+    acc,
+    hessian,
+    l_min,
+):
+    """Variant of compute_acc_point that also writes the gravity gradient tensor
+    d(acc)/d(position) into hessian (3, 3). Differentiating the Pines sums once
+    more only requires the derived Legendre functions of degree N+2, so the
+    normalization tables must come from compute_n_matrices(N + 1) and the scratch
+    arrays must hold N+3 degrees. The tensor is assembled as
+
+        H = B - s c^T - c s^T + f s s^T + h I
+
+    where s is the unit position vector and B, c, f, h are sums over the same
+    (l, m) terms as the acceleration."""
+    potential = 0.0
+    r = np.sqrt(position[0] ** 2 + position[1] ** 2 + position[2] ** 2)
+    s = position[0] / r
+    t = position[1] / r
+    u = position[2] / r
+
+    rho = a / r
+    rhol[0] = mu / r
+    rhol[1] = rhol[0] * rho
+    rhol[2] = rhol[1] * rho
+
+    compute_legendre(u, N + 1, n1, n2, aBar)
+    compute_lon_terms(s, t, N, rE, iM)
+
+    a1, a2, a3, a4 = 0.0, 0.0, 0.0, 0.0
+    bxx, bxy, bxz, byz, bzz = 0.0, 0.0, 0.0, 0.0, 0.0
+    cx, cy, cz, f, h = 0.0, 0.0, 0.0, 0.0, 0.0
+    for l in range(1, N + 1):  # noqa: E741
+        rhol[l + 2] = rho * rhol[l + 1]
+        if l < l_min:
+            continue
+        sum_a1, sum_a2, sum_a3, sum_a4 = 0.0, 0.0, 0.0, 0.0
+        sum_bxx, sum_bxy, sum_bxz, sum_byz, sum_bzz = 0.0, 0.0, 0.0, 0.0, 0.0
+        sum_cx, sum_cy, sum_cz, sum_f = 0.0, 0.0, 0.0, 0.0
+        for m in range(0, l + 1):
+            lm = lm_index(l, m)
+            D = cbar[lm] * rE[m] + sbar[lm] * iM[m]
+            E = 0.0 if m == 0 else cbar[lm] * rE[m - 1] + sbar[lm] * iM[m - 1]
+            F = 0.0 if m == 0 else sbar[lm] * rE[m - 1] - cbar[lm] * iM[m - 1]
+            P = 0.0 if m < 2 else cbar[lm] * rE[m - 2] + sbar[lm] * iM[m - 2]
+            Q = 0.0 if m < 2 else sbar[lm] * rE[m - 2] - cbar[lm] * iM[m - 2]
+
+            # Normalized derived Legendre functions of the shifted (degree, order)
+            lm1 = lm_index(l + 1, m + 1)
+            A_l_m1 = 0.0 if m >= l else n1q[lm] * aBar[l][m + 1]
+            A_l_m2 = 0.0 if m + 2 > l else n1q[lm] * n1q[lm + 1] * aBar[l][m + 2]
+            A_l1_m1 = n2q[lm] * aBar[l + 1][m + 1]
+            A_l1_m2 = 0.0 if m >= l else n2q[lm] * n1q[lm1] * aBar[l + 1][m + 2]
+            A_l2_m2 = n2q[lm] * n2q[lm1] * aBar[l + 2][m + 2]
+
+            sum_a1 += m * aBar[l][m] * E
+            sum_a2 += m * aBar[l][m] * F
+            sum_a3 += A_l_m1 * D
+            sum_a4 += A_l1_m1 * D
+
+            sum_bxx += m * (m - 1) * aBar[l][m] * P
+            sum_bxy += m * (m - 1) * aBar[l][m] * Q
+            sum_bxz += m * A_l_m1 * E
+            sum_byz += m * A_l_m1 * F
+            sum_bzz += A_l_m2 * D
+            sum_cx += m * A_l1_m1 * E
+            sum_cy += m * A_l1_m1 * F
+            sum_cz += A_l1_m2 * D
+            sum_f += A_l2_m2 * D
+
+            potential += rhol[l] * aBar[l][m] * D
+        a1 += rhol[l + 1] / a * sum_a1
+        a2 += rhol[l + 1] / a * sum_a2
+        a3 += rhol[l + 1] / a * sum_a3
+        a4 -= rhol[l + 1] / a * sum_a4
+
+        w = rhol[l + 2] / a**2
+        bxx += w * sum_bxx
+        bxy += w * sum_bxy
+        bxz += w * sum_bxz
+        byz += w * sum_byz
+        bzz += w * sum_bzz
+        cx += w * sum_cx
+        cy += w * sum_cy
+        cz += w * sum_cz
+        f += w * sum_f
+        h -= w * sum_a4
+
+    # The prior loop doesn't account for the l=0 index (point mass)
+    if l_min == 0:
+        a4 -= rhol[1] / a
+        f += 3.0 * rhol[2] / a**2
+        h -= rhol[2] / a**2
+        potential += rhol[0] * aBar[0][0] * (cbar[0] * rE[0] + sbar[0] * iM[0])
+
+    acc[0] = a1 + s * a4
+    acc[1] = a2 + t * a4
+    acc[2] = a3 + u * a4
+
+    hessian[0, 0] = bxx - 2.0 * s * cx + f * s * s + h
+    hessian[1, 1] = -bxx - 2.0 * t * cy + f * t * t + h
+    hessian[2, 2] = bzz - 2.0 * u * cz + f * u * u + h
+    hessian[0, 1] = bxy - s * cy - t * cx + f * s * t
+    hessian[0, 2] = bxz - s * cz - u * cx + f * s * u
+    hessian[1, 2] = byz - t * cz - u * cy + f * t * u
+    hessian[1, 0] = hessian[0, 1]
+    hessian[2, 0] = hessian[0, 2]
+    hessian[2, 1] = hessian[1, 2]
+
+    # See compute_acc_point for the sign of the potential
+    return -potential
+
+
+def compute_acc_hessian_blocks(
+    positions,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    l_min,
+    n_blocks,
+):
+    """compute_acc_blocks with the gravity gradient tensor (N, 3, 3) as an
+    additional output (see compute_acc_hessian_point)."""
+    acc = np.zeros(positions.shape)
+    N_total = int(len(positions) / 3)
+    potential = np.zeros((N_total,))
+    hessian = np.zeros((N_total, 3, 3))
+    if N == -1 or N_total == 0:
+        return (acc, potential, hessian)
+
+    n_blocks = max(min(n_blocks, N_total), 1)
+    block_size = (N_total + n_blocks - 1) // n_blocks
+    for b in prange(n_blocks):
+        rE = np.zeros((N + 2,))
+        iM = np.zeros((N + 2,))
+        rhol = np.zeros((N + 3,))
+        aBar = np.zeros((N + 3, N + 3))
+        for i in range(b * block_size, min((b + 1) * block_size, N_total)):
+            potential[i] = compute_acc_hessian_point(
+                positions[3 * i : 3 * (i + 1)],
+                N,
+                mu,
+                a,
+                n1,
+                n2,
+                n1q,
+                n2q,
+                cbar,
+                sbar,
+                aBar,
+                rE,
+                iM,
+                rhol,
+                acc[3 * i : 3 * (i + 1)],
+                hessian[i],
+                l_min,
+            )
+    return (acc, potential, hessian)
+
+
+def degree_variance_weights(cbar, sbar, N):
+    """Per-degree weights w_l = sqrt((l+1)(2l+1) sum_m (C_lm^2 + S_lm^2)).
+    mu/r^2 (a/r)^l w_l is the RMS (over the sphere of radius r) of the
+    acceleration contributed by degree l of the fully normalized expansion."""
+    weights = np.zeros((N + 1,))
+    for l in range(0, N + 1):  # noqa: E741
+        start, stop = lm_index(l, 0), lm_index(l + 1, 0)
+        sigma2 = np.sum(cbar[start:stop] ** 2 + sbar[start:stop] ** 2)
+        weights[l] = np.sqrt((l + 1) * (2 * l + 1) * sigma2)
+    return weights
+
+
+@njit(cache=True)
+def truncation_degree(r, N, mu, a, weights, tol):
+    """Smallest degree L such that the degree variance estimate of the omitted
+    terms, mu/r^2 sum_{l=L+1}^{N} (a/r)^l w_l, is below tol. The terms are
+    accumulated as logarithms, since (a/r)^l underflows at high degree or far
+    from the body."""
+    if tol <= 0.0:
+        return N
+    log_rho = np.log(a / r)
+    log_scale = np.log(mu / r**2)
+    log_tol = np.log(tol)
+    log_tail = -np.inf
+    for l in range(N, 0, -1):  # noqa: E741
+        if weights[l] <= 0.0:
+            continue
+        log_term = log_scale + l * log_rho + np.log(weights[l])
+        high = max(log_tail, log_term)
+        low = min(log_tail, log_term)
+        log_tail = high + np.log1p(np.exp(low - high))
+        if log_tail >= log_tol:
+            return l
+    return 0
+
+
+def compute_acc_adaptive_blocks(
+    positions,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    weights,
+    tol,
+    l_min,
+    n_blocks,
+):
+    """Same as compute_acc_blocks except that each point stops its degree loop at
+    its own truncation degree. Also returns the degree used for each point."""
+    n_points = len(positions) // 3
+    acc = np.zeros((n_points * 3,))
+    potential = np.zeros((n_points,))
+    degrees = np.zeros((n_points,), dtype=np.int64)
+    if N == -1 or n_points == 0:
+        return acc, potential, degrees
+
+    n_blocks = max(min(n_blocks, n_points), 1)
+    block_size = (n_points + n_blocks - 1) // n_blocks
+    for b in prange(n_blocks):
+        rE = np.zeros((N + 2,))
+        iM = np.zeros((N + 2,))
+        rhol = np.zeros((N + 2,))
+        aBar = np.zeros((N + 2, N + 2))
+        start = b * block_size
+        stop = min(start + block_size, n_points)
+        for i in range(start, stop):
+            position = positions[3 * i : 3 * (i + 1)]
+            r = np.sqrt(position[0] ** 2 + position[1] ** 2 + position[2] ** 2)
+            N_eff = truncation_degree(r, N, mu, a, weights, tol)
+            degrees[i] = N_eff
+            potential[i] = compute_acc_point(
+                position,
+                N_eff,
+                mu,
+                a,
+                n1,
+                n2,
+                n1q,
+                n2q,
+                cbar,
+                sbar,
+                aBar,
+                rE,
+                iM,
+                rhol,
+                acc[3 * i : 3 * (i + 1)],
+                l_min,
+            )
+    return acc, potential, degrees
+
+
+def compute_acc_adaptive(
+    positions,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    tol,
+    parallel=True,
+    deg_removed=-1,
+    return_degrees=False,
+):
+    """Accuracy targeted variant of compute_acc. Each point only sums degrees up to
+    the lowest degree at which the degree variance estimate of the omitted
+    acceleration falls below tol (same units as the acceleration). Points well
+    above the Brillouin sphere therefore only cost a fraction of the full degree.
+
+    Args:
+        tol (float): acceptable (RMS) acceleration error of the truncation
+        return_degrees (bool, optional): also return the degree used per point
+    """
+    cbar, sbar = as_packed(cbar), as_packed(sbar)
+    positions = np.ascontiguousarray(positions, dtype=np.float64)
+    weights = degree_variance_weights(cbar, sbar, N)
+    l_min = max(deg_removed + 1, 0)
+    if parallel:
+        acc, potential, degrees = compute_acc_adaptive_blocks_parallel(
+            positions,
+            N,
+            mu,
+            a,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            cbar,
+            sbar,
+            weights,
+            tol,
+            l_min,
+            get_num_threads(),
+        )
+    else:
+        acc, potential, degrees = compute_acc_adaptive_blocks_jit(
+            positions,
+            N,
+            mu,
+            a,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            cbar,
+            sbar,
+            weights,
+            tol,
+            l_min,
+            1,
+        )
+    if return_degrees:
+        return acc, potential, degrees
+    return acc, potential
+
+
+@njit(cache=True)
+def compute_acc_point_degrees(
+    position,
+    degrees,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    aBar,
+    rE,
+    iM,
+    rhol,
+    acc,
+    potential_out,
+    l_min,
+):
+    """Evaluate the Pines algorithm for a single position and record the partial
+    sums as the degree loop passes each entry of degrees (sorted, unique, and
+    <= N = degrees[-1]). acc[k] and potential_out[k] hold the expansion truncated
+    at degrees[k]."""
+    N = degrees[-1]
+    r = np.sqrt(position[0] ** 2 + position[1] ** 2 + position[2] ** 2)
+    s = position[0] / r
+    t = position[1] / r
+    u = position[2] / r
+
+    rho = a / r
+    rhol[0] = mu / r
+    rhol[1] = rhol[0] * rho
+
+    compute_legendre(u, N, n1, n2, aBar)
+    compute_lon_terms(s, t, N, rE, iM)
+
+    a1, a2, a3, a4 = 0.0, 0.0, 0.0, 0.0
+    potential = 0.0
+    if l_min == 0:
+        a4 -= rhol[1] / a
+        potential += rhol[0] * aBar[0][0] * (cbar[0] * rE[0] + sbar[0] * iM[0])
+
+    k = 0
+    while k < len(degrees) and degrees[k] < 1:
+        acc[k, 0] = a1 + s * a4
+        acc[k, 1] = a2 + t * a4
+        acc[k, 2] = a3 + u * a4
+        potential_out[k] = -potential
+        k += 1
+
+    for l in range(1, N + 1):  # noqa: E741
+        rhol[l + 1] = rho * rhol[l]
+        if l >= l_min:
+            sum_a1, sum_a2, sum_a3, sum_a4 = 0.0, 0.0, 0.0, 0.0
+            for m in range(0, l + 1):
+                lm = lm_index(l, m)
+                D = cbar[lm] * rE[m] + sbar[lm] * iM[m]
+                E = 0.0 if m == 0 else cbar[lm] * rE[m - 1] + sbar[lm] * iM[m - 1]
+                F = 0.0 if m == 0 else sbar[lm] * rE[m - 1] - cbar[lm] * iM[m - 1]
+
+                sum_a1 += m * aBar[l][m] * E
+                sum_a2 += m * aBar[l][m] * F
+
+                if m < l:
+                    sum_a3 += n1q[lm] * aBar[l][m + 1] * D
+                sum_a4 += n2q[lm] * aBar[l + 1][m + 1] * D
+
+                potential += rhol[l] * aBar[l][m] * D
+            a1 += rhol[l + 1] / a * sum_a1
+            a2 += rhol[l + 1] / a * sum_a2
+            a3 += rhol[l + 1] / a * sum_a3
+            a4 -= rhol[l + 1] / a * sum_a4
+
+        while k < len(degrees) and degrees[k] == l:
+            acc[k, 0] = a1 + s * a4
+            acc[k, 1] = a2 + t * a4
+            acc[k, 2] = a3 + u * a4
+            potential_out[k] = -potential
+            k += 1
+
+
+def compute_acc_degrees_blocks(
+    positions,
+    degrees,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    l_min,
+    n_blocks,
+):
+    """Block driver for compute_acc_point_degrees (see compute_acc_blocks)"""
+    N = degrees[-1]
+    N_total = int(len(positions) / 3)
+    acc = np.zeros((len(degrees), len(positions)))
+    potential = np.zeros((len(degrees), N_total))
+    if N_total == 0:
+        return (acc, potential)
+
+    n_blocks = max(min(n_blocks, N_total), 1)
+    block_size = (N_total + n_blocks - 1) // n_blocks
+    for b in prange(n_blocks):
+        rE = np.zeros((N + 2,))
+        iM = np.zeros((N + 2,))
+        rhol = np.zeros((N + 2,))
+        aBar = np.zeros((N + 2, N + 2))
+        for i in range(b * block_size, min((b + 1) * block_size, N_total)):
+            compute_acc_point_degrees(
+                positions[3 * i : 3 * (i + 1)],
+                degrees,
+                mu,
+                a,
+                n1,
+                n2,
+                n1q,
+                n2q,
+                cbar,
+                sbar,
+                aBar,
+                rE,
+                iM,
+                rhol,
+                acc[:, 3 * i : 3 * (i + 1)],
+                potential[:, i],
+                l_min,
+            )
+    return (acc, potential)
+
+
+def compute_acc_degrees(
+    positions,
+    degrees,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    parallel=True,
+    deg_removed=-1,
+):
+    """Evaluate the expansion truncated at each of the requested degrees using a
+    single recursion per position. The normalization (n1, n2, n1q, n2q) and
+    coefficient tables must cover max(degrees).
+
+    Args:
+        positions (np.array): flattened (3N,) array of positions
+        degrees (list): truncation degrees [d1, d2, ...]
+        parallel (bool, optional): Evaluate the positions across all numba
+            threads. Defaults to True.
+        deg_removed (int, optional): Exclude degrees <= deg_removed from every
+            truncation. Defaults to -1.
+
+    Returns:
+        tuple: accelerations (len(degrees), 3N) and potentials (len(degrees), N)
+        ordered like degrees.
+    """
+    cbar, sbar = as_packed(cbar), as_packed(sbar)
+    positions = np.ascontiguousarray(positions, dtype=np.float64)
+    unique_degrees, inverse = np.unique(np.asarray(degrees), return_inverse=True)
+    unique_degrees = unique_degrees.astype(np.int64)
+    l_min = max(deg_removed + 1, 0)
+    if unique_degrees[0] < 0:
+        raise ValueError("Truncation degrees must be non-negative")
+
+    if parallel:
+        kernel, n_blocks = compute_acc_degrees_blocks_parallel, get_num_threads()
+    else:
+        kernel, n_blocks = compute_acc_degrees_blocks_jit, 1
+    acc, potential = kernel(
+        positions,
+        unique_degrees,
+        mu,
+        a,
+        n1,
+        n2,
+        n1q,
+        n2q,
+        cbar,
+        sbar,
+        l_min,
+        n_blocks,
+    )
+    inverse = inverse.reshape((-1,))
+    return (acc[inverse], potential[inverse])
+
+
+@njit(cache=True)
+def compute_angular_sums(
+    direction,
+    N,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    aBar,
+    rE,
+    iM,
+    sums,
+    l_min,
+):
+    """Per-degree angular sums of the Pines algorithm for a unit direction. These
+    don't depend on the radius, which only enters through rhol, so
+
+        a_k = sum_l rhol[l + 1] / a * sums[l, k]  (k = 0..3 -> a1, a2, a3, a4)
+        U = sum_l rhol[l] * sums[l, 4]
+    """
+    s = direction[0]
+    t = direction[1]
+    u = direction[2]
+
+    compute_legendre(u, N, n1, n2, aBar)
+    compute_lon_terms(s, t, N, rE, iM)
+
+    sums[:, :] = 0.0
+    for l in range(max(l_min, 1), N + 1):  # noqa: E741
+        for m in range(0, l + 1):
+            lm = lm_index(l, m)
+            D = cbar[lm] * rE[m] + sbar[lm] * iM[m]
+            E = 0.0 if m == 0 else cbar[lm] * rE[m - 1] + sbar[lm] * iM[m - 1]
+            F = 0.0 if m == 0 else sbar[lm] * rE[m - 1] - cbar[lm] * iM[m - 1]
+
+            sums[l, 0] += m * aBar[l][m] * E
+            sums[l, 1] += m * aBar[l][m] * F
+            if m < l:
+                sums[l, 2] += n1q[lm] * aBar[l][m + 1] * D
+            sums[l, 3] -= n2q[lm] * aBar[l + 1][m + 1] * D
+            sums[l, 4] += aBar[l][m] * D
+
+    if l_min == 0:
+        sums[0, 3] = -1.0
+        sums[0, 4] = aBar[0][0] * (cbar[0] * rE[0] + sbar[0] * iM[0])
+
+
+def compute_acc_shells_blocks(
+    directions,
+    rhol,
+    N,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    l_min,
+    n_blocks,
+):
+    """Evaluate every direction at every radius. rhol holds the radial factors
+    for each radius (n_radii x N+2), so the angular sums are computed once per
+    direction and each radius only costs an O(N) sum over degree."""
+    n_dir = len(directions)
+    n_radii = len(rhol)
+    acc = np.zeros((n_radii, n_dir, 3))
+    potential = np.zeros((n_radii, n_dir))
+    if N == -1 or n_dir == 0:
+        return acc, potential
+
+    n_blocks = max(min(n_blocks, n_dir), 1)
+    block_size = (n_dir + n_blocks - 1) // n_blocks
+    for b in prange(n_blocks):
+        aBar = np.zeros((N + 2, N + 2))
+        rE = np.zeros((N + 2,))
+        iM = np.zeros((N + 2,))
+        sums = np.zeros((N + 1, 5))
+        start = b * block_size
+        stop = min(start + block_size, n_dir)
+        for i in range(start, stop):
+            direction = directions[i]
+            compute_angular_sums(
+                direction,
+                N,
+                n1,
+                n2,
+                n1q,
+                n2q,
+                cbar,
+                sbar,
+                aBar,
+                rE,
+                iM,
+                sums,
+                l_min,
+            )
+            for k in range(n_radii):
+                a1, a2, a3, a4, U = 0.0, 0.0, 0.0, 0.0, 0.0
+                for l in range(0, N + 1):  # noqa: E741
+                    rho_a = rhol[k, l + 1] / a
+                    a1 += rho_a * sums[l, 0]
+                    a2 += rho_a * sums[l, 1]
+                    a3 += rho_a * sums[l, 2]
+                    a4 += rho_a * sums[l, 3]
+                    U += rhol[k, l] * sums[l, 4]
+                acc[k, i, 0] = a1 + direction[0] * a4
+                acc[k, i, 1] = a2 + direction[1] * a4
+                acc[k, i, 2] = a3 + direction[2] * a4
+                potential[k, i] = -U
+    return acc, potential
+
+
+def compute_acc_shells(
+    directions,
+    radii,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    parallel=True,
+    deg_removed=-1,
+):
+    """Evaluate the same set of directions on several spherical shells (e.g. an
+    altitude sweep of a FibonacciDist). The Legendre and longitude terms only
+    depend on the direction, so they are computed once and reused for every
+    radius.
+
+    Args:
+        directions (np.array): directions (N x 3); normalized internally
+        radii (np.array): radii of the shells (R,)
+
+    Returns:
+        tuple: accelerations (R, N, 3) and potentials (R, N)
+    """
+    cbar, sbar = as_packed(cbar), as_packed(sbar)
+    directions = np.asarray(directions, dtype=np.float64).reshape((-1, 3))
+    directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+    directions = np.ascontiguousarray(directions)
+    radii = np.atleast_1d(np.asarray(radii, dtype=np.float64))
+    l_min = max(deg_removed + 1, 0)
+
+    rhol = np.zeros((len(radii), N + 2))
+    rhol[:, 0] = mu / radii
+    for l in range(1, N + 2):  # noqa: E741
+        rhol[:, l] = rhol[:, l - 1] * a / radii
+
+    if parallel:
+        return compute_acc_shells_blocks_parallel(
+            directions,
+            rhol,
+            N,
+            a,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            cbar,
+            sbar,
+            l_min,
+            get_num_threads(),
+        )
+    return compute_acc_shells_blocks_jit(
+        directions,
+        rhol,
+        N,
+        a,
+        n1,
+        n2,
+        n1q,
+        n2q,
+        cbar,
+        sbar,
+        l_min,
+        1,
+    )
+
+
+def compute_grid_ring_coefficients(
+    phi,
+    radius,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    l_min,
+):
+    """Fourier coefficients (in longitude) of the Pines sums along rings of
+    constant colatitude phi and radius. Every point on a ring shares u = cos(phi),
+    so the Legendre terms are computed once per ring. With q = sin(phi), the
+    longitude terms are rE[m] + i*iM[m] = q^m exp(i*m*lambda), so each sum is
+    Re(sum_k coef[k] exp(i*k*lambda)):
+
+        a1 + i*a2 -> coef_a12 (a1 = Re, a2 = -Im)
+        a3, a4, potential -> coef_a3, coef_a4, coef_pot
+    """
+    n_rings = len(phi)
+    coef_a12 = np.zeros((n_rings, N + 2), dtype=np.complex128)
+    coef_a3 = np.zeros((n_rings, N + 2), dtype=np.complex128)
+    coef_a4 = np.zeros((n_rings, N + 2), dtype=np.complex128)
+    coef_pot = np.zeros((n_rings, N + 2), dtype=np.complex128)
+    for i in prange(n_rings):
+        aBar = np.zeros((N + 2, N + 2))
+        rhol = np.zeros((N + 2,))
+        qm = np.zeros((N + 2,))
+
+        u = np.cos(phi[i])
+        q = np.sin(phi[i])
+        compute_legendre(u, N, n1, n2, aBar)
+
+        rho = a / radius
+        rhol[0] = mu / radius
+        for l in range(0, N + 1):  # noqa: E741
+            rhol[l + 1] = rho * rhol[l]
+
+        qm[0] = 1.0
+        for m in range(1, N + 2):
+            qm[m] = q * qm[m - 1]
+
+        for l in range(max(l_min, 1), N + 1):  # noqa: E741
+            rho_a = rhol[l + 1] / a
+            for m in range(0, l + 1):
+                lm = lm_index(l, m)
+                cs = complex(cbar[lm], -sbar[lm])
+                if m > 0:
+                    coef_a12[i, m - 1] += rho_a * m * aBar[l][m] * qm[m - 1] * cs
+                if m < l:
+                    coef_a3[i, m] += rho_a * n1q[lm] * aBar[l][m + 1] * qm[m] * cs
+                coef_a4[i, m] -= rho_a * n2q[lm] * aBar[l + 1][m + 1] * qm[m] * cs
+                coef_pot[i, m] += rhol[l] * aBar[l][m] * qm[m] * cs
+
+        if l_min == 0:
+            coef_a4[i, 0] -= rhol[1] / a
+            coef_pot[i, 0] += rhol[0] * cbar[0]
+    return coef_a12, coef_a3, coef_a4, coef_pot
+
+
+def synthesize_rings(coefficients, N_lon):
+    """Evaluate sum_k coef[k] exp(i*k*lambda_j) for the N_lon longitudes
+    lambda_j = linspace(0, 2pi, N_lon) (endpoint included, as in DHGridDist)
+    with one FFT per ring. Frequencies beyond the number of unique longitudes
+    are folded (aliased) onto the FFT length, which is exact on this grid."""
+    M = N_lon - 1
+    if M < 1:
+        return np.sum(coefficients, axis=1, keepdims=True)
+    n_rings, K = coefficients.shape
+    folded = np.zeros((n_rings, M), dtype=np.complex128)
+    np.add.at(folded, (slice(None), np.arange(K) % M), coefficients)
+    values = np.fft.ifft(folded, axis=1) * M
+    return np.concatenate([values, values[:, :1]], axis=1)
+
+
+def compute_acc_grid(
+    phi,
+    N_lon,
+    radius,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    parallel=True,
+    deg_removed=-1,
+):
+    """Spherical harmonic synthesis on a Driscoll-Healy style grid of constant
+    radius: colatitudes phi and N_lon longitudes spaced as
+    linspace(0, 2pi, N_lon). The Legendre terms are computed once per latitude
+    ring and the longitude dependence is evaluated with an FFT, which is orders
+    of magnitude cheaper than evaluating every grid point independently.
+
+    Returns:
+        tuple: accelerations (N_lon, N_lat, 3) and potentials (N_lon, N_lat)
+    """
+    cbar, sbar = as_packed(cbar), as_packed(sbar)
+    phi = np.ascontiguousarray(phi, dtype=np.float64)
+    l_min = max(deg_removed + 1, 0)
+    if parallel:
+        kernel = compute_grid_ring_coefficients_parallel
+    else:
+        kernel = compute_grid_ring_coefficients_jit
+    coefficients = kernel(
+        phi,
+        float(radius),
+        N,
+        mu,
+        a,
+        n1,
+        n2,
+        n1q,
+        n2q,
+        cbar,
+        sbar,
+        l_min,
+    )
+    z_a12, z_a3, z_a4, z_pot = [synthesize_rings(c, N_lon) for c in coefficients]
+
+    theta = np.linspace(0, 2 * np.pi, N_lon, endpoint=True)
+    s = np.outer(np.sin(phi), np.cos(theta))
+    t = np.outer(np.sin(phi), np.sin(theta))
+    u = np.outer(np.cos(phi), np.ones_like(theta))
+    a4 = z_a4.real
+
+    acc = np.zeros((N_lon, len(phi), 3))
+    acc[:, :, 0] = (z_a12.real + s * a4).T
+    acc[:, :, 1] = (-z_a12.imag + t * a4).T
+    acc[:, :, 2] = (z_a3.real + u * a4).T
+    potential = -z_pot.real.T
+    return acc, potential
+
+
+@njit(cache=True)
+def compute_legendre_column(u, N, m, diag_m, diag_m1, n1, n2, col):
+    """Fill col[l] = aBar[l][m] for m <= l <= N+1 given the sectoral terms
+    aBar[m][m] (diag_m) and aBar[m+1][m+1] (diag_m1). n1 and n2 are order-major
+    tables of degrees <= N+1 (see order_major_tables)."""
+    col[m] = diag_m
+    if m + 1 <= N + 1:
+        col[m + 1] = np.sqrt((2.0 * (m + 1)) * getK(m) / getK(m + 1)) * diag_m1 * u
+    for l in range(m + 2, N + 2):  # noqa: E741
+        lm = order_index(l, m, N + 1)
+        col[l] = u * n1[lm] * col[l - 1] - n2[lm] * col[l - 2]
+
+
+@njit(cache=True)
+def next_sectoral(diag, l):  # noqa: E741
+    "Sectoral term aBar[l][l] from aBar[l-1][l-1]"
+    return np.sqrt(((2.0 * l + 1.0) * getK(l)) / ((2.0 * l * getK(l - 1)))) * diag
+
+
+@njit(cache=True)
+def compute_acc_point_low_memory(
+    position,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    col_m,
+    col_m1,
+    rhol,
+    acc,
+    l_min,
+):
+    """Evaluate the Pines algorithm (degrees l_min..N) for a single position one
+    order (m) at a time. Only the aBar columns m and m+1 are held in memory, so
+    the scratch is O(N) rather than the O(N^2) aBar matrix used by
+    compute_acc_point.
+
+    The sums run over the degrees of one order at a time, so the coefficient
+    and normalization tables are read from order-major copies of degrees <= N+1
+    (see order_major_tables) in which those degrees are contiguous. The
+    acceleration is written into acc and the potential is returned.
+    """
+    r = np.sqrt(position[0] ** 2 + position[1] ** 2 + position[2] ** 2)
+    s = position[0] / r
+    t = position[1] / r
+    u = position[2] / r
+
+    rho = a / r
+    rhol[0] = mu / r
+    for l in range(0, N + 1):  # noqa: E741
+        rhol[l + 1] = rho * rhol[l]
+
+    # Sectoral terms for the first two columns
+    diag_m = 1.0
+    diag_m1 = next_sectoral(diag_m, 1)
+    diag_m2 = next_sectoral(diag_m1, 2)
+    compute_legendre_column(u, N, 0, diag_m, diag_m1, n1, n2, col_m)
+    compute_legendre_column(u, N, 1, diag_m1, diag_m2, n1, n2, col_m1)
+
+    rE_prev, iM_prev = 0.0, 0.0
+    rE_m, iM_m = 1.0, 0.0
+
+    a1, a2, a3, a4 = 0.0, 0.0, 0.0, 0.0
+    potential = 0.0
+    for m in range(0, N + 1):
+        for l in range(max(m, 1, l_min), N + 1):  # noqa: E741
+            lm = order_index(l, m, N + 1)
+            D = cbar[lm] * rE_m + sbar[lm] * iM_m
+            E = 0.0 if m == 0 else cbar[lm] * rE_prev + sbar[lm] * iM_prev
+            F = 0.0 if m == 0 else sbar[lm] * rE_prev - cbar[lm] * iM_prev
+
+            rho_a = rhol[l + 1] / a
+            a1 += rho_a * m * col_m[l] * E
+            a2 += rho_a * m * col_m[l] * F
+            if m < l:
+                a3 += rho_a * n1q[lm] * col_m1[l] * D
+            a4 -= rho_a * n2q[lm] * col_m1[l + 1] * D
+
+            potential += rhol[l] * col_m[l] * D
+
+        # Advance to the next order: column m+1 becomes the current column
+        # and column m+2 is generated in place of column m.
+        col_m, col_m1 = col_m1, col_m
+        diag_m, diag_m1 = diag_m1, diag_m2
+        if m + 2 <= N + 1:
+            diag_m2 = next_sectoral(diag_m1, m + 3) if m + 3 <= N + 1 else 0.0
+            compute_legendre_column(
+                u,
+                N,
+                m + 2,
+                diag_m1,
+                diag_m2,
+                n1,
+                n2,
+                col_m1,
+            )
+
+        rE_prev, iM_prev = rE_m, iM_m
+        rE_m = s * rE_prev - t * iM_prev
+        iM_m = s * iM_prev + t * rE_prev
+
+    # The prior loop doesn't account for the l=0 index
+    if l_min == 0:
+        a4 -= rhol[1] / a
+        potential += rhol[0] * cbar[0]
+
+    acc[0] = a1 + s * a4
+    acc[1] = a2 + t * a4
+    acc[2] = a3 + u * a4
+    return -potential
+
+
+def compute_acc_low_memory_blocks(
+    positions,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    l_min,
+    n_blocks,
+):
+    """Block driver for compute_acc_point_low_memory (see compute_acc_blocks).
+    The tables are order-major (see order_major_tables)."""
+    acc = np.zeros(positions.shape)
+    N_total = int(len(positions) / 3)
+    potential = np.zeros((N_total,))
+    if N == -1 or N_total == 0:
+        return (acc, potential)
+
+    n_blocks = max(min(n_blocks, N_total), 1)
+    block_size = (N_total + n_blocks - 1) // n_blocks
+    for b in prange(n_blocks):
+        col_m = np.zeros((N + 2,))
+        col_m1 = np.zeros((N + 2,))
+        rhol = np.zeros((N + 2,))
+        for i in range(b * block_size, min((b + 1) * block_size, N_total)):
+            potential[i] = compute_acc_point_low_memory(
+                positions[3 * i : 3 * (i + 1)],
+                N,
+                mu,
+                a,
+                n1,
+                n2,
+                n1q,
+                n2q,
+                cbar,
+                sbar,
+                col_m,
+                col_m1,
+                rhol,
+                acc[3 * i : 3 * (i + 1)],
+                l_min,
+            )
+    return (acc, potential)
+
+
+def order_major_tables(N, n1, n2, n1q, n2q, cbar, sbar):
+    """Order-major copies (see SHCoefficients.order_index) of the degrees <= N+1
+    of the normalization and coefficient tables, the layout read by
+    compute_acc_point_low_memory. Building them costs a pass over the tables, so
+    models evaluating many batches build them once (see SphericalHarmonics).
+
+    Returns:
+        tuple: (n1, n2, n1q, n2q, cbar, sbar) order-major
+    """
+    cbar, sbar = as_packed(cbar), as_packed(sbar)
+    return tuple(
+        to_order_major(table, N + 1) for table in (n1, n2, n1q, n2q, cbar, sbar)
+    )
+
+
+def compute_acc_low_memory(
+    positions,
+    N,
+    mu,
+    a,
+    n1,
+    n2,
+    n1q,
+    n2q,
+    cbar,
+    sbar,
+    parallel=True,
+    deg_removed=-1,
+    tables=None,
+):
+    """Batched Pines evaluation of a flattened (3N,) array of positions that
+    keeps only O(N) scratch per thread (two aBar columns) instead of the dense
+    (N+2)x(N+2) aBar matrix. Preferable at very high degree (2000+) where the
+    dense matrix no longer fits in cache. Arguments match compute_acc, plus
+    tables, the order_major_tables of the other tables if already built (they
+    are built on every call otherwise).
+    """
+    positions = np.ascontiguousarray(positions, dtype=np.float64)
+    l_min = max(deg_removed + 1, 0)
+    if N == -1:
+        return (np.zeros(positions.shape), np.zeros((int(len(positions) / 3),)))
+    if tables is None:
+        tables = order_major_tables(N, n1, n2, n1q, n2q, cbar, sbar)
+    if parallel:
+        return compute_acc_low_memory_blocks_parallel(
+            positions,
+            N,
+            mu,
+            a,
+            *tables,
+            l_min,
+            get_num_threads(),
+        )
+    return compute_acc_low_memory_blocks_jit(positions, N, mu, a, *tables, l_min, 1)
+
+
+@njit(cache=True, parallel=False)
+def compute_acc_thread(position, N, mu, a, n1, n2, n1q, n2q, cbar, sbar):
+    rE = np.zeros((N + 2,))
+    iM = np.zeros((N + 2,))
+    rhol = np.zeros((N + 2,))
+    aBar = np.zeros((N + 2, N + 2))
+    acc = np.zeros((3,))
+    potential = compute_acc_point(
+        position,
+        N,
+        mu,
+        a,
+        n1,
+        n2,
+        n1q,
+        n2q,
+        cbar,
+        sbar,
+        aBar,
+        rE,
+        iM,
+        rhol,
+        acc,
+        0,
+    )
+    return (acc, potential)
 
 
 getK = njit(getK, cache=True)
 compute_n_matrices = njit(compute_n_matrices, cache=True)
-# compute_acc_jit = njit(compute_acc, parallel=False, cache=True)
-# compute_acc_parallel = njit(compute_acc, parallel=True, cache=True)
-# compute_acc_thread = njit(compute_acc_thread, cache=True)
-
-# compute_acc_jit = compute_acc
+compute_acc_blocks_jit = njit(
+    compute_acc_blocks,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_acc_blocks_parallel = njit(
+    compute_acc_blocks,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+compute_acc_hessian_blocks_jit = njit(
+    compute_acc_hessian_blocks,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_acc_hessian_blocks_parallel = njit(
+    compute_acc_hessian_blocks,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+compute_acc_low_memory_blocks_jit = njit(
+    compute_acc_low_memory_blocks,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_acc_low_memory_blocks_parallel = njit(
+    compute_acc_low_memory_blocks,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+compute_acc_degrees_blocks_jit = njit(
+    compute_acc_degrees_blocks,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_acc_degrees_blocks_parallel = njit(
+    compute_acc_degrees_blocks,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+compute_grid_ring_coefficients_jit = njit(
+    compute_grid_ring_coefficients,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_grid_ring_coefficients_parallel = njit(
+    compute_grid_ring_coefficients,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+compute_acc_shells_blocks_jit = njit(
+    compute_acc_shells_blocks,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_acc_shells_blocks_parallel = njit(
+    compute_acc_shells_blocks,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+compute_acc_adaptive_blocks_jit = njit(
+    compute_acc_adaptive_blocks,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_acc_adaptive_blocks_parallel = njit(
+    compute_acc_adaptive_blocks,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
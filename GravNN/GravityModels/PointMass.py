@@ -1,6 +1,7 @@
 import os
 
 import numpy as np
+from numba import get_num_threads, njit, prange
 
 from GravNN.CelestialBodies.Planets import Earth
 from GravNN.GravityModels.GravityModelBase import GravityModelBase
@@ -21,8 +22,78 @@ def get_pm_data(trajectory, gravity_file, **kwargs):
     return x, a, u
 
 
+def compute_point_mass_values(positions, mass_positions, masses_mu, n_blocks, tile):
+    """Accelerations and potentials of M point masses at N positions. The positions
+    are split into n_blocks blocks (one per thread) and the masses into tiles of
+    tile masses, so each tile stays in cache while the positions of a block are
+    visited. No N x M intermediate is ever formed."""
+    N = len(positions)
+    M = len(masses_mu)
+    n_blocks = max(min(n_blocks, N), 1)
+    block_size = (N + n_blocks - 1) // n_blocks
+    accelerations = np.zeros((N, 3))
+    potentials = np.zeros((N,))
+    for b in prange(n_blocks):
+        for tile_start in range(0, M, tile):
+            tile_stop = min(tile_start + tile, M)
+            for i in range(b * block_size, min((b + 1) * block_size, N)):
+                x, y, z = positions[i, 0], positions[i, 1], positions[i, 2]
+                a_x, a_y, a_z, u = 0.0, 0.0, 0.0, 0.0
+                for j in range(tile_start, tile_stop):
+                    dx = x - mass_positions[j, 0]
+                    dy = y - mass_positions[j, 1]
+                    dz = z - mass_positions[j, 2]
+                    inv_r = 1.0 / np.sqrt(dx * dx + dy * dy + dz * dz)
+                    mu_inv_r = masses_mu[j] * inv_r
+                    mu_inv_r3 = mu_inv_r * inv_r * inv_r
+                    a_x -= mu_inv_r3 * dx
+                    a_y -= mu_inv_r3 * dy
+                    a_z -= mu_inv_r3 * dz
+                    u -= mu_inv_r
+                accelerations[i, 0] += a_x
+                accelerations[i, 1] += a_y
+                accelerations[i, 2] += a_z
+                potentials[i] += u
+    return accelerations, potentials
+
+
+def compute_point_masses(
+    positions,
+    mass_positions,
+    masses_mu,
+    parallel=True,
+    tile=256,
+):
+    """Accelerations and potentials of a set of point masses (mascons)
+
+    Args:
+        positions (np.array): evaluation points (N x 3) [m]
+        mass_positions (np.array): location of each mass (M x 3) [m]
+        masses_mu (np.array): gravitational parameter of each mass (M,) [m^3/s^2]
+        parallel (bool, optional): Split the positions across all numba threads.
+            Defaults to True.
+        tile (int, optional): Masses processed per pass over a block of
+            positions. Defaults to 256.
+
+    Returns:
+        tuple: accelerations (N x 3) [m/s^2] and potentials (N,) [m^2/s^2]
+    """
+    kernel = (
+        compute_point_mass_values_parallel
+        if parallel
+        else compute_point_mass_values_jit
+    )
+    return kernel(
+        np.ascontiguousarray(positions, dtype=np.float64).reshape((-1, 3)),
+        np.ascontiguousarray(mass_positions, dtype=np.float64).reshape((-1, 3)),
+        np.ascontiguousarray(masses_mu, dtype=np.float64).reshape((-1,)),
+        get_num_threads() if parallel else 1,
+        tile,
+    )
+
+
 class PointMass(GravityModelBase):
-    def __init__(self, celestial_body, trajectory=None):
+    def __init__(self, celestial_body, trajectory=None, parallel=True):
         """Gravity model that only produces accelerations and potentials
         as if there were only a point mass.
 
@@ -30,10 +101,13 @@ class PointMass(GravityModelBase):
             celestial_body (CelestialBody): body used to generate gravity measurements
             trajectory (TrajectoryBase, optional): trajectory for which gravity
             measurements must be produced. Defaults to None.
+            parallel (bool, optional): Evaluate the positions across the available
+                threads rather than serially. Defaults to True.
         """
-        super().__init__(celestial_body, trajectory=trajectory)
+        super().__init__(celestial_body, trajectory=trajectory, parallel=parallel)
         self.celestial_body = celestial_body
         self.mu = celestial_body.mu
+        self.parallel = parallel
         self.configure(trajectory)
 
     def generate_full_file_directory(self):
@@ -48,10 +122,7 @@ class PointMass(GravityModelBase):
         if positions is None:
             positions = self.trajectory.positions
 
-        self.accelerations = np.zeros(positions.shape)
-        for i in range(len(self.accelerations)):
-            self.accelerations[i] = self.compute_acceleration_value(positions[i])
-
+        self.compute_batch(positions)
         return self.accelerations
 
     def compute_potential(self, positions=None):
@@ -59,12 +130,21 @@ class PointMass(GravityModelBase):
         if positions is None:
             positions = self.trajectory.positions
 
-        self.potentials = np.zeros(len(positions))
-        for i in range(len(self.potentials)):
-            self.potentials[i] = self.compute_potential_value(positions[i])
-
+        self.compute_batch(positions)
         return self.potentials
 
+    def compute_batch(self, positions):
+        "Compute the accelerations and potentials of all positions in one call"
+        accelerations, potentials = compute_point_masses(
+            positions,
+            np.zeros((1, 3)),
+            np.array([self.mu]),
+            parallel=self.parallel,
+        )
+        self.accelerations = accelerations.reshape(np.shape(positions))
+        self.potentials = potentials
+        return self.accelerations, self.potentials
+
     def compute_acceleration_value(self, position):
         # remember that a = -dU/dx
         # U = -mu/r
@@ -126,5 +206,18 @@ def main():
     print(sh_results)
 
 
+compute_point_mass_values_jit = njit(
+    compute_point_mass_values,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_point_mass_values_parallel = njit(
+    compute_point_mass_values,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+
 if __name__ == "__main__":
     main()
@@ -4,17 +4,21 @@ import os
 
 import matplotlib.pyplot as plt
 import numpy as np
-import trimesh
-from numba import njit  # , range
+from numba import config, get_num_threads, njit, prange, set_num_threads
 
 from GravNN.CelestialBodies.Asteroids import Eros
 from GravNN.GravityModels.GravityModelBase import GravityModelBase
 from GravNN.GravityModels.PointMass import PointMass
 from GravNN.Support.PathTransformations import make_windows_path_posix
+from GravNN.Support.ShapeModelRegistry import get_shape_model
+from GravNN.Support.slurm_utils import get_run_id, get_shard_index
 
 
 def get_poly_data(trajectory, obj_mesh_file, **kwargs):
     override = bool(kwargs.get("override", [False])[0])
+    chunk_size = kwargs.get("chunk_size", [None])[0]
+    lease = kwargs.get("lease", [None])[0]
+    n_shards = kwargs.get("n_shards", [None])[0]
     remove_point_mass = bool(kwargs.get("remove_point_mass", [False])[0])
 
     obj_mesh_file = make_windows_path_posix(obj_mesh_file)
@@ -24,7 +28,18 @@ def get_poly_data(trajectory, obj_mesh_file, **kwargs):
         obj_mesh_file,
         trajectory=trajectory,
     )
-    poly_r0_gm.load(override=override)
+    if n_shards is not None:
+        poly_r0_gm.generate_sharded(
+            n_shards,
+            shard=kwargs.get("shard_index", [get_shard_index()])[0],
+            processes=kwargs.get("shard_processes", [None])[0],
+            override=override,
+            run_id=kwargs.get("shard_run_id", [get_run_id()])[0],
+            lease=lease,
+            chunk_size=chunk_size,
+        )
+        override = False
+    poly_r0_gm.load(override=override, chunk_size=chunk_size, lease=lease)
 
     x = poly_r0_gm.positions  # position (N x 3)
     a = poly_r0_gm.accelerations
@@ -194,6 +209,126 @@ def edge_acc_loop(point_scaled, vertices, edges_unique, edge_dyads):
     return acc, pot
 
 
+@njit(cache=True, parallel=False)
+def facet_acc_hessian_loop(point_scaled, vertices, faces, facet_dyads):
+    """facet_acc_loop that also accumulates the facet contribution to the gravity
+    gradient tensor, -sum(wf * F)"""
+    acc = np.zeros((3,))
+    hess = np.zeros((3, 3))
+    pot = 0.0
+    for i in range(len(faces)):
+        r_f = vertices[faces[i][0]] - point_scaled
+
+        wf = GetPerformanceFactor(point_scaled, vertices, faces, i)
+        F = facet_dyads[i]
+
+        acc += wf * np.dot(F, r_f)
+        pot -= wf * np.dot(r_f, np.dot(F, r_f))
+        hess -= wf * F
+    return acc, pot, hess
+
+
+@njit(cache=True, parallel=False)
+def edge_acc_hessian_loop(point_scaled, vertices, edges_unique, edge_dyads):
+    """edge_acc_loop that also accumulates the edge contribution to the gravity
+    gradient tensor, sum(Le * E)"""
+    acc = np.zeros((3,))
+    hess = np.zeros((3, 3))
+    pot = 0.0
+    for i in range(len(edges_unique)):
+        r0 = vertices[edges_unique[i][0]]
+        r1 = vertices[edges_unique[i][1]]
+        r_e = (r0 + r1) / 2 - point_scaled
+
+        Le = GetLe(point_scaled, vertices, edges_unique, i)
+        E = edge_dyads[i]
+
+        acc -= Le * np.dot(E, r_e)
+        pot += Le * np.dot(r_e, np.dot(E, r_e))
+        hess += Le * E
+    return acc, pot, hess
+
+
+def compute_poly_values(
+    points_scaled,
+    vertices,
+    faces,
+    edges_unique,
+    facet_dyads,
+    edge_dyads,
+):
+    """Facet and edge sums of the acceleration and potential (before the G*density
+    scaling) for a batch of points (N x 3) in mesh units. When compiled with
+    parallel=True the points are split across the numba threads, which share the
+    mesh and dyad arrays rather than receiving a copy of the model."""
+    N = len(points_scaled)
+    acc = np.zeros((N, 3))
+    pot = np.zeros((N,))
+    for i in prange(N):
+        acc_facet, pot_facet = facet_acc_loop(
+            points_scaled[i],
+            vertices,
+            faces,
+            facet_dyads,
+        )
+        acc_edge, pot_edge = edge_acc_loop(
+            points_scaled[i],
+            vertices,
+            edges_unique,
+            edge_dyads,
+        )
+        acc[i] = acc_facet + acc_edge  # signs taken care of in loop
+        pot[i] = pot_facet + pot_edge
+    return acc, pot
+
+
+def compute_poly_hessian(
+    points_scaled,
+    vertices,
+    faces,
+    edges_unique,
+    facet_dyads,
+    edge_dyads,
+):
+    "compute_poly_values with the (unscaled) gravity gradient tensors (N x 3 x 3)"
+    N = len(points_scaled)
+    acc = np.zeros((N, 3))
+    pot = np.zeros((N,))
+    hess = np.zeros((N, 3, 3))
+    for i in prange(N):
+        acc_facet, pot_facet, hess_facet = facet_acc_hessian_loop(
+            points_scaled[i],
+            vertices,
+            faces,
+            facet_dyads,
+        )
+        acc_edge, pot_edge, hess_edge = edge_acc_hessian_loop(
+            points_scaled[i],
+            vertices,
+            edges_unique,
+            edge_dyads,
+        )
+        acc[i] = acc_facet + acc_edge
+        pot[i] = pot_facet + pot_edge
+        hess[i] = hess_facet + hess_edge
+    return acc, pot, hess
+
+
+def compute_polyhedral_dyads(shape_model):
+    "Facet and edge dyads of a ShapeModel (see ShapeModelRegistry)"
+    mesh = shape_model.mesh
+    facet_dyads = compute_facet_dyads(mesh.face_normals)
+    edge_dyads = compute_edge_dyads(
+        mesh.vertices,
+        mesh.faces,
+        shape_model.edges_unique,
+        mesh.face_adjacency_edges,
+        mesh.face_normals,
+        mesh.face_adjacency,
+    )
+    return facet_dyads, edge_dyads
+
+
 class Mesh:
     def __init__(self, trimesh):
         self.vertices = copy.deepcopy(np.array(trimesh.vertices))
@@ -204,7 +339,7 @@ class Mesh:
 
 
 class Polyhedral(GravityModelBase):
-    def __init__(self, celestial_body, obj_file, trajectory=None):
+    def __init__(self, celestial_body, obj_file, trajectory=None, parallel=True):
         """Polyhedral gravity model based on work from Werner and Scheeres
         (https://link.springer.com/article/10.1007/BF00053511)
         The model computes the accelerations from a constant density polyhedral shape
@@ -215,27 +350,30 @@ class Polyhedral(GravityModelBase):
             obj_file (str): path to shape model of the body
             trajectory (TrajectoryBase, optional): Trajectory / distribution for which
                 the gravity measurements should be computed. Defaults to None.
+            parallel (bool, optional): Evaluate the positions across the available
+                threads rather than serially. Defaults to True.
         """
-        super().__init__(celestial_body, obj_file, trajectory=trajectory)
+        super().__init__(
+            celestial_body,
+            obj_file,
+            trajectory=trajectory,
+            parallel=parallel,
+        )
         self.obj_file = obj_file
+        self.parallel = parallel
 
         self.configure(trajectory)
 
         self.planet = celestial_body
         obj_file = make_windows_path_posix(obj_file)
-        filename, file_extension = os.path.splitext(obj_file)
-        self.mesh = trimesh.load_mesh(obj_file, file_type=file_extension[1:])
+        self.shape_model = get_shape_model(obj_file)
+        self.mesh = self.shape_model
         self.scaleFactor = 1e3  # Assume that the mesh is given in km
         self.density = self.compute_density()
 
-        self.facet_dyads = compute_facet_dyads(self.mesh.face_normals)
-        self.edge_dyads = compute_edge_dyads(
-            self.mesh.vertices,
-            self.mesh.faces,
-            self.mesh.edges_unique,
-            self.mesh.face_adjacency_edges,
-            self.mesh.face_normals,
-            self.mesh.face_adjacency,
+        self.facet_dyads, self.edge_dyads = self.shape_model.derived(
+            "polyhedral_dyads",
+            compute_polyhedral_dyads,
         )
         self.reduce_mesh_memory()
         self.get_available_cores()
@@ -335,20 +473,7 @@ class Polyhedral(GravityModelBase):
         if positions is None:
             positions = self.trajectory.positions
 
-        # bar = ProgressBar(positions.shape[0], enable=pbar)
-        self.accelerations = np.zeros(positions.shape)
-        self.potentials = np.zeros(len(positions))
-
-        if len(positions) == 1:
-            results = map(self.compute_values, positions)
-        else:
-            with mp.Pool(processes=self.processes) as pool:
-                results = pool.map(self.compute_values, positions)
-
-        for i, result in enumerate(results):
-            self.accelerations[i] = result[0]
-            self.potentials[i] = result[1]
-
+        self.compute_batch(positions)
         return self.accelerations
 
     def compute_potential(self, positions=None):
@@ -356,20 +481,78 @@ class Polyhedral(GravityModelBase):
         if positions is None:
             positions = self.trajectory.positions
 
-        self.accelerations = np.zeros(positions.shape)
-        self.potentials = np.zeros(len(positions))
+        self.compute_batch(positions)
+        return self.potentials
 
-        if len(positions) == 1:
-            results = map(self.compute_values, positions)
-        else:
-            with mp.Pool(processes=self.processes) as pool:
-                results = pool.map(self.compute_values, positions)
+    def compute_hessian(self, positions=None):
+        """Compute the analytic gravity gradient tensor d(acc)/d(position) (Werner
+        and Scheeres eq. 16) for an existing trajectory or provided positions. The
+        accelerations and potentials of the same pass are stored on the model.
 
-        for i, result in enumerate(results):
-            self.accelerations[i] = result[0]
-            self.potentials[i] = result[1]
+        Returns:
+            np.array: gravity gradient tensors (N x 3 x 3) [1/s^2]
+        """
+        if positions is None:
+            positions = self.trajectory.positions
 
-        return self.potentials
+        G = 6.67430 * 10**-11  # m^3/(kg s^2)
+        kernel = (
+            compute_poly_hessian_parallel
+            if self.parallel
+            else compute_poly_hessian_jit
+        )
+        acc, pot, hess = self.run_kernel(kernel, positions)
+        self.set_values(acc, pot)
+
+        # d(acc)/d(position): the km -> m scale of the acceleration cancels with
+        # the scaling of the position
+        self.hessians = hess * G * self.density
+        return self.hessians
+
+    def compute_batch(self, positions):
+        """Compute the accelerations and potentials of all positions in a single
+        call of the multi-point kernel"""
+        kernel = (
+            compute_poly_values_parallel if self.parallel else compute_poly_values_jit
+        )
+        acc, pot = self.run_kernel(kernel, positions)
+        self.set_values(acc, pot)
+        return self.accelerations, self.potentials
+
+    def run_kernel(self, kernel, positions):
+        points_scaled = np.ascontiguousarray(positions, dtype=np.float64).reshape(
+            (-1, 3),
+        )
+        points_scaled = points_scaled / self.scaleFactor
+        args = (
+            points_scaled,
+            self.mesh.vertices,
+            self.mesh.faces,
+            self.mesh.edges_unique,
+            self.facet_dyads,
+            self.edge_dyads,
+        )
+        if not self.parallel:
+            return kernel(*args)
+
+        # Respect the cores allocated to the job (e.g. SLURM) rather than
+        # the cores of the node
+        n_threads = get_num_threads()
+        set_num_threads(max(min(self.processes, config.NUMBA_NUM_THREADS), 1))
+        try:
+            return kernel(*args)
+        finally:
+            set_num_threads(n_threads)
+
+    def set_values(self, acc, pot):
+        G = 6.67430 * 10**-11  # m^3/(kg s^2)
+        self.accelerations = acc * G * self.density * self.scaleFactor
+        # [km^2/s^2] - > [m^2/s^2]
+        pot = pot * 1.0 / 2.0 * G * self.density * self.scaleFactor**2
+
+        # the paper gives delta U, not a.
+        # Given that a is already standard, we are going to negate U
+        self.potentials = -pot
 
     def compute_values(self, position):
         G = 6.67430 * 10**-11  # m^3/(kg s^2)
@@ -526,6 +709,31 @@ def test_energy_conservation():
     plt.show()
 
 
+compute_poly_values_jit = njit(
+    compute_poly_values,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_poly_values_parallel = njit(
+    compute_poly_values,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+compute_poly_hessian_jit = njit(
+    compute_poly_hessian,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_poly_hessian_parallel = njit(
+    compute_poly_hessian,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+
 if __name__ == "__main__":
     main()
     # test_energy_conservation()
@@ -0,0 +1,189 @@
+import hashlib
+import os
+
+import numpy as np
+
+from GravNN.GravityModels.Polyhedral import Polyhedral
+from GravNN.GravityModels.PolyhedralSH import (
+    brillouin_radius,
+    get_polyhedral_sh_file,
+    read_sh_file,
+)
+
+
+def degree_amplitudes(fine, coarse):
+    """Amplitude sqrt(sum_m dC_lm^2 + dS_lm^2) of each degree of the difference
+    between two sets of PackedCoefficients of the same degree"""
+    dC = fine.C - coarse.C
+    dS = fine.S - coarse.S
+    degrees = np.repeat(np.arange(fine.degree + 1), np.arange(1, fine.degree + 2))
+    return np.sqrt(np.bincount(degrees, weights=dC**2 + dS**2))
+
+
+def estimate_relative_error(radii, amplitudes, reference_radius, brillouin_radius):
+    """A-priori estimate of the acceleration error, relative to mu/r^2, caused by
+    a change of the mass distribution whose coefficient differences per degree are
+    amplitudes (see degree_amplitudes).
+
+    Each degree contributes at most (l+1) sqrt(2l+1) amplitude_l (R/r)^l, and the
+    degrees beyond the estimate are bounded by a geometric series in
+    brillouin_radius/r. The estimate is infinite inside the Brillouin sphere
+    where the expansion does not converge.
+
+    Args:
+        radii (np.array): distance of each point from the origin [m]
+        amplitudes (np.array): degree amplitudes of the difference (L+1,)
+        reference_radius (float): reference radius of the coefficients [m]
+        brillouin_radius (float): radius enclosing both mass distributions [m]
+
+    Returns:
+        np.array: estimated relative error of each point
+    """
+    radii = np.asarray(radii, dtype=np.float64).reshape((-1, 1))
+    l = np.arange(len(amplitudes))  # noqa: E741
+    terms = (l + 1) * np.sqrt(2 * l + 1) * amplitudes * (reference_radius / radii) ** l
+    error = terms.sum(axis=1)
+
+    ratio = brillouin_radius / radii[:, 0]
+    converged = ratio < 1.0
+    last_terms = terms[:, -2:].max(axis=1)
+    tail = np.full(error.shape, np.inf)
+    tail[converged] = (
+        last_terms[converged] * ratio[converged] / (1.0 - ratio[converged])
+    )
+    return error + tail
+
+
+class PolyhedralLOD(Polyhedral):
+    def __init__(
+        self,
+        celestial_body,
+        obj_file,
+        trajectory=None,
+        parallel=True,
+        coarse_obj_files=(),
+        tolerance=1e-6,
+        estimate_degree=16,
+    ):
+        """Constant density polyhedral gravity model holding several resolutions
+        of the same shape. Each point is evaluated with the coarsest mesh whose
+        estimated acceleration error at the point's radius is below tolerance,
+        so points far from the body use few facets while points near the surface
+        use the full resolution mesh (obj_file).
+
+        The error of a coarse mesh is estimated a-priori from the difference of
+        the exact spherical harmonic coefficients of the two meshes (see
+        PolyhedralSH and estimate_relative_error). Points inside the Brillouin
+        sphere of the meshes always use the full resolution mesh, as do the
+        gravity gradients of compute_hessian.
+
+        Args:
+            celestial_body (CelestialBody): Body for gravity calc
+            obj_file (str): path to the full resolution shape model of the body
+            trajectory (TrajectoryBase, optional): Trajectory / distribution for which
+                the gravity measurements should be computed. Defaults to None.
+            parallel (bool, optional): Evaluate the positions across the available
+                threads rather than serially. Defaults to True.
+            coarse_obj_files (list, optional): paths to decimations of the shape
+                model, in any order. Defaults to ().
+            tolerance (float, optional): Largest acceptable acceleration error
+                relative to mu/r^2. Defaults to 1e-6.
+            estimate_degree (int, optional): Degree of the coefficients used to
+                estimate the error. Defaults to 16.
+        """
+        if tolerance <= 0.0:
+            raise ValueError(f"tolerance must be positive (got {tolerance})")
+        self.coarse_obj_files = list(coarse_obj_files)
+        self.tolerance = tolerance
+        self.estimate_degree = estimate_degree
+        super().__init__(
+            celestial_body,
+            obj_file,
+            trajectory=trajectory,
+            parallel=parallel,
+        )
+
+        coarse_models = [
+            Polyhedral(celestial_body, coarse_obj_file, parallel=parallel)
+            for coarse_obj_file in self.coarse_obj_files
+        ]
+        coarse_models.sort(key=lambda model: len(model.mesh.faces))
+
+        # Levels ordered from the coarsest to the full resolution mesh
+        self.levels = coarse_models + [self]
+        self.brillouin_radius = max(
+            brillouin_radius(level.mesh.vertices * level.scaleFactor)
+            for level in self.levels
+        )
+
+        coefficients = [
+            read_sh_file(
+                get_polyhedral_sh_file(
+                    celestial_body,
+                    level.obj_file,
+                    estimate_degree,
+                    level.scaleFactor,
+                ),
+                estimate_degree,
+            )
+            for level in self.levels
+        ]
+        self.amplitudes = [
+            degree_amplitudes(coefficients[-1], level_coefficients)
+            for level_coefficients in coefficients[:-1]
+        ]
+
+    def generate_full_file_directory(self):
+        levels = ",".join(
+            sorted(os.path.basename(obj_file) for obj_file in self.coarse_obj_files),
+        )
+        self.file_directory += (
+            os.path.splitext(os.path.basename(__file__))[0]
+            + "_"
+            + os.path.basename(self.obj_file).split(".")[0]
+            + f"_{hashlib.sha256(levels.encode()).hexdigest()[:8]}"
+            + f"_Tol{self.tolerance:g}"
+            + "/"
+        )
+
+    def select_levels(self, positions):
+        """Index into self.levels of the coarsest mesh meeting the tolerance at each
+        position"""
+        positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+        radii = np.linalg.norm(positions, axis=1)
+        selected = np.full((len(positions),), len(self.levels) - 1)
+        undecided = np.ones((len(positions),), dtype=bool)
+        for i, amplitudes in enumerate(self.amplitudes):
+            error = estimate_relative_error(
+                radii[undecided],
+                amplitudes,
+                self.planet.radius,
+                self.brillouin_radius,
+            )
+            accepted = np.flatnonzero(undecided)[error <= self.tolerance]
+            selected[accepted] = i
+            undecided[accepted] = False
+        return selected
+
+    def compute_batch(self, positions):
+        """Compute the accelerations and potentials, evaluating each point with the
+        mesh selected by select_levels"""
+        positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+        self.point_levels = self.select_levels(positions)
+
+        accelerations = np.zeros(positions.shape)
+        potentials = np.zeros((len(positions),))
+        for i, level in enumerate(self.levels):
+            mask = self.point_levels == i
+            if not np.any(mask):
+                continue
+            if level is self:
+                acc, pot = super().compute_batch(positions[mask])
+            else:
+                acc, pot = level.compute_batch(positions[mask])
+            accelerations[mask] = acc
+            potentials[mask] = pot
+
+        self.accelerations = accelerations
+        self.potentials = potentials
+        return self.accelerations, self.potentials
@@ -0,0 +1,303 @@
+import hashlib
+import os
+
+import numpy as np
+from numba import get_num_threads, njit, prange
+
+import GravNN
+from GravNN.GravityModels.PinesAlgorithm import compute_acc, compute_n_matrices
+from GravNN.GravityModels.Polyhedral import Polyhedral
+from GravNN.GravityModels.PolyhedralTreecode import (
+    compute_expansion_terms,
+    triangle_quadrature,
+)
+from GravNN.GravityModels.SHCoefficients import (
+    PackedCoefficients,
+    lm_index,
+    n_coefficients,
+)
+from GravNN.Regression.utils import RegressSolution, save
+from GravNN.Support.PathTransformations import make_windows_path_posix
+from GravNN.Support.ShapeModelRegistry import get_shape_model
+
+
+def compute_polyhedron_moments(
+    vertices,
+    faces,
+    degree,
+    radius,
+    n1,
+    n2,
+    quadrature_points,
+    quadrature_weights,
+    n_blocks,
+):
+    """Volume integrals of the solid harmonics (|y|/radius)^l aBar_lm (s+it)^m /
+    (2l + 1) over a polyhedron, accumulated per block of facets (n_blocks x
+    n_coefficients(degree)).
+
+    The solid harmonics are homogeneous polynomials of degree l, so the
+    divergence theorem turns each volume integral into
+    1/(l+3) sum_f (n_f . v_f) * integral over facet f, and the facet integrals are
+    exact for a quadrature rule of the same degree (triangle_quadrature)."""
+    N_faces = len(faces)
+    n_blocks = max(min(n_blocks, N_faces), 1)
+    block_size = (N_faces + n_blocks - 1) // n_blocks
+    C = np.zeros((n_blocks, n_coefficients(degree)))
+    S = np.zeros((n_blocks, n_coefficients(degree)))
+    for b in prange(n_blocks):
+        aBar = np.zeros((degree + 2, degree + 2))
+        rE = np.zeros((degree + 2,))
+        iM = np.zeros((degree + 2,))
+        rel = np.zeros((3,))
+        for f in range(b * block_size, min((b + 1) * block_size, N_faces)):
+            v0 = vertices[faces[f, 0]]
+            v1 = vertices[faces[f, 1]]
+            v2 = vertices[faces[f, 2]]
+
+            # (n_f . v_f) * area of the facet
+            height_area = np.dot(v0, np.cross(v1 - v0, v2 - v1)) / 2.0
+            for j in range(len(quadrature_weights)):
+                for k in range(3):
+                    rel[k] = (
+                        quadrature_points[j, 0] * v0[k]
+                        + quadrature_points[j, 1] * v1[k]
+                        + quadrature_points[j, 2] * v2[k]
+                    )
+                w = quadrature_weights[j] * height_area
+                if rel[0] ** 2 + rel[1] ** 2 + rel[2] ** 2 == 0.0:
+                    C[b, 0] += w / 3.0
+                    continue
+                r = compute_expansion_terms(rel, degree, n1, n2, aBar, rE, iM)
+                rho_l = w
+                for l in range(0, degree + 1):  # noqa: E741
+                    term = rho_l / ((2.0 * l + 1.0) * (l + 3.0))
+                    for m in range(0, l + 1):
+                        lm = lm_index(l, m)
+                        C[b, lm] += term * aBar[l][m] * rE[m]
+                        S[b, lm] += term * aBar[l][m] * iM[m]
+                    rho_l *= r / radius
+    return C, S
+
+
+def polyhedron_stokes_coefficients(vertices, faces, degree, radius, parallel=True):
+    """Exact exterior Stokes coefficients of a constant density polyhedron, i.e.
+    the spherical harmonic expansion (same normalization as the Pines algorithm)
+    whose field matches the polyhedral model outside of the Brillouin sphere.
+    The cost grows as O(F * degree^4).
+
+    Args:
+        vertices (np.array): vertex locations (V x 3), in the units of radius
+        faces (np.array): vertex indices of each facet (F x 3)
+        degree (int): maximum degree of the expansion
+        radius (float): reference radius of the expansion
+        parallel (bool, optional): Integrate the facets across all numba threads.
+            Defaults to True.
+
+    Returns:
+        PackedCoefficients: the Stokes coefficients, C_00 = 1
+    """
+    vertices = np.ascontiguousarray(vertices, dtype=np.float64)
+    faces = np.ascontiguousarray(faces, dtype=np.int64)
+    n1, n2, _, _ = compute_n_matrices(degree)
+    moments = (
+        compute_polyhedron_moments_parallel
+        if parallel
+        else compute_polyhedron_moments_jit
+    )
+    C, S = moments(
+        vertices,
+        faces,
+        degree,
+        radius,
+        n1,
+        n2,
+        *triangle_quadrature(degree),
+        get_num_threads() if parallel else 1,
+    )
+    C, S = C.sum(axis=0), S.sum(axis=0)
+
+    # The degree 0 term is the volume of the polyhedron
+    volume = C[0]
+    return PackedCoefficients(C / volume, S / volume, degree)
+
+
+def brillouin_radius(vertices):
+    "Radius of the smallest origin centered sphere enclosing the vertices"
+    return float(np.max(np.linalg.norm(vertices, axis=1)))
+
+
+def get_polyhedral_sh_file(planet, obj_file, degree, scale_factor=1e3):
+    """Path to a spherical harmonic gravity file (same csv format as the other
+    gravity files, reference radius planet.radius) holding the exact
+    coefficients of the constant density shape model. The coefficients are
+    computed on first use and stored in the cache directory, keyed by the
+    contents of the shape model and the parameters.
+
+    Args:
+        planet (CelestialBody): body providing mu and the reference radius
+        obj_file (str): path to the shape model
+        degree (int): maximum degree of the expansion
+        scale_factor (float, optional): shape model units to meters.
+            Defaults to 1e3 (km).
+
+    Returns:
+        str: path of the gravity file, loadable by SphericalHarmonics
+    """
+    obj_file = make_windows_path_posix(obj_file)
+    shape_model = get_shape_model(obj_file)
+    digest = hashlib.sha256(shape_model.digest.encode())
+    digest.update(repr((planet.radius, planet.mu, scale_factor)).encode())
+    name = os.path.splitext(os.path.basename(obj_file))[0]
+    sh_file = (
+        f"{os.path.dirname(GravNN.__file__)}/Files/GravityModels/Cache/"
+        f"{name}_{digest.hexdigest()[:16]}_poly_sh_{degree}.csv"
+    )
+    if os.path.exists(sh_file):
+        return sh_file
+
+    coefficients = polyhedron_stokes_coefficients(
+        shape_model.vertices * scale_factor,
+        shape_model.faces,
+        degree,
+        planet.radius,
+    )
+
+    # Write to a temporary file first so a partial file is never picked up
+    tmp_file = sh_file + f".{os.getpid()}.tmp"
+    save(tmp_file, planet, *coefficients.to_dense())
+    os.replace(tmp_file, sh_file)
+    return sh_file
+
+
+def read_sh_file(sh_file, degree):
+    "Packed coefficients of degree <= degree from a file written by save"
+    data = np.loadtxt(sh_file, delimiter=",", skiprows=1, ndmin=2)
+    C = np.zeros((n_coefficients(degree),))
+    S = np.zeros((n_coefficients(degree),))
+    for l, m, C_lm, S_lm in data:  # noqa: E741
+        if l <= degree:
+            C[lm_index(int(l), int(m))] = C_lm
+            S[lm_index(int(l), int(m))] = S_lm
+    return PackedCoefficients(C, S, degree)
+
+
+def get_polyhedral_sh_solution(planet, obj_file, degree, scale_factor=1e3):
+    """RegressSolution holding the exact coefficients of a constant density shape
+    model (see get_polyhedral_sh_file), e.g. to build a SphericalHarmonics model
+    without going through the gravity file"""
+    sh_file = get_polyhedral_sh_file(planet, obj_file, degree, scale_factor)
+    coefficients = read_sh_file(sh_file, degree)
+    return RegressSolution(coefficients.to_solution(-1), degree, -1, planet)
+
+
+class PolyhedralHybrid(Polyhedral):
+    def __init__(
+        self,
+        celestial_body,
+        obj_file,
+        trajectory=None,
+        parallel=True,
+        degree=20,
+        brillouin_factor=2.0,
+    ):
+        """Constant density polyhedral gravity model which evaluates points far from
+        the body with the exact spherical harmonic expansion of the same shape
+        (see polyhedron_stokes_coefficients). Points beyond brillouin_factor
+        times the Brillouin radius cost O(degree^2) rather than O(F); the
+        remaining points use the polyhedral kernel.
+
+        Args:
+            celestial_body (CelestialBody): Body for gravity calc
+            obj_file (str): path to shape model of the body
+            trajectory (TrajectoryBase, optional): Trajectory / distribution for which
+                the gravity measurements should be computed. Defaults to None.
+            parallel (bool, optional): Evaluate the positions across the available
+                threads rather than serially. Defaults to True.
+            degree (int, optional): Degree of the far field expansion. Its relative
+                truncation error at the switch radius is roughly
+                brillouin_factor^-(degree+1). Defaults to 20.
+            brillouin_factor (float, optional): Switch radius in multiples of the
+                Brillouin radius (must be > 1). Defaults to 2.0.
+        """
+        if brillouin_factor <= 1.0:
+            raise ValueError(
+                f"brillouin_factor must exceed 1 (got {brillouin_factor}), the "
+                "expansion diverges inside the Brillouin sphere",
+            )
+        self.degree = degree
+        self.brillouin_factor = brillouin_factor
+        super().__init__(
+            celestial_body,
+            obj_file,
+            trajectory=trajectory,
+            parallel=parallel,
+        )
+
+        self.sh_file = get_polyhedral_sh_file(
+            celestial_body,
+            obj_file,
+            degree,
+            self.scaleFactor,
+        )
+        self.sh_radius = (
+            brillouin_radius(self.mesh.vertices * self.scaleFactor) * brillouin_factor
+        )
+        self.coefficients = read_sh_file(self.sh_file, degree)
+        self.n1, self.n2, self.n1q, self.n2q = compute_n_matrices(degree)
+
+    def generate_full_file_directory(self):
+        self.file_directory += (
+            os.path.splitext(os.path.basename(__file__))[0]
+            + "_"
+            + os.path.basename(self.obj_file).split(".")[0]
+            + f"_SH{self.degree}_B{self.brillouin_factor}"
+            + "/"
+        )
+
+    def compute_batch(self, positions):
+        """Compute the accelerations and potentials, routing the points beyond the
+        switch radius to the spherical harmonic expansion"""
+        positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+        far = np.linalg.norm(positions, axis=1) > self.sh_radius
+
+        accelerations = np.zeros(positions.shape)
+        potentials = np.zeros((len(positions),))
+        if np.any(~far):
+            acc, pot = super().compute_batch(positions[~far])
+            accelerations[~far] = acc
+            potentials[~far] = pot
+        if np.any(far):
+            acc, pot = compute_acc(
+                positions[far].reshape((-1,)),
+                self.degree,
+                self.planet.mu,
+                self.planet.radius,
+                self.n1,
+                self.n2,
+                self.n1q,
+                self.n2q,
+                self.coefficients.C,
+                self.coefficients.S,
+                parallel=self.parallel,
+            )
+            accelerations[far] = acc.reshape((-1, 3))
+            potentials[far] = pot
+
+        self.accelerations = accelerations
+        self.potentials = potentials
+        return self.accelerations, self.potentials
+
+
+compute_polyhedron_moments_jit = njit(
+    compute_polyhedron_moments,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_polyhedron_moments_parallel = njit(
+    compute_polyhedron_moments,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
@@ -0,0 +1,529 @@
+import os
+
+import numpy as np
+from numba import config, get_num_threads, njit, prange, set_num_threads
+
+from GravNN.GravityModels.PinesAlgorithm import (
+    compute_legendre,
+    compute_lon_terms,
+    compute_n_matrices,
+)
+from GravNN.GravityModels.PointMass import PointMass
+from GravNN.GravityModels.Polyhedral import Polyhedral
+from GravNN.GravityModels.SHCoefficients import lm_index, n_coefficients
+from GravNN.Support.PathTransformations import make_windows_path_posix
+from GravNN.Support.slurm_utils import get_run_id, get_shard_index
+
+
+def get_treecode_data(trajectory, obj_mesh_file, **kwargs):
+    override = bool(kwargs.get("override", [False])[0])
+    chunk_size = kwargs.get("chunk_size", [None])[0]
+    lease = kwargs.get("lease", [None])[0]
+    n_shards = kwargs.get("n_shards", [None])[0]
+    remove_point_mass = bool(kwargs.get("remove_point_mass", [False])[0])
+    theta = float(kwargs.get("theta", [0.4])[0])
+    order = int(kwargs.get("multipole_order", [12])[0])
+
+    obj_mesh_file = make_windows_path_posix(obj_mesh_file)
+
+    poly_r0_gm = PolyhedralTreecode(
+        trajectory.celestial_body,
+        obj_mesh_file,
+        trajectory=trajectory,
+        theta=theta,
+        order=order,
+    )
+    if n_shards is not None:
+        poly_r0_gm.generate_sharded(
+            n_shards,
+            shard=kwargs.get("shard_index", [get_shard_index()])[0],
+            processes=kwargs.get("shard_processes", [None])[0],
+            override=override,
+            run_id=kwargs.get("shard_run_id", [get_run_id()])[0],
+            lease=lease,
+            chunk_size=chunk_size,
+        )
+        override = False
+    poly_r0_gm.load(override=override, chunk_size=chunk_size, lease=lease)
+
+    x = poly_r0_gm.positions  # position (N x 3)
+    a = poly_r0_gm.accelerations
+    u = poly_r0_gm.potentials  # potential (N,)
+
+    if remove_point_mass:
+        point_mass_r0_gm = PointMass(trajectory.celestial_body, trajectory=trajectory)
+        point_mass_r0_gm.load(override=override)
+        a_pm = point_mass_r0_gm.accelerations
+        u_pm = point_mass_r0_gm.potentials
+
+        a = a - a_pm
+        u = u - u_pm
+
+    return x, a, u
+
+
+def triangle_quadrature(p):
+    """Collapsed (Duffy) Gauss-Legendre rule integrating polynomials of degree p
+    exactly over a triangle.
+
+    Returns:
+        tuple: barycentric coordinates (n x 3) and weights (n,) as fractions of
+        the facet area
+    """
+    x, w = np.polynomial.legendre.leggauss((p + 3) // 2)
+    x = (x + 1.0) / 2.0
+    xi, eta = np.meshgrid(x, x, indexing="ij")
+    weights = np.outer(w, w) * (1.0 - xi) / 2.0
+    b1 = xi
+    b2 = eta * (1.0 - xi)
+    points = np.stack((1.0 - b1 - b2, b1, b2), axis=-1).reshape((-1, 3))
+    return np.ascontiguousarray(points), weights.reshape((-1,))
+
+
+def build_facet_tree(vertices, faces, leaf_size):
+    """Octree over the facet centroids. The facets of every node are contiguous
+    in the returned facet order, so a node is described by a [start, end) range.
+
+    Returns:
+        tuple: facet order (F,), node centers (n x 3), node radii (n,) (distance
+        from the center to the furthest vertex of the node), node start and end
+        (n,), and the children of each node (n x 8, -1 if absent)
+    """
+    corners = vertices[faces]  # (F x 3 x 3)
+    centroids = corners.mean(axis=1)
+
+    order = []
+    centers, radii, starts, ends, children = [], [], [], [], []
+
+    def add_node(idx):
+        node = len(centers)
+        node_corners = corners[idx].reshape((-1, 3))
+        center = (node_corners.min(axis=0) + node_corners.max(axis=0)) / 2.0
+        centers.append(center)
+        radii.append(np.max(np.linalg.norm(node_corners - center, axis=1)))
+        starts.append(len(order))
+        ends.append(len(order))
+        children.append([-1] * 8)
+
+        octant = np.sum((centroids[idx] > center) * np.array([1, 2, 4]), axis=1)
+        if len(idx) <= leaf_size or np.all(octant == octant[0]):
+            order.extend(idx)
+        else:
+            for o in range(8):
+                if np.any(octant == o):
+                    children[node][o] = add_node(idx[octant == o])
+        ends[node] = len(order)
+        return node
+
+    add_node(np.arange(len(faces)))
+    return (
+        np.array(order, dtype=np.int64),
+        np.array(centers),
+        np.array(radii),
+        np.array(starts, dtype=np.int64),
+        np.array(ends, dtype=np.int64),
+        np.array(children, dtype=np.int64),
+    )
+
+
+def compute_facet_geometry(vertices, faces):
+    """Unit normals (F x 3), outward edge normals (F x 3 x 3) and edge lengths
+    (F x 3) of the edges (0, 1), (1, 2), (2, 0) of each facet, and facet areas (F,)"""
+    r0, r1, r2 = (vertices[faces[:, idx]] for idx in range(3))
+    cross = np.cross(r1 - r0, r2 - r1)
+    areas = np.linalg.norm(cross, axis=1) / 2.0
+    normals = cross / (2.0 * areas[:, None])
+
+    edges = np.stack((r1 - r0, r2 - r1, r0 - r2), axis=1)
+    edge_lengths = np.linalg.norm(edges, axis=2)
+    edge_normals = np.cross(edges, normals[:, None, :]) / edge_lengths[:, :, None]
+    return normals, edge_normals, edge_lengths, areas
+
+
+@njit(cache=True)
+def compute_expansion_terms(rel, p, n1, n2, aBar, rE, iM):
+    """Fill aBar, rE, iM for the direction of rel and return |rel|"""
+    r = np.sqrt(rel[0] ** 2 + rel[1] ** 2 + rel[2] ** 2)
+    compute_legendre(rel[2] / r, p, n1, n2, aBar)
+    compute_lon_terms(rel[0] / r, rel[1] / r, p, rE, iM)
+    return r
+
+
+def compute_node_expansions(
+    vertices,
+    faces,
+    normals,
+    areas,
+    centers,
+    radii,
+    starts,
+    ends,
+    p,
+    n1,
+    n2,
+    quadrature_points,
+    quadrature_weights,
+):
+    """Multipole expansions (degree p, about the node center with the node radius
+    as reference radius) of the potential of the four surface densities
+    [n . (v - c), n_x, n_y, n_z] spread uniformly over the facets of each node.
+    The coefficients use the same normalization as the Pines algorithm with
+    mu = 1, i.e. the potential of a unit point charge at y is
+    C_lm = (|y|/a)^l aBar_lm cos(m lambda) / (2l + 1). The facet integrals use a
+    quadrature rule exact to degree p (triangle_quadrature), so the moments are
+    exact."""
+    n_nodes = len(centers)
+    C = np.zeros((n_nodes, 4, n_coefficients(p)))
+    S = np.zeros((n_nodes, 4, n_coefficients(p)))
+    for node in prange(n_nodes):
+        aBar = np.zeros((p + 2, p + 2))
+        rE = np.zeros((p + 2,))
+        iM = np.zeros((p + 2,))
+        charges = np.zeros((4,))
+        rel = np.zeros((3,))
+        facet_C = np.zeros((n_coefficients(p),))
+        facet_S = np.zeros((n_coefficients(p),))
+        center = centers[node]
+        a = radii[node]
+        for f in range(starts[node], ends[node]):
+            v0 = vertices[faces[f, 0]]
+            v1 = vertices[faces[f, 1]]
+            v2 = vertices[faces[f, 2]]
+            charges[0] = (
+                normals[f, 0] * (v0[0] - center[0])
+                + normals[f, 1] * (v0[1] - center[1])
+                + normals[f, 2] * (v0[2] - center[2])
+            )
+            charges[1:] = normals[f]
+
+            # The densities are constant over the facet, so integrate the basis
+            # once and scale it by each density
+            facet_C[:] = 0.0
+            facet_S[:] = 0.0
+            for j in range(len(quadrature_weights)):
+                w = quadrature_weights[j] * areas[f]
+                for k in range(3):
+                    rel[k] = (
+                        quadrature_points[j, 0] * v0[k]
+                        + quadrature_points[j, 1] * v1[k]
+                        + quadrature_points[j, 2] * v2[k]
+                        - center[k]
+                    )
+                if rel[0] ** 2 + rel[1] ** 2 + rel[2] ** 2 == 0.0:
+                    facet_C[0] += w
+                    continue
+                r = compute_expansion_terms(rel, p, n1, n2, aBar, rE, iM)
+                rho_l = w
+                for l in range(0, p + 1):  # noqa: E741
+                    term = rho_l / (2.0 * l + 1.0)
+                    for m in range(0, l + 1):
+                        lm = lm_index(l, m)
+                        facet_C[lm] += term * aBar[l][m] * rE[m]
+                        facet_S[lm] += term * aBar[l][m] * iM[m]
+                    rho_l *= r / a
+            for q in range(4):
+                C[node, q] += charges[q] * facet_C
+                S[node, q] += charges[q] * facet_S
+    return C, S
+
+
+@njit(cache=True)
+def facet_potential(point, vertices, faces, normals, edge_normals, edge_lengths, f):
+    """Potential of a unit surface density on facet f at point, i.e. the integral
+    of 1/|y - x| over the facet, and the signed height n . (v - x) of the facet
+    plane above the point (Werner and Scheeres edge and facet terms)."""
+    r = np.zeros((3, 3))
+    R = np.zeros((3,))
+    for k in range(3):
+        for d in range(3):
+            r[k, d] = vertices[faces[f, k], d] - point[d]
+        R[k] = np.sqrt(r[k, 0] ** 2 + r[k, 1] ** 2 + r[k, 2] ** 2)
+
+    phi = 0.0
+    for k in range(3):
+        k1 = (k + 1) % 3
+        e = edge_lengths[f, k]
+        Le = np.log(R[k] + R[k1] + e) - np.log(R[k] + R[k1] - e)
+        n_r = (
+            edge_normals[f, k, 0] * r[k, 0]
+            + edge_normals[f, k, 1] * r[k, 1]
+            + edge_normals[f, k, 2] * r[k, 2]
+        )
+        phi += n_r * Le
+
+    wy = (
+        r[0, 0] * (r[1, 1] * r[2, 2] - r[1, 2] * r[2, 1])
+        + r[0, 1] * (r[1, 2] * r[2, 0] - r[1, 0] * r[2, 2])
+        + r[0, 2] * (r[1, 0] * r[2, 1] - r[1, 1] * r[2, 0])
+    )
+    wx = (
+        R[0] * R[1] * R[2]
+        + R[0] * (r[1, 0] * r[2, 0] + r[1, 1] * r[2, 1] + r[1, 2] * r[2, 2])
+        + R[1] * (r[2, 0] * r[0, 0] + r[2, 1] * r[0, 1] + r[2, 2] * r[0, 2])
+        + R[2] * (r[0, 0] * r[1, 0] + r[0, 1] * r[1, 1] + r[0, 2] * r[1, 2])
+    )
+    wf = 2.0 * np.arctan2(wy, wx)
+
+    h = normals[f, 0] * r[0, 0] + normals[f, 1] * r[0, 1] + normals[f, 2] * r[0, 2]
+    return phi - h * wf, h
+
+
+def compute_treecode_values(
+    points_scaled,
+    vertices,
+    faces,
+    normals,
+    edge_normals,
+    edge_lengths,
+    centers,
+    radii,
+    starts,
+    ends,
+    children,
+    C,
+    S,
+    p,
+    n1,
+    n2,
+    theta,
+    n_blocks,
+):
+    """Acceleration and potential (before the G*density scaling, same convention
+    as compute_poly_values) for a batch of points in mesh units.
+
+    Per facet, the Werner and Scheeres sums reduce to h_f phi_f (potential) and
+    -n_f phi_f (acceleration) where phi_f is the potential of a unit density on
+    facet f and h_f = n_f . (v_f - x). The tree is walked from the root: a node whose
+    radius is below theta times its distance to the point is evaluated from its
+    multipole expansions (h_f = n_f . (v_f - c) - n_f . (x - c)), leaves that are
+    too close are summed exactly."""
+    N = len(points_scaled)
+    acc = np.zeros((N, 3))
+    pot = np.zeros((N,))
+    if N == 0:
+        return acc, pot
+
+    n_blocks = max(min(n_blocks, N), 1)
+    block_size = (N + n_blocks - 1) // n_blocks
+    for b in prange(n_blocks):
+        aBar = np.zeros((p + 2, p + 2))
+        rE = np.zeros((p + 2,))
+        iM = np.zeros((p + 2,))
+        phi = np.zeros((4,))
+        rel = np.zeros((3,))
+        stack = np.zeros((len(centers) + 1,), dtype=np.int64)
+        for i in range(b * block_size, min((b + 1) * block_size, N)):
+            point = points_scaled[i]
+            stack[0] = 0
+            n_stack = 1
+            while n_stack > 0:
+                n_stack -= 1
+                node = stack[n_stack]
+                for k in range(3):
+                    rel[k] = point[k] - centers[node, k]
+                d = np.sqrt(rel[0] ** 2 + rel[1] ** 2 + rel[2] ** 2)
+                if radii[node] < theta * d:
+                    compute_expansion_terms(rel, p, n1, n2, aBar, rE, iM)
+                    phi[:] = 0.0
+                    rho_l = 1.0 / d
+                    for l in range(0, p + 1):  # noqa: E741
+                        for m in range(0, l + 1):
+                            lm = lm_index(l, m)
+                            for q in range(4):
+                                phi[q] += (
+                                    rho_l
+                                    * aBar[l][m]
+                                    * (C[node, q, lm] * rE[m] + S[node, q, lm] * iM[m])
+                                )
+                        rho_l *= radii[node] / d
+                    pot[i] += phi[0] - (
+                        rel[0] * phi[1] + rel[1] * phi[2] + rel[2] * phi[3]
+                    )
+                    for k in range(3):
+                        acc[i, k] -= phi[k + 1]
+                    continue
+
+                leaf = True
+                for o in range(8):
+                    if children[node, o] != -1:
+                        stack[n_stack] = children[node, o]
+                        n_stack += 1
+                        leaf = False
+                if leaf:
+                    for f in range(starts[node], ends[node]):
+                        phi_f, h = facet_potential(
+                            point,
+                            vertices,
+                            faces,
+                            normals,
+                            edge_normals,
+                            edge_lengths,
+                            f,
+                        )
+                        pot[i] += h * phi_f
+                        for k in range(3):
+                            acc[i, k] -= normals[f, k] * phi_f
+    return acc, pot
+
+
+class PolyhedralTreecode(Polyhedral):
+    def __init__(
+        self,
+        celestial_body,
+        obj_file,
+        trajectory=None,
+        parallel=True,
+        theta=0.4,
+        order=12,
+        leaf_size=32,
+    ):
+        """Hierarchical (treecode) evaluation of the constant density polyhedral
+        gravity model. The facets are grouped into an octree and each node stores
+        multipole expansions of its facets. Nodes that are well separated from
+        the evaluation point are evaluated from their expansion, the remaining
+        leaves with the exact Werner and Scheeres facet terms. The cost per
+        point therefore grows with log(F) rather than F. compute_hessian is
+        inherited and remains exact.
+
+        Args:
+            celestial_body (CelestialBody): Body for gravity calc
+            obj_file (str): path to shape model of the body
+            trajectory (TrajectoryBase, optional): Trajectory / distribution for which
+                the gravity measurements should be computed. Defaults to None.
+            parallel (bool, optional): Evaluate the positions across the available
+                threads rather than serially. Defaults to True.
+            theta (float, optional): Opening angle. A node is approximated when
+                its radius is below theta times its distance to the point. The
+                error of each approximated node decreases as theta^(order+1).
+                Defaults to 0.4.
+            order (int, optional): Degree of the multipole expansions.
+                Defaults to 12 (~1e-6 relative error with the default theta).
+            leaf_size (int, optional): Maximum number of facets per leaf.
+                Defaults to 32.
+        """
+        if order < 0:
+            raise ValueError(f"order must be non-negative, got {order}")
+        if not 0.0 <= theta < 1.0:
+            raise ValueError(f"theta must be in [0, 1), got {theta}")
+        self.theta = theta
+        self.order = order
+        self.leaf_size = leaf_size
+        super().__init__(
+            celestial_body,
+            obj_file,
+            trajectory=trajectory,
+            parallel=parallel,
+        )
+
+        (
+            facet_order,
+            self.centers,
+            self.radii,
+            self.starts,
+            self.ends,
+            self.children,
+        ) = build_facet_tree(self.mesh.vertices, self.mesh.faces, leaf_size)
+        self.tree_faces = np.ascontiguousarray(self.mesh.faces[facet_order])
+        (
+            self.normals,
+            self.edge_normals,
+            self.edge_lengths,
+            areas,
+        ) = compute_facet_geometry(self.mesh.vertices, self.tree_faces)
+
+        self.n1, self.n2, _, _ = compute_n_matrices(order)
+        compute_expansions = (
+            compute_node_expansions_parallel
+            if parallel
+            else compute_node_expansions_jit
+        )
+        self.C, self.S = compute_expansions(
+            self.mesh.vertices,
+            self.tree_faces,
+            self.normals,
+            areas,
+            self.centers,
+            self.radii,
+            self.starts,
+            self.ends,
+            order,
+            self.n1,
+            self.n2,
+            *triangle_quadrature(order),
+        )
+
+    def generate_full_file_directory(self):
+        self.file_directory += (
+            os.path.splitext(os.path.basename(__file__))[0]
+            + "_"
+            + os.path.basename(self.obj_file).split(".")[0]
+            + f"_Theta{self.theta}_Order{self.order}"
+            + "/"
+        )
+
+    def compute_batch(self, positions):
+        """Compute the accelerations and potentials of all positions in a single
+        call of the treecode kernel"""
+        points_scaled = np.ascontiguousarray(positions, dtype=np.float64).reshape(
+            (-1, 3),
+        )
+        points_scaled = points_scaled / self.scaleFactor
+        args = (
+            points_scaled,
+            self.mesh.vertices,
+            self.tree_faces,
+            self.normals,
+            self.edge_normals,
+            self.edge_lengths,
+            self.centers,
+            self.radii,
+            self.starts,
+            self.ends,
+            self.children,
+            self.C,
+            self.S,
+            self.order,
+            self.n1,
+            self.n2,
+            self.theta,
+        )
+        if self.parallel:
+            # Respect the cores allocated to the job (e.g. SLURM) rather than
+            # the cores of the node
+            n_threads = get_num_threads()
+            set_num_threads(max(min(self.processes, config.NUMBA_NUM_THREADS), 1))
+            try:
+                acc, pot = compute_treecode_values_parallel(*args, get_num_threads())
+            finally:
+                set_num_threads(n_threads)
+        else:
+            acc, pot = compute_treecode_values_jit(*args, 1)
+
+        self.set_values(acc, pot)
+        return self.accelerations, self.potentials
+
+
+compute_node_expansions_jit = njit(
+    compute_node_expansions,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_node_expansions_parallel = njit(
+    compute_node_expansions,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+compute_treecode_values_jit = njit(
+    compute_treecode_values,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_treecode_values_parallel = njit(
+    compute_treecode_values,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
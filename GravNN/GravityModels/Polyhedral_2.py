@@ -4,13 +4,13 @@ import os
 
 import matplotlib.pyplot as plt
 import numpy as np
-import trimesh
-from numba import njit
+from numba import config, get_num_threads, njit, prange, set_num_threads
 
 from GravNN.CelestialBodies.Asteroids import Eros
 from GravNN.GravityModels.GravityModelBase import GravityModelBase
 from GravNN.GravityModels.PointMass import PointMass
 from GravNN.Support.PathTransformations import make_windows_path_posix
+from GravNN.Support.ShapeModelRegistry import get_shape_model
 
 
 def get_poly_data(trajectory, obj_mesh_file, **kwargs):
@@ -44,84 +44,177 @@ def get_poly_data(trajectory, obj_mesh_file, **kwargs):
     return x, a, u
 
 
+def compute_geometry(vertices, faces, dtype=np.float64):
+    """Precompute the point independent geometry of the polyhedron as contiguous
+    arrays so each evaluation only needs to sweep them once.
+
+    Args:
+        vertices (np.array): vertex locations (V x 3)
+        faces (np.array): vertex indices of each facet (F x 3)
+        dtype (np.dtype, optional): storage precision of the normals, dyads and
+            lengths. Defaults to np.float64.
+
+    Returns:
+        tuple: facet normals (F x 3), unique edges (E x 2, lowest vertex first),
+        edge dyads (E x 3 x 3) summed over the facets adjacent to the edge, and
+        edge lengths (E,)
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces)
+    r_i, r_j, r_k = (vertices[faces[:, idx]] for idx in range(3))
+
+    face_normals = np.cross(r_j - r_i, r_k - r_j)
+    face_normals /= np.linalg.norm(face_normals, axis=1, keepdims=True)
+
+    # Edges (i, j), (j, k), (k, i) of every facet and their outward edge normals
+    face_edges = faces[:, [0, 1, 1, 2, 2, 0]].reshape((-1, 3, 2))
+    r21 = vertices[face_edges[:, :, 1]] - vertices[face_edges[:, :, 0]]
+    n21 = np.cross(r21, face_normals[:, None, :])
+    n21 /= np.linalg.norm(n21, axis=2, keepdims=True)
+    dyads = face_normals[:, None, :, None] * n21[:, :, None, :]
+
+    # Each edge is shared by two facets, so sum their dyads into a single term
+    edges, inverse = np.unique(
+        np.sort(face_edges.reshape((-1, 2)), axis=1),
+        axis=0,
+        return_inverse=True,
+    )
+    edge_dyads = np.zeros((len(edges), 3, 3))
+    np.add.at(edge_dyads, inverse.reshape((-1,)), dyads.reshape((-1, 3, 3)))
+    edge_lengths = np.linalg.norm(vertices[edges[:, 1]] - vertices[edges[:, 0]], axis=1)
+
+    return (
+        np.ascontiguousarray(face_normals, dtype=dtype),
+        np.ascontiguousarray(edges, dtype=np.int32),
+        np.ascontiguousarray(edge_dyads, dtype=dtype),
+        np.ascontiguousarray(edge_lengths, dtype=dtype),
+    )
+
+
 @njit(cache=True, parallel=False)
-def get_values(faces, vertices, point_scaled):
+def get_values(
+    point_scaled,
+    vertices,
+    faces,
+    face_normals,
+    edges,
+    edge_dyads,
+    edge_lengths,
+    r,
+    r_norm,
+):
+    """Potential and acceleration (before the G*density scaling) of a single
+    point using the precomputed geometry (see compute_geometry). The vertex
+    relative vectors and their norms are computed once into the caller supplied
+    scratch arrays r (V x 3) and r_norm (V,)."""
+    for v in range(len(vertices)):
+        r[v, 0] = vertices[v, 0] - point_scaled[0]
+        r[v, 1] = vertices[v, 1] - point_scaled[1]
+        r[v, 2] = vertices[v, 2] - point_scaled[2]
+        r_norm[v] = np.sqrt(r[v, 0] ** 2 + r[v, 1] ** 2 + r[v, 2] ** 2)
+
     U = np.float64(0.0)
     acc = np.zeros((3,), dtype=np.float64)
-    for face_idx, face in enumerate(faces):
-        i, j, k = face[0:3]  # vertex index
-        # vertex locations
-        vertices = vertices
-        r_i, r_j, r_k = vertices[face[0:3], :] - point_scaled
-
-        # Edges
-        e_1 = r_j - r_i
-        e_2 = r_k - r_j
-
-        # print("Max length between edges:", np.max(e_1)*1e3, np.max(e_2)*1e3)
-
-        # Facet normal
-        n_f = np.cross(e_1, e_2)
-        n_f /= np.linalg.norm(n_f)
-
-        for edge_idx in range(3):
-            if edge_idx == 0:
-                idx_min = i if i < j else j
-                r1, r2 = r_i, r_j
-            if edge_idx == 1:
-                idx_min = j if j < k else k
-                r1, r2 = r_j, r_k
-            if edge_idx == 2:
-                idx_min = i if i < k else k
-                r1, r2 = r_k, r_i
-
-            a = np.linalg.norm(r1)
-            b = np.linalg.norm(r2)
-            r_e = vertices[idx_min] - point_scaled
-
-            # compute the edge normal
-            r21 = r2 - r1
-            e = np.linalg.norm(r21)
-            n21 = np.cross(r21, n_f)
-            n21 /= np.linalg.norm(n21)
-
-            # compute the edge dyad
-            Ee = np.outer(n_f, n21)
-
-            # Compute Edge Performance Factor
-            # Le = np.log((a + b + e) / (a + b - e))
-            Le = np.log(a + b + e) - np.log(a + b - e)
-
-            # Add to edge acceleration and potential
-            acc -= Le * Ee @ r_e
-            U += Le * r_e @ Ee @ r_e
+    for edge_idx in range(len(edges)):
+        v0 = edges[edge_idx, 0]
+        v1 = edges[edge_idx, 1]
+
+        # Compute Edge Performance Factor
+        a = r_norm[v0]
+        b = r_norm[v1]
+        e = edge_lengths[edge_idx]
+        Le = np.log(a + b + e) - np.log(a + b - e)
+
+        # Add to edge acceleration and potential (r_e is any point on the edge)
+        E = edge_dyads[edge_idx]
+        r_e0, r_e1, r_e2 = r[v0, 0], r[v0, 1], r[v0, 2]
+        Er_0 = E[0, 0] * r_e0 + E[0, 1] * r_e1 + E[0, 2] * r_e2
+        Er_1 = E[1, 0] * r_e0 + E[1, 1] * r_e1 + E[1, 2] * r_e2
+        Er_2 = E[2, 0] * r_e0 + E[2, 1] * r_e1 + E[2, 2] * r_e2
+        acc[0] -= Le * Er_0
+        acc[1] -= Le * Er_1
+        acc[2] -= Le * Er_2
+        U += Le * (r_e0 * Er_0 + r_e1 * Er_1 + r_e2 * Er_2)
+
+    for face_idx in range(len(faces)):
+        i = faces[face_idx, 0]
+        j = faces[face_idx, 1]
+        k = faces[face_idx, 2]
+        r_i, r_j, r_k = r[i], r[j], r[k]
+        R1, R2, R3 = r_norm[i], r_norm[j], r_norm[k]
 
         # compute the solid angle for the facet
-        R1 = np.linalg.norm(r_i)
-        R2 = np.linalg.norm(r_j)
-        R3 = np.linalg.norm(r_k)
-
-        wy = r_i @ np.cross(r_j, r_k)
+        wy = (
+            r_i[0] * (r_j[1] * r_k[2] - r_j[2] * r_k[1])
+            + r_i[1] * (r_j[2] * r_k[0] - r_j[0] * r_k[2])
+            + r_i[2] * (r_j[0] * r_k[1] - r_j[1] * r_k[0])
+        )
         wx = (
             R1 * R2 * R3
-            + R1 * np.dot(r_j, r_k)
-            + R2 * np.dot(r_k, r_i)
-            + R3 * np.dot(r_i, r_j)
+            + R1 * (r_j[0] * r_k[0] + r_j[1] * r_k[1] + r_j[2] * r_k[2])
+            + R2 * (r_k[0] * r_i[0] + r_k[1] * r_i[1] + r_k[2] * r_i[2])
+            + R3 * (r_i[0] * r_j[0] + r_i[1] * r_j[1] + r_i[2] * r_j[2])
         )
         wf = 2.0 * np.arctan2(wy, wx)
 
-        # pot -= wf * np.dot(r_f, np.dot(F, r_f))
-        # acc += wf * np.dot(F, r_f)
-
-        F = np.outer(n_f, n_f)
-        U -= r_i @ F @ r_i * wf
-        acc += F @ r_i * wf
-        # U -= r_i @ n_f @ np.outer(n_f, r_i)* wf
-        # a += n_f @ np.outer(n_f, r_i) * wf
+        # F = n_f n_f^T, so F r_i = n_f (n_f . r_i)
+        n_f = face_normals[face_idx]
+        n_r = n_f[0] * r_i[0] + n_f[1] * r_i[1] + n_f[2] * r_i[2]
+        U -= n_r * n_r * wf
+        acc[0] += n_f[0] * n_r * wf
+        acc[1] += n_f[1] * n_r * wf
+        acc[2] += n_f[2] * n_r * wf
 
     return U, acc
 
 
+def compute_poly_values(
+    points_scaled,
+    vertices,
+    faces,
+    face_normals,
+    edges,
+    edge_dyads,
+    edge_lengths,
+    n_blocks,
+):
+    """get_values for a batch of points (N x 3) in mesh units. The points are split
+    into n_blocks contiguous blocks which allocate the vertex scratch once. When
+    compiled with parallel=True, the blocks are evaluated concurrently and share
+    the geometry arrays rather than receiving a copy of the model."""
+    N = len(points_scaled)
+    acc = np.zeros((N, 3))
+    pot = np.zeros((N,))
+    if N == 0:
+        return acc, pot
+
+    n_blocks = max(min(n_blocks, N), 1)
+    block_size = (N + n_blocks - 1) // n_blocks
+    for b in prange(n_blocks):
+        r = np.zeros((len(vertices), 3))
+        r_norm = np.zeros((len(vertices),))
+        for i in range(b * block_size, min((b + 1) * block_size, N)):
+            pot[i], acc[i] = get_values(
+                points_scaled[i],
+                vertices,
+                faces,
+                face_normals,
+                edges,
+                edge_dyads,
+                edge_lengths,
+                r,
+                r_norm,
+            )
+    return acc, pot
+
+
+def compute_tetrahedra_volume(shape_model):
+    """Sum of the unsigned volumes of the tetrahedra spanned by the origin and each
+    facet of a ShapeModel (see ShapeModelRegistry)"""
+    r1, r2, r3 = (shape_model.vertices[shape_model.faces[:, i]] for i in range(3))
+    return np.sum(np.abs(np.einsum("ij,ij->i", np.cross(r1, r2), r3))) / 6.0
+
+
 class Mesh:
     def __init__(self, trimesh):
         self.vertices = copy.deepcopy(np.array(trimesh.vertices, dtype=np.float64))
@@ -132,7 +225,14 @@ class Mesh:
 
 
 class Polyhedral_2(GravityModelBase):
-    def __init__(self, celestial_body, obj_file, trajectory=None):
+    def __init__(
+        self,
+        celestial_body,
+        obj_file,
+        trajectory=None,
+        parallel=True,
+        geometry_dtype=np.float64,
+    ):
         """Polyhedral gravity model based on work from Werner and Scheeres
         (https://link.springer.com/article/10.1007/BF00053511)
         The model computes the accelerations from a constant density polyhedral shape
@@ -143,26 +243,48 @@ class Polyhedral_2(GravityModelBase):
             obj_file (str): path to shape model of the body
             trajectory (TrajectoryBase, optional): Trajectory / distribution for which
                 the gravity measurements should be computed. Defaults to None.
+            parallel (bool, optional): Evaluate the positions across the available
+                threads rather than serially. Defaults to True.
+            geometry_dtype (np.dtype, optional): Storage precision of the
+                precomputed normals, dyads, and edge lengths. np.float32 halves
+                their memory traffic at the cost of ~1e-7 relative accuracy.
+                Defaults to np.float64.
         """
-        super().__init__(celestial_body, obj_file, trajectory=trajectory)
+        super().__init__(
+            celestial_body,
+            obj_file,
+            trajectory=trajectory,
+            parallel=parallel,
+            geometry_dtype=geometry_dtype,
+        )
         self.obj_file = obj_file
+        self.parallel = parallel
+        self.geometry_dtype = np.dtype(geometry_dtype)
 
         self.configure(trajectory)
 
         self.planet = celestial_body
         obj_file = make_windows_path_posix(obj_file)
-        filename, file_extension = os.path.splitext(obj_file)
-        self.mesh = trimesh.load_mesh(
-            obj_file,
-            file_type=file_extension[1:],
-            dtype=np.float64,
-        )
-        # self.mesh = trimesh.load_mesh(obj_file, file_type=file_extension[1:], process=False)
+        self.shape_model = get_shape_model(obj_file)
+        self.mesh = self.shape_model
         self.scaleFactor = 1e3  # Assume that the mesh is given in km
         self.volume = self.compute_volume()
         self.density = self.compute_density()
 
         self.reduce_mesh_memory()
+        (
+            self.face_normals,
+            self.edges,
+            self.edge_dyads,
+            self.edge_lengths,
+        ) = self.shape_model.derived(
+            f"polyhedral_2_geometry_{self.geometry_dtype.name}",
+            lambda shape: compute_geometry(
+                self.mesh.vertices,
+                self.mesh.faces,
+                self.geometry_dtype,
+            ),
+        )
         self.get_available_cores()
 
     def get_available_cores(self):
@@ -183,16 +305,15 @@ class Polyhedral_2(GravityModelBase):
             os.path.splitext(os.path.basename(__file__))[0]
             + "_"
             + os.path.basename(self.obj_file).split(".")[0]
-            + "/"
         )
-        pass
+        # Reduced precision geometry produces (slightly) different values
+        if self.geometry_dtype != np.float64:
+            self.file_directory += "_" + self.geometry_dtype.name
+        self.file_directory += "/"
 
     def compute_volume(self):
-        V = 0
-        for face in self.mesh.faces:
-            r1, r2, r3 = self.mesh.vertices[face[0:3], :] * self.scaleFactor
-            V += np.abs(np.cross(r1, r2) @ r3) / 6.0
-        return float(V)
+        V = self.shape_model.derived("tetrahedra_volume", compute_tetrahedra_volume)
+        return float(V) * self.scaleFactor**3
 
     def compute_density(self):
         volume = self.mesh.volume * 1e9  # m^3
@@ -268,20 +389,7 @@ class Polyhedral_2(GravityModelBase):
         if positions is None:
             positions = self.trajectory.positions
 
-        # bar = ProgressBar(positions.shape[0], enable=pbar)
-        self.accelerations = np.zeros(positions.shape)
-        self.potentials = np.zeros(len(positions))
-
-        if len(positions) == 1:
-            results = map(self.compute_values, positions)
-        else:
-            with mp.Pool(processes=self.processes) as pool:
-                results = pool.map(self.compute_values, positions)
-
-        for i, result in enumerate(results):
-            self.accelerations[i] = result[0]
-            self.potentials[i] = result[1]
-
+        self.compute_batch(positions)
         return self.accelerations
 
     def compute_potential(self, positions=None):
@@ -289,32 +397,64 @@ class Polyhedral_2(GravityModelBase):
         if positions is None:
             positions = self.trajectory.positions
 
-        self.accelerations = np.zeros(positions.shape)
-        self.potentials = np.zeros(len(positions))
+        self.compute_batch(positions)
+        return self.potentials
 
-        if len(positions) == 1:
-            results = map(self.compute_values, positions)
+    def compute_batch(self, positions):
+        """Compute the accelerations and potentials of all positions in a single
+        call of the multi-point kernel"""
+        G = 6.67430 * 10**-11
+
+        points_scaled = np.ascontiguousarray(positions, dtype=np.float64).reshape(
+            (-1, 3),
+        )
+        points_scaled = points_scaled / self.scaleFactor
+        args = (
+            points_scaled,
+            self.mesh.vertices,
+            self.mesh.faces,
+            self.face_normals,
+            self.edges,
+            self.edge_dyads,
+            self.edge_lengths,
+        )
+        if self.parallel:
+            # Respect the cores allocated to the job (e.g. SLURM) rather than
+            # the cores of the node
+            n_threads = get_num_threads()
+            set_num_threads(max(min(self.processes, config.NUMBA_NUM_THREADS), 1))
+            try:
+                acc, pot = compute_poly_values_parallel(*args, get_num_threads())
+            finally:
+                set_num_threads(n_threads)
         else:
-            with mp.Pool(processes=self.processes) as pool:
-                results = pool.map(self.compute_values, positions)
+            acc, pot = compute_poly_values_jit(*args, 1)
 
-        for i, result in enumerate(results):
-            self.accelerations[i] = result[0]
-            self.potentials[i] = result[1]
+        pot *= 1.0 / 2.0 * G * self.density * self.scaleFactor**2
+        acc *= G * self.density * self.scaleFactor
 
-        return self.potentials
+        # the paper gives delta U, not a.
+        # Given that a is already standard, we are going to negate U
+        self.accelerations = acc
+        self.potentials = -pot
+        return self.accelerations, self.potentials
 
     def compute_values(self, position):
         # G = 6.67408 * 1e-11  # m^3/(kg s^2)
         G = 6.67430 * 10**-11
 
-        acc = np.zeros((3,))
-        pot = 0.0
-
-        # point_scaled = position
-        # pot, acc = get_values(self.mesh.faces, self.mesh.vertices*self.scaleFactor, point_scaled)
-        point_scaled = position / self.scaleFactor
-        pot, acc = get_values(self.mesh.faces, self.mesh.vertices, point_scaled)
+        point_scaled = np.asarray(position, dtype=np.float64) / self.scaleFactor
+        pot, acc = get_values(
+            point_scaled,
+            self.mesh.vertices,
+            self.mesh.faces,
+            self.face_normals,
+            self.edges,
+            self.edge_dyads,
+            self.edge_lengths,
+            np.zeros((len(self.mesh.vertices), 3)),
+            np.zeros((len(self.mesh.vertices),)),
+        )
 
         pot *= 1.0 / 2.0 * G * self.density * self.scaleFactor**2
         acc *= G * self.density * self.scaleFactor
@@ -344,5 +484,18 @@ def main():
     print(timeList)
 
 
+compute_poly_values_jit = njit(
+    compute_poly_values,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_poly_values_parallel = njit(
+    compute_poly_values,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,137 @@
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def lm_index(l, m):  # noqa: E741
+    """Position of (l, m) in a packed lower-triangular array. Entries are stored
+    degree by degree, i.e. (0,0), (1,0), (1,1), (2,0), ... so the orders of a
+    given degree are contiguous."""
+    return l * (l + 1) // 2 + m
+
+
+@njit(cache=True)
+def order_index(l, m, N):  # noqa: E741
+    """Position of (l, m) in an order-major packed array of degrees <= N. Entries
+    are stored order by order, i.e. (0,0), (1,0), ..., (N,0), (1,1), ... so the
+    degrees of a given order are contiguous (see to_order_major)."""
+    return m * (N + 1) - m * (m - 1) // 2 + l - m
+
+
+@njit(cache=True)
+def n_coefficients(N):
+    "Number of (l, m) pairs with 0 <= m <= l <= N"
+    return (N + 1) * (N + 2) // 2
+
+
+@njit(cache=True)
+def solution_index(l, m, remove_deg):  # noqa: E741
+    """Column of C_lm in the interleaved [C, S] parameter vector estimated by the
+    regressors (S_lm is the following column). The degrees <= remove_deg are not
+    part of the vector."""
+    return 2 * (lm_index(l, m) - lm_index(remove_deg + 1, 0))
+
+
+def pack(array, N):
+    """Packed copy of the lower triangle (degrees <= N) of a dense [l][m] array.
+    Entries missing from the dense array are zero."""
+    array = np.asarray(array, dtype=np.float64)
+    rows, cols = np.tril_indices(N + 1)
+    valid = (rows < array.shape[0]) & (cols < array.shape[1])
+    packed = np.zeros((n_coefficients(N),))
+    packed[valid] = array[rows[valid], cols[valid]]
+    return packed
+
+
+def unpack(packed, N):
+    """Dense (N+1, N+1) [l][m] copy of the first N degrees of a packed array.
+    Degrees missing from the packed array are zero."""
+    rows, cols = np.tril_indices(N + 1)
+    n = min(len(packed), len(rows))
+    array = np.zeros((N + 1, N + 1))
+    array[rows[:n], cols[:n]] = packed[:n]
+    return array
+
+
+def to_order_major(packed, N):
+    """Order-major copy (see order_index) of the degrees <= N of a packed array.
+    Degrees missing from the packed array are zero."""
+    m = np.repeat(np.arange(N + 1), np.arange(N + 1, 0, -1))
+    start = m * (N + 1) - m * (m - 1) // 2
+    l = m + np.arange(len(m)) - start  # noqa: E741
+    source = l * (l + 1) // 2 + m
+    valid = source < len(packed)
+    array = np.zeros((len(m),))
+    array[valid] = np.asarray(packed)[source[valid]]
+    return array
+
+
+def as_packed(array):
+    """Packed coefficients for either layout, so the kernels keep accepting the
+    dense [l][m] arrays used by older scripts. Packed arrays are returned as is."""
+    array = np.asarray(array)
+    if array.ndim == 2:
+        return pack(array, len(array) - 1)
+    return array
+
+
+def packed_degree(packed):
+    "Highest degree fully contained in a packed array"
+    N = int((np.sqrt(8 * len(packed) + 1) - 3) // 2)
+    while n_coefficients(N + 1) <= len(packed):
+        N += 1
+    return N
+
+
+class PackedCoefficients:
+    def __init__(self, C, S, degree):
+        """Stokes coefficients stored as packed lower-triangular arrays (see
+        lm_index). This halves the memory of the dense square [l][m] arrays and
+        is the layout consumed by the Pines kernels, the regressors, and the
+        PinesAlgorithmLayer.
+
+        Args:
+            C (np.array): packed C_lm (n_coefficients(degree),)
+            S (np.array): packed S_lm (n_coefficients(degree),)
+            degree (int): highest degree stored
+        """
+        self.C = C
+        self.S = S
+        self.degree = degree
+
+    @classmethod
+    def from_dense(cls, C_lm, S_lm, degree=None):
+        if degree is None:
+            degree = len(C_lm) - 1
+        return cls(pack(C_lm, degree), pack(S_lm, degree), degree)
+
+    @classmethod
+    def from_solution(cls, coefficients, regress_deg, remove_deg):
+        """Coefficients from the interleaved [C_lm, S_lm, ...] vector estimated by
+        the regressors (degrees remove_deg+1..regress_deg). If degrees were
+        removed, C_00 is set to 1."""
+        coefficients = np.reshape(coefficients, (-1, 2))
+        C = np.zeros((n_coefficients(regress_deg),))
+        S = np.zeros((n_coefficients(regress_deg),))
+        if remove_deg != -1:
+            C[0] = 1.0
+
+        start = lm_index(remove_deg + 1, 0)
+        C[start:] = coefficients[:, 0]
+        S[start:] = coefficients[:, 1]
+        return cls(C, S, regress_deg)
+
+    def to_dense(self):
+        return unpack(self.C, self.degree), unpack(self.S, self.degree)
+
+    def to_solution(self, remove_deg):
+        "Interleaved [C_lm, S_lm, ...] vector of the degrees > remove_deg"
+        start = lm_index(remove_deg + 1, 0)
+        return np.stack((self.C[start:], self.S[start:]), axis=1).reshape((-1,))
+
+    def populate_removed_degrees(self, other, remove_deg):
+        "Copy the degrees <= remove_deg from other"
+        stop = lm_index(remove_deg + 1, 0)
+        self.C[:stop] = other.C[:stop]
+        self.S[:stop] = other.S[:stop]
+        return self
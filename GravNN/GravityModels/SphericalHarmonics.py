@@ -1,12 +1,18 @@
 import csv
+import hashlib
 import json
 import os
+import tempfile
+from functools import partial
 
 import numpy as np
 
+import GravNN
 from GravNN.GravityModels.GravityModelBase import GravityModelBase
 from GravNN.GravityModels.PinesAlgorithm import *
+from GravNN.GravityModels.SHCoefficients import PackedCoefficients
 from GravNN.Regression.utils import RegressSolution
+from GravNN.Support.slurm_utils import get_run_id, get_shard_index
 
 
 def make_2D_array(lis):
@@ -21,6 +27,62 @@ def make_2D_array(lis):
     return arr
 
 
+def coefficient_cache_path(sh_file, degree):
+    """Location of the binary copy of a coefficient file. The key combines the
+    resolved path, size and modification time of the file (so an edited or replaced
+    file is converted again) with the requested degree."""
+    stat = os.stat(sh_file)
+    fingerprint = f"{os.path.realpath(sh_file)}_{stat.st_size}_{stat.st_mtime_ns}"
+    file_hash = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(sh_file))[0]
+    gravNN_dir = os.path.abspath(os.path.dirname(GravNN.__file__))
+    cache_dir = f"{gravNN_dir}/Files/GravityModels/Cache"
+    return f"{cache_dir}/{name}_{file_hash}_{degree}_packed.npy"
+
+
+def load_cached_coefficients(sh_file, degree):
+    """Memory map the cached coefficients of sh_file (read-only, so concurrent
+    processes share the same pages).
+
+    Returns:
+        tuple: (mu, radius, degree, PackedCoefficients) or None if no cache exists
+    """
+    path = coefficient_cache_path(sh_file, degree)
+    if not os.path.exists(path):
+        return None
+    data = np.load(path, mmap_mode="r")
+    mu, radius, max_degree, packed_degree = data[0, :4]
+    mu = None if np.isnan(mu) else float(mu)
+    radius = None if np.isnan(radius) else float(radius)
+    coefficients = PackedCoefficients(data[1], data[2], int(packed_degree))
+    return mu, radius, int(max_degree), coefficients
+
+
+def save_cached_coefficients(sh_file, degree, mu, radius, max_degree, coefficients):
+    """Store the parsed coefficients as a single (3, n) .npy array: a header row
+    holding [mu, radius, degree, packed degree] followed by the packed C_lm and
+    S_lm. The file is written to a temporary name and moved into place so readers
+    never observe a partially written cache."""
+    if len(coefficients.C) < 4:
+        return
+    path = coefficient_cache_path(sh_file, degree)
+    data = np.zeros((3, len(coefficients.C)))
+    data[0, :4] = [
+        np.nan if mu is None else mu,
+        np.nan if radius is None else radius,
+        max_degree,
+        coefficients.degree,
+    ]
+    data[1] = coefficients.C
+    data[2] = coefficients.S
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, data)
+    os.replace(tmp_path, path)
+
+
 def get_normalization(l, m):  # noqa: E741
     N = np.zeros((l + 1, l + 1))
     for i in range(0, l + 1):
@@ -37,7 +99,10 @@ def get_normalization(l, m):  # noqa: E741
 
 def get_sh_data(trajectory, gravity_file, **kwargs):
     override = bool(kwargs.get("override", [False])[0])
-    parallel = kwargs.get("parallel", False)
+    chunk_size = kwargs.get("chunk_size", [None])[0]
+    lease = kwargs.get("lease", [None])[0]
+    n_shards = kwargs.get("n_shards", [None])[0]
+    parallel = kwargs.get("parallel", True)
     try:
         max_deg = int(kwargs["max_deg"][0])
         deg_removed = int(kwargs["deg_removed"][0])
@@ -45,65 +110,83 @@ def get_sh_data(trajectory, gravity_file, **kwargs):
         max_deg = int(kwargs["max_deg"])
         deg_removed = int(kwargs["deg_removed"])
 
-    Call_r0_gm = SphericalHarmonics(
-        gravity_file,
-        degree=max_deg,
-        trajectory=trajectory,
-        parallel=parallel,
-    )
-    accelerations = Call_r0_gm.load(override=override).accelerations
-    potentials = Call_r0_gm.potentials
-
-    Clm_r0_gm = SphericalHarmonics(
-        gravity_file,
-        degree=deg_removed,
-        trajectory=trajectory,
-        parallel=parallel,
-    )
-    accelerations_Clm = Clm_r0_gm.load(override=override).accelerations
-    potentials_Clm = Clm_r0_gm.potentials
-
-    x = Call_r0_gm.positions  # position (N x 3)
-    a = accelerations - accelerations_Clm
-    u = potentials - potentials_Clm  # (N,)
+    if deg_removed < 0:
+        sh_r0_gm = SphericalHarmonics(
+            gravity_file,
+            degree=max_deg,
+            trajectory=trajectory,
+            parallel=parallel,
+        )
+    else:
+        # Only sum degrees deg_removed+1..max_deg in a single sweep rather than
+        # differencing two full evaluations.
+        sh_r0_gm = SphericalHarmonicsDegRemoved(
+            gravity_file,
+            max_deg,
+            deg_removed,
+            trajectory=trajectory,
+            parallel=parallel,
+        )
+    if n_shards is not None:
+        sh_r0_gm.generate_sharded(
+            n_shards,
+            shard=kwargs.get("shard_index", [get_shard_index()])[0],
+            processes=kwargs.get("shard_processes", [None])[0],
+            override=override,
+            run_id=kwargs.get("shard_run_id", [get_run_id()])[0],
+            lease=lease,
+            chunk_size=chunk_size,
+        )
+        override = False
+    sh_r0_gm.load(override=override, chunk_size=chunk_size, lease=lease)
+
+    x = sh_r0_gm.positions  # position (N x 3)
+    a = sh_r0_gm.accelerations
+    u = sh_r0_gm.potentials  # (N,)
 
     return x, a, u
 
 
-class SphericalHarmonicsDegRemoved(GravityModelBase):
-    def __init__(self, sh_info, degree, remove_deg, trajectory=None, parallel=False):
-        self.sh_hf = SphericalHarmonics(sh_info, degree, trajectory)
-        self.sh_lf = SphericalHarmonics(sh_info, remove_deg, trajectory)
-        super().__init__()
-        self.configure(trajectory)
-        self.deg_removed = degree
+def get_sh_shell_data(directions, radii, gravity_file, **kwargs):
+    """Spherical harmonic accelerations and potentials for one set of directions
+    evaluated on several spherical shells, reusing the angular terms across radii.
 
-    def compute_potential(self, positions=None):
-        if positions is None:
-            positions = self.trajectory.positions
-        self.sh_hf.compute_potential(positions)
-        self.sh_lf.compute_potential(positions)
-        self.potentials = self.sh_hf.potentials - self.sh_lf.potentials
-        return self.potentials
-
-    def compute_acceleration(self, positions=None):
-        if positions is None:
-            positions = self.trajectory.positions
-        self.sh_hf.compute_acceleration(positions)
-        self.sh_lf.compute_acceleration(positions)
-        self.accelerations = self.sh_hf.accelerations - self.sh_lf.accelerations
-        return self.accelerations
+    Returns:
+        tuple: accelerations (len(radii), N, 3) and potentials (len(radii), N)
+    """
+    parallel = kwargs.get("parallel", True)
+    try:
+        max_deg = int(kwargs["max_deg"][0])
+        deg_removed = int(kwargs["deg_removed"][0])
+    except Exception:
+        max_deg = int(kwargs["max_deg"])
+        deg_removed = int(kwargs["deg_removed"])
 
-    def generate_full_file_directory(self):
-        class_name = self.__class__.__name__
-        obj_file = os.path.basename(self.sh_hf.file).split(".csv")[0].split(".txt")[0]
-        hf_deg = str(self.sh_hf.degree)
-        lf_deg = str(self.sh_lf.degree)
-        self.file_directory += f"{class_name}_{obj_file}_{hf_deg}_{lf_deg}/"
+    if deg_removed < 0:
+        sh_r0_gm = SphericalHarmonics(gravity_file, max_deg, parallel=parallel)
+    else:
+        sh_r0_gm = SphericalHarmonicsDegRemoved(
+            gravity_file,
+            max_deg,
+            deg_removed,
+            parallel=parallel,
+        )
+    return sh_r0_gm.compute_shells(directions, radii)
 
 
 class SphericalHarmonics(GravityModelBase):
-    def __init__(self, sh_info, degree, trajectory=None, parallel=False):
+    # Degrees <= deg_removed are excluded from the expansion (-1 keeps all)
+    deg_removed = -1
+
+    def __init__(
+        self,
+        sh_info,
+        degree,
+        trajectory=None,
+        parallel=True,
+        low_memory=False,
+        tolerance=None,
+    ):
         """Spherical Harmonic Gravity Model. Takes in a set of Stokes coefficients and
         computes acceleration and potentials using a non-singular representation
         (Pines Algorithm).
@@ -113,15 +196,32 @@ class SphericalHarmonics(GravityModelBase):
             degree (int): maximum degree of the spherical harmonic expansions
             trajectory (TrajectoryBase, optional): Trajectory / distribution for which
             the gravity measurements should be produced. Defaults to None.
+            parallel (bool, optional): Evaluate the positions across all available
+            threads rather than serially. Defaults to True.
+            low_memory (bool, optional): Run the Legendre recursion one order at a
+            time so only O(degree) scratch is held per thread. Recommended for
+            very high degree expansions. Defaults to False.
+            tolerance (float, optional): Acceleration accuracy target. If provided,
+            each position stops summing degrees once the degree variance estimate
+            of the omitted terms is below the tolerance, which makes high altitude
+            samples much cheaper. Defaults to None (always use the full degree).
         """
-        super().__init__(sh_info, degree, trajectory=trajectory, parallel=parallel)
+        super().__init__(
+            sh_info,
+            degree,
+            trajectory=trajectory,
+            parallel=parallel,
+            low_memory=low_memory,
+            tolerance=tolerance,
+        )
 
         self.degree = degree
+        self.tolerance = tolerance
 
         self.mu = None
         self.radEquator = None
-        self.C_lm = None
-        self.S_lm = None
+        self.coefficients = None
+        self._dense_coefficients = None
 
         if isinstance(sh_info, RegressSolution):
             self.file = "./"
@@ -138,11 +238,29 @@ class SphericalHarmonics(GravityModelBase):
 
         self.n1, self.n2, self.n1q, self.n2q = compute_n_matrices(self.degree)
 
-        # if parallel:
-        #     self.compute_fcn = compute_acc_parallel
-        # else:
-        #     self.compute_fcn = compute_acc_jit
-        # pass
+        self.parallel = parallel
+        if tolerance is not None:
+            self.compute_fcn = partial(
+                compute_acc_adaptive,
+                tol=tolerance,
+                parallel=parallel,
+            )
+        elif low_memory:
+            self.compute_fcn = partial(
+                compute_acc_low_memory,
+                parallel=parallel,
+                tables=order_major_tables(
+                    self.degree,
+                    self.n1,
+                    self.n2,
+                    self.n1q,
+                    self.n2q,
+                    self.coefficients.C,
+                    self.coefficients.S,
+                ),
+            )
+        else:
+            self.compute_fcn = partial(compute_acc, parallel=parallel)
 
     def generate_full_file_directory(self):
         self.file_directory += (
@@ -151,10 +269,17 @@ class SphericalHarmonics(GravityModelBase):
             + os.path.basename(self.file).split(".csv")[0].split(".txt")[0]
             + "_"
             + str(self.degree)
+            + self.tolerance_suffix()
             + "/"
         )
         pass
 
+    def tolerance_suffix(self):
+        "Keep adaptively truncated results separate from the full degree ones"
+        if self.tolerance is None:
+            return ""
+        return f"_Tol{self.tolerance}"
+
     def loadSH_json(self):
         data = json.load(open(self.file, "r"))
         clm = np.zeros((40, 40)).tolist()
@@ -181,8 +306,10 @@ class SphericalHarmonics(GravityModelBase):
 
         self.mu = data["totalMass"]["value"] * 6.67408 * 1e-11
         self.radEquator = data["referenceRadius"]["value"]
-        self.C_lm = make_2D_array(clm)
-        self.S_lm = make_2D_array(slm)
+        self.coefficients = PackedCoefficients.from_dense(
+            make_2D_array(clm),
+            make_2D_array(slm),
+        )
         return
 
     def loadSH_csv(self):
@@ -236,33 +363,72 @@ class SphericalHarmonics(GravityModelBase):
             if self.degree is None:
                 self.degree = currDeg - 2
 
-            self.C_lm = make_2D_array(clmList)
-            self.S_lm = make_2D_array(slmList)
+            self.coefficients = PackedCoefficients.from_dense(
+                make_2D_array(clmList),
+                make_2D_array(slmList),
+            )
             return
 
     def loadSH(self):
+        # Parsing the text files dominates construction for large expansions, so
+        # the parsed coefficients are cached in a memory mapped binary file.
+        requested_degree = self.degree
+        cached = load_cached_coefficients(self.file, requested_degree)
+        if cached is not None:
+            self.mu, self.radEquator, self.degree, self.coefficients = cached
+            return
+
         if ".json" in self.file:
             self.loadSH_json()
         else:
             self.loadSH_csv()
 
+        save_cached_coefficients(
+            self.file,
+            requested_degree,
+            self.mu,
+            self.radEquator,
+            self.degree,
+            self.coefficients,
+        )
+
+    @property
+    def C_lm(self):
+        "Dense [l][m] copy of the C coefficients (the models store them packed)"
+        return self.dense_coefficients()[0]
+
+    @property
+    def S_lm(self):
+        "Dense [l][m] copy of the S coefficients (the models store them packed)"
+        return self.dense_coefficients()[1]
+
+    def dense_coefficients(self):
+        cached = self._dense_coefficients
+        if cached is None or cached[0] is not self.coefficients:
+            cached = (self.coefficients, *self.coefficients.to_dense())
+            self._dense_coefficients = cached
+        return cached[1:]
+
     def load_regression(self, reg_solution):
         self.file_directory += "_Regress"
         self.mu = reg_solution.planet.mu
         self.radEquator = reg_solution.planet.radius
-        self.C_lm = reg_solution.C_lm
-        self.S_lm = reg_solution.S_lm
+        self.coefficients = reg_solution.coefficients
 
         return
 
     def compute_potential(self, positions=None):
         "Compute the potential for an existing trajectory or provided set of positions"
+        if positions is None and self.on_dh_grid():
+            self.compute_grid()
+            return self.potentials
+
         if positions is None:
             positions = self.trajectory.positions
 
         positions = np.reshape(positions, (len(positions) * 3))
 
-        accelerations, potentials = compute_acc(
+        accelerations, potentials = self.compute_fcn(
             positions,
             self.degree,
             self.mu,
@@ -271,8 +437,9 @@ class SphericalHarmonics(GravityModelBase):
             self.n2,
             self.n1q,
             self.n2q,
-            self.C_lm,
-            self.S_lm,
+            self.coefficients.C,
+            self.coefficients.S,
+            deg_removed=self.deg_removed,
         )
 
         self.accelerations = np.reshape(
@@ -285,12 +452,16 @@ class SphericalHarmonics(GravityModelBase):
 
     def compute_acceleration(self, positions=None):
         "Compute the acceleration for an existing trajectory or set of positions"
+        if positions is None and self.on_dh_grid():
+            self.compute_grid()
+            return self.accelerations
+
         if positions is None:
             positions = self.trajectory.positions
 
         positions = np.reshape(positions, (len(positions) * 3))
 
-        accelerations, potentials = compute_acc(
+        accelerations, potentials = self.compute_fcn(
             positions,
             self.degree,
             self.mu,
@@ -299,8 +470,9 @@ class SphericalHarmonics(GravityModelBase):
             self.n2,
             self.n1q,
             self.n2q,
-            self.C_lm,
-            self.S_lm,
+            self.coefficients.C,
+            self.coefficients.S,
+            deg_removed=self.deg_removed,
         )
 
         self.accelerations = np.reshape(
@@ -310,6 +482,194 @@ class SphericalHarmonics(GravityModelBase):
         self.potentials = potentials
         return self.accelerations
 
+    def on_dh_grid(self):
+        "Whether the trajectory is a constant radius DHGridDist"
+        # Imported here so loading the model doesn't import every distribution
+        from GravNN.Trajectories.DHGridDist import DHGridDist
+
+        return isinstance(self.trajectory, DHGridDist)
+
+    def compute_grid(self, trajectory=None):
+        """Compute the acceleration and potential on a DHGridDist using
+        latitude-ring reuse of the Legendre terms and an FFT over longitude
+        rather than evaluating every grid point independently.
+
+        Args:
+            trajectory (DHGridDist, optional): grid to evaluate. Defaults to the
+            model trajectory.
+
+        Returns:
+            tuple: accelerations (N, 3) and potentials (N,) in the same order as
+            the DHGridDist positions
+        """
+        if trajectory is None:
+            trajectory = self.trajectory
+
+        phi = np.linspace(0, np.pi, trajectory.N_lat, endpoint=True)
+        accelerations, potentials = compute_acc_grid(
+            phi,
+            trajectory.N_lon,
+            trajectory.radius,
+            self.degree,
+            self.mu,
+            self.radEquator,
+            self.n1,
+            self.n2,
+            self.n1q,
+            self.n2q,
+            self.coefficients.C,
+            self.coefficients.S,
+            parallel=self.parallel,
+            deg_removed=self.deg_removed,
+        )
+        self.accelerations = accelerations.reshape((-1, 3))
+        self.potentials = potentials.reshape((-1,))
+        return self.accelerations, self.potentials
+
+    def compute_shells(self, directions, radii):
+        """Compute the acceleration and potential for the same directions at
+        several radii. The Legendre and longitude terms are only computed once per
+        direction; each additional radius costs an O(degree) sum.
+
+        Args:
+            directions (np.array): directions or positions (N x 3)
+            radii (np.array): radii of the shells
+
+        Returns:
+            tuple: accelerations (len(radii), N, 3) and potentials (len(radii), N)
+        """
+        return compute_acc_shells(
+            directions,
+            radii,
+            self.degree,
+            self.mu,
+            self.radEquator,
+            self.n1,
+            self.n2,
+            self.n1q,
+            self.n2q,
+            self.coefficients.C,
+            self.coefficients.S,
+            parallel=self.parallel,
+            deg_removed=self.deg_removed,
+        )
+
+    def compute_truncated(self, degrees, positions=None):
+        """Compute the acceleration and potential of the expansion truncated at each
+        of the provided degrees from a single sweep of the recursion.
+
+        Args:
+            degrees (list): truncation degrees (each <= the model degree)
+            positions (np.array, optional): positions (N x 3). Defaults to the
+            trajectory positions.
+
+        Returns:
+            tuple: accelerations (len(degrees), N, 3) and potentials
+            (len(degrees), N)
+        """
+        if positions is None:
+            positions = self.trajectory.positions
+
+        if np.max(degrees) > self.degree:
+            raise ValueError(
+                f"Truncation degree {np.max(degrees)} exceeds the model degree "
+                f"{self.degree}",
+            )
+
+        positions = np.reshape(positions, (len(positions) * 3))
+        accelerations, potentials = compute_acc_degrees(
+            positions,
+            degrees,
+            self.mu,
+            self.radEquator,
+            self.n1,
+            self.n2,
+            self.n1q,
+            self.n2q,
+            self.coefficients.C,
+            self.coefficients.S,
+            parallel=self.parallel,
+            deg_removed=self.deg_removed,
+        )
+        return accelerations.reshape((len(accelerations), -1, 3)), potentials
+
+    def compute_hessian(self, positions=None):
+        """Compute the analytic gravity gradient tensor d(acc)/d(position). The
+        accelerations and potentials of the same pass are stored on the model.
+
+        Args:
+            positions (np.array, optional): positions (N x 3). Defaults to the
+            trajectory positions.
+
+        Returns:
+            np.array: gravity gradient tensors (N x 3 x 3) [1/s^2]
+        """
+        if positions is None:
+            positions = self.trajectory.positions
+
+        positions = np.reshape(positions, (len(positions) * 3))
+        accelerations, potentials, hessians = compute_acc(
+            positions,
+            self.degree,
+            self.mu,
+            self.radEquator,
+            self.n1,
+            self.n2,
+            self.n1q,
+            self.n2q,
+            self.coefficients.C,
+            self.coefficients.S,
+            parallel=self.parallel,
+            deg_removed=self.deg_removed,
+            return_hessian=True,
+        )
+        self.accelerations = accelerations.reshape((-1, 3))
+        self.potentials = potentials
+        self.hessians = hessians
+        return self.hessians
+
+
+class SphericalHarmonicsDegRemoved(SphericalHarmonics):
+    def __init__(
+        self,
+        sh_info,
+        degree,
+        remove_deg,
+        trajectory=None,
+        parallel=True,
+        low_memory=False,
+        tolerance=None,
+    ):
+        """Spherical harmonic model with the first remove_deg degrees removed.
+        Only degrees remove_deg+1..degree are summed, so the disturbing field is
+        produced in one sweep instead of differencing two full models.
+
+        Args:
+            sh_info (str): path to spherical harmonic coefficients (Stokes coefficients)
+            degree (int): maximum degree of the spherical harmonic expansions
+            remove_deg (int): highest degree excluded from the expansion
+            trajectory (TrajectoryBase, optional): Trajectory / distribution for which
+            the gravity measurements should be produced. Defaults to None.
+        """
+        self.deg_removed = remove_deg
+        super().__init__(
+            sh_info,
+            degree,
+            trajectory=trajectory,
+            parallel=parallel,
+            low_memory=low_memory,
+            tolerance=tolerance,
+        )
+        self.id = self.generate_hash(sh_info, degree, remove_deg)
+
+    def generate_full_file_directory(self):
+        class_name = self.__class__.__name__
+        obj_file = os.path.basename(self.file).split(".csv")[0].split(".txt")[0]
+        hf_deg = str(self.degree)
+        lf_deg = str(self.deg_removed)
+        tol = self.tolerance_suffix()
+        self.file_directory += f"{class_name}_{obj_file}_{hf_deg}_{lf_deg}{tol}/"
+
 
 if __name__ == "__main__":
     import time
@@ -1,6 +1,7 @@
 import numpy as np
 import tensorflow as tf
 
+from GravNN.GravityModels.SHCoefficients import as_packed, lm_index, packed_degree
 from GravNN.Networks.Losses import norm
 
 
@@ -606,9 +607,11 @@ class PinesAlgorithmLayer(tf.keras.layers.Layer):
         super(PinesAlgorithmLayer, self).__init__(dtype=dtype)
         self.mu = tf.constant(mu, dtype=dtype).numpy()
         self.a = tf.constant(a, dtype=dtype).numpy()
-        self.cBar = tf.constant(cBar, dtype=dtype).numpy()
-        self.sBar = tf.constant(sBar, dtype=dtype).numpy()
-        self.N = tf.constant(len(cBar) - 3, dtype=tf.int32).numpy()
+        # Coefficients are stored packed (see SHCoefficients); the two extra
+        # degrees required by the recursion are part of the provided arrays.
+        self.cBar = tf.constant(as_packed(cBar), dtype=dtype).numpy()
+        self.sBar = tf.constant(as_packed(sBar), dtype=dtype).numpy()
+        self.N = tf.constant(packed_degree(self.cBar) - 2, dtype=tf.int32).numpy()
         self.n1, self.n2 = self.compute_normalization_constants(self.N)
         # a = self.compute_aBar(tf.constant(10,dtype=dtype))
         # rE, iM = self.compute_rE_iM(
@@ -770,10 +773,11 @@ class PinesAlgorithmLayer(tf.keras.layers.Layer):
         potential = 0.0
         for l in range(1, self.N + 1):  # noqa: E741
             for m in range(0, l + 1):
+                lm = lm_index(l, m)
                 potential += (
                     rhol[l]
                     * aBar[l, m]
-                    * (self.cBar[l, m] * rE[m] + self.sBar[l, m] * iM[m])
+                    * (self.cBar[lm] * rE[m] + self.sBar[lm] * iM[m])
                 )
 
         potential += self.mu / r
@@ -1,14 +1,14 @@
 import os
-import tempfile
 
 import numpy as np
-import trimesh
 
 import GravNN
 from GravNN.CelestialBodies.Asteroids import Eros
-from GravNN.GravityModels.Mascons import Mascons
+from GravNN.GravityModels.PointMass import compute_point_masses
 from GravNN.GravityModels.Polyhedral import Polyhedral
+from GravNN.Support.MeshContainment import MeshContainment
 from GravNN.Support.ProgressBar import ProgressBar
+from GravNN.Support.ShapeModelRegistry import get_shape_model
 from GravNN.Trajectories.RandomDist import RandomDist
 
 np.random.seed(10)
@@ -50,21 +50,13 @@ class MasconRegressorSequential:
         self.filename = os.path.basename(self.obj_file)
 
     def remove_current_model(self, x, a, mu_list, r_masses):
-        with tempfile.NamedTemporaryFile() as tmpfile:
-            save_data = np.append(mu_list.reshape((-1, 1)), r_masses, axis=1)
-            np.savetxt(
-                tmpfile.name,
-                save_data,
-                delimiter=",",
-            )
-            regressed_model = Mascons(self.planet, tmpfile.name)
-            accelerations = regressed_model.compute_acceleration(x)
-            da = a - accelerations
-            da_percent = np.linalg.norm(da, axis=1) / np.linalg.norm(a, axis=1)
-            da_percent_avg = np.mean(da_percent)
-            brill_mask = np.linalg.norm(x, axis=1) > self.planet.radius
-            print(f"Current model error: {da_percent_avg*100}% \t {len(mu_list)}")
-            print(f"Outside Brillouin Sphere: {np.mean(da_percent[brill_mask]) * 100}")
+        accelerations, _ = compute_point_masses(x, r_masses, mu_list)
+        da = a - accelerations
+        da_percent = np.linalg.norm(da, axis=1) / np.linalg.norm(a, axis=1)
+        da_percent_avg = np.mean(da_percent)
+        brill_mask = np.linalg.norm(x, axis=1) > self.planet.radius
+        print(f"Current model error: {da_percent_avg*100}% \t {len(mu_list)}")
+        print(f"Outside Brillouin Sphere: {np.mean(da_percent[brill_mask]) * 100}")
         return da
 
     def batches(self, batch_size):
@@ -142,11 +134,7 @@ class MasconRegressor:
         self.N_masses = N_masses
 
         self.filename = os.path.basename(self.obj_file)
-        _, file_extension = os.path.splitext(self.obj_file)
-        self.obj_mesh = trimesh.load_mesh(
-            self.obj_file,
-            file_type=file_extension[1:],
-        )
+        self.obj_mesh = get_shape_model(self.obj_file).mesh
 
         self.r_masses = self.initializes_mass_positions()
 
@@ -187,17 +175,10 @@ class MasconRegressor:
         return np.transpose(np.array([X, Y, Z]))  # [N x 3]
 
     def identify_exterior_points(self, positions):
-        # Necessary to cap memory footprint
-        N = len(positions)
-        step = 500
-        mask = np.full((N,), False)
-        rayObject = trimesh.ray.ray_triangle.RayMeshIntersector(self.obj_mesh)
-        for i in range(0, N, step):
-            end_idx = (i // step + 1) * step
-            position_subset = positions[i:end_idx] / 1e3
-            mask[i:end_idx] = ~rayObject.contains_points(position_subset)
-            print(i / N)
-        return mask
+        # The classifier caches a voxel grid of the shape model, build it once
+        if not hasattr(self, "containment"):
+            self.containment = MeshContainment(self.obj_mesh)
+        return ~self.containment.contains(positions / 1e3)
 
     def recursively_remove_exterior_points(self, positions):
         mask = self.identify_exterior_points(positions)
@@ -2,6 +2,7 @@ import tempfile
 
 import numpy as np
 
+from GravNN.GravityModels.SHCoefficients import n_coefficients
 from GravNN.Regression.BLLS import BLLS
 from GravNN.Regression.SHRegression import SHRegression
 from GravNN.Regression.utils import (
@@ -215,7 +216,7 @@ def test_setup(max_true_degree, regress_degree, remove_degree, P0_diag, initial_
     REMOVE_DEG = remove_degree
 
     def compute_dimensionality(N, M):
-        return (N + 2) * (N + 1) - (M + 2) * (M + 1)
+        return 2 * (n_coefficients(N) - n_coefficients(M))
 
     dim = compute_dimensionality(REGRESS_DEG, REMOVE_DEG)
 
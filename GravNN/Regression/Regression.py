@@ -1,6 +1,8 @@
 import numpy as np
 from numba import njit
 
+from GravNN.GravityModels.SHCoefficients import n_coefficients, solution_index
+
 
 @njit(cache=True)
 def getK(l):
@@ -46,11 +48,10 @@ def compute_euler(N, a, mu, rMag, s, t):
 @njit(cache=True)  # , parallel=True)
 def populate_M(rVec1D, A, n1, n2, N, a, mu, remove_deg):
     P = len(rVec1D)
-    Q = N + 1  # Total Indicies Needed to store all coefficients
     if remove_deg:
-        M = np.zeros((P, Q * (Q + 1) - 2 * (2 + 1)))
+        M = np.zeros((P, 2 * (n_coefficients(N) - n_coefficients(1))))
     else:
-        M = np.zeros((P, Q * (Q + 1)))
+        M = np.zeros((P, 2 * n_coefficients(N)))
 
     for p in range(0, int(P / 3)):
         rVal = rVec1D[3 * p : 3 * (p + 1)]
@@ -139,16 +140,16 @@ def populate_M(rVec1D, A, n1, n2, N, a, mu, remove_deg):
                 # idx = n - 2 # The M matrix excludes columns for C00, C10, C11 so we need to subtract 2 from the current degree for proper indexing
                 # idx = n
                 if remove_deg:
-                    degIdx = n * (n + 1) - (2 * (2 + 1))
+                    idx = solution_index(n, m, 1)
                 else:
-                    degIdx = n * (n + 1)
-
-                M[3 * p + 0, degIdx + 2 * m + 0] = f_Cnm_1  # X direction
-                M[3 * p + 0, degIdx + 2 * m + 1] = f_Snm_1
-                M[3 * p + 1, degIdx + 2 * m + 0] = f_Cnm_2  # Y direction
-                M[3 * p + 1, degIdx + 2 * m + 1] = f_Snm_2
-                M[3 * p + 2, degIdx + 2 * m + 0] = f_Cnm_3  # Z direction
-                M[3 * p + 2, degIdx + 2 * m + 1] = f_Snm_3
+                    idx = solution_index(n, m, -1)
+
+                M[3 * p + 0, idx + 0] = f_Cnm_1  # X direction
+                M[3 * p + 0, idx + 1] = f_Snm_1
+                M[3 * p + 1, idx + 0] = f_Cnm_2  # Y direction
+                M[3 * p + 1, idx + 1] = f_Snm_2
+                M[3 * p + 2, idx + 0] = f_Cnm_3  # Z direction
+                M[3 * p + 2, idx + 1] = f_Snm_3
 
     return M
 
@@ -3,6 +3,7 @@ import tempfile
 import numpy as np
 from numba import njit
 
+from GravNN.GravityModels.SHCoefficients import n_coefficients, solution_index
 from GravNN.GravityModels.SphericalHarmonics import SphericalHarmonics
 from GravNN.Regression.utils import *
 from GravNN.Regression.utils import (
@@ -28,7 +29,7 @@ def iterate_lstsq(M, aVec, iterations):
 def populate_H_singular(rVec1D, A, n1, n2, N, a, mu, remove_deg):
     P = len(rVec1D)
     k = remove_deg
-    M = np.zeros((P, (N + 2) * (N + 1) - (k + 2) * (k + 1)))
+    M = np.zeros((P, 2 * (n_coefficients(N) - n_coefficients(k))))
 
     rVal = rVec1D[0:3]
     rMag = np.linalg.norm(rVal)
@@ -99,14 +100,14 @@ def populate_H_singular(rVec1D, A, n1, n2, N, a, mu, remove_deg):
             else:
                 f_Snm_3 = (rho[n + 1] / a) * (-1.0 * u * c2 * A[n + 1, m + 1]) * iM[m]
 
-            degIdx = (n + 1) * (n) - (k + 2) * (k + 1)
+            idx = solution_index(n, m, k)
 
-            M[0, degIdx + 2 * m + 0] = f_Cnm_1  # X direction
-            M[0, degIdx + 2 * m + 1] = f_Snm_1
-            M[1, degIdx + 2 * m + 0] = f_Cnm_2  # Y direction
-            M[1, degIdx + 2 * m + 1] = f_Snm_2
-            M[2, degIdx + 2 * m + 0] = f_Cnm_3  # Z direction
-            M[2, degIdx + 2 * m + 1] = f_Snm_3
+            M[0, idx + 0] = f_Cnm_1  # X direction
+            M[0, idx + 1] = f_Snm_1
+            M[1, idx + 0] = f_Cnm_2  # Y direction
+            M[1, idx + 1] = f_Snm_2
+            M[2, idx + 0] = f_Cnm_3  # Z direction
+            M[2, idx + 1] = f_Snm_3
 
     return M
 
@@ -115,7 +116,7 @@ def populate_H_singular(rVec1D, A, n1, n2, N, a, mu, remove_deg):
 def populate_M(rVec1D, A, n1, n2, N, a, mu, remove_deg):
     P = len(rVec1D)
     k = remove_deg
-    M = np.zeros((P, (N + 2) * (N + 1) - (k + 2) * (k + 1)))
+    M = np.zeros((P, 2 * (n_coefficients(N) - n_coefficients(k))))
 
     for p in range(0, int(P / 3)):
         rVal = rVec1D[3 * p : 3 * (p + 1)]
@@ -5,6 +5,7 @@ import sigfig
 from numba import njit
 from scipy.optimize import Bounds, minimize
 
+from GravNN.GravityModels.SHCoefficients import n_coefficients, solution_index
 from GravNN.Regression.utils import compute_A, compute_euler, format_coefficients, getK
 
 
@@ -12,7 +13,7 @@ from GravNN.Regression.utils import compute_A, compute_euler, format_coefficient
 def populate_M(rVec1D, A, n1, n2, N, a, mu, remove_deg):
     P = len(rVec1D)
     k = remove_deg
-    M = np.zeros((P, (N + 2) * (N + 1) - (k + 2) * (k + 1)))
+    M = np.zeros((P, 2 * (n_coefficients(N) - n_coefficients(k))))
 
     for p in range(0, int(P / 3)):
         rVal = rVec1D[3 * p : 3 * (p + 1)]
@@ -87,14 +88,14 @@ def populate_M(rVec1D, A, n1, n2, N, a, mu, remove_deg):
                         (rho[n + 1] / a) * (-1.0 * u * c2 * A[n + 1, m + 1]) * iM[m]
                     )
 
-                degIdx = (n + 1) * (n) - (k + 2) * (k + 1)
+                idx = solution_index(n, m, k)
 
-                M[3 * p + 0, degIdx + 2 * m + 0] = f_Cnm_1  # X direction
-                M[3 * p + 0, degIdx + 2 * m + 1] = f_Snm_1
-                M[3 * p + 1, degIdx + 2 * m + 0] = f_Cnm_2  # Y direction
-                M[3 * p + 1, degIdx + 2 * m + 1] = f_Snm_2
-                M[3 * p + 2, degIdx + 2 * m + 0] = f_Cnm_3  # Z direction
-                M[3 * p + 2, degIdx + 2 * m + 1] = f_Snm_3
+                M[3 * p + 0, idx + 0] = f_Cnm_1  # X direction
+                M[3 * p + 0, idx + 1] = f_Snm_1
+                M[3 * p + 1, idx + 0] = f_Cnm_2  # Y direction
+                M[3 * p + 1, idx + 1] = f_Snm_2
+                M[3 * p + 2, idx + 0] = f_Cnm_3  # Z direction
+                M[3 * p + 2, idx + 1] = f_Snm_3
 
     return M
 
@@ -3,6 +3,13 @@ import os
 import numpy as np
 from numba import njit
 
+from GravNN.GravityModels.SHCoefficients import (
+    PackedCoefficients,
+    n_coefficients,
+    solution_index,
+    unpack,
+)
+
 
 @njit(cache=True)
 def getK(l):  # noqa: E741
@@ -49,7 +56,7 @@ def compute_euler(N, a, mu, rMag, s, t):
 def populate_H_singular(rVec1D, A, n1, n2, N, a, mu, remove_deg):
     P = len(rVec1D)
     k = remove_deg
-    M = np.zeros((P, (N + 2) * (N + 1) - (k + 2) * (k + 1)))
+    M = np.zeros((P, 2 * (n_coefficients(N) - n_coefficients(k))))
 
     rVal = rVec1D[0:3]
     rMag = np.linalg.norm(rVal)
@@ -120,45 +127,35 @@ def populate_H_singular(rVec1D, A, n1, n2, N, a, mu, remove_deg):
             else:
                 f_Snm_3 = (rho[n + 1] / a) * (-1.0 * u * c2 * A[n + 1, m + 1]) * iM[m]
 
-            degIdx = (n + 1) * (n) - (k + 2) * (k + 1)
+            idx = solution_index(n, m, k)
 
-            M[0, degIdx + 2 * m + 0] = f_Cnm_1  # X direction
-            M[0, degIdx + 2 * m + 1] = f_Snm_1
-            M[1, degIdx + 2 * m + 0] = f_Cnm_2  # Y direction
-            M[1, degIdx + 2 * m + 1] = f_Snm_2
-            M[2, degIdx + 2 * m + 0] = f_Cnm_3  # Z direction
-            M[2, degIdx + 2 * m + 1] = f_Snm_3
+            M[0, idx + 0] = f_Cnm_1  # X direction
+            M[0, idx + 1] = f_Snm_1
+            M[1, idx + 0] = f_Cnm_2  # Y direction
+            M[1, idx + 1] = f_Snm_2
+            M[2, idx + 0] = f_Cnm_3  # Z direction
+            M[2, idx + 1] = f_Snm_3
 
     return M
 
 
 def format_coefficients(coefficients, regress_deg, remove_deg):
-    coefficients = coefficients.reshape((-1, 2))
-
-    N = regress_deg
-    M = remove_deg
-    C_lm = np.zeros((N + 1, N + 1))
-    S_lm = np.zeros((N + 1, N + 1))
-
-    if M != -1:
-        C_lm[0, 0] = 1.0
-
-    k = 0
-    for i in range(M + 1, N + 1):
-        for j in range(i + 1):
-            C_lm[i, j] = coefficients[k, 0]
-            S_lm[i, j] = coefficients[k, 1]
-            k += 1
-
-    return C_lm, S_lm
+    "Dense [l][m] arrays from the estimated parameter vector"
+    packed = PackedCoefficients.from_solution(coefficients, regress_deg, remove_deg)
+    return packed.to_dense()
 
 
 def populate_removed_degrees(C_lm_hat, S_lm_hat, C_lm, S_lm, remove_deg):
-    for i in range(0, remove_deg + 1):
-        for j in range(i + 1):
-            C_lm_hat[i, j] = C_lm[i, j]
-            S_lm_hat[i, j] = S_lm[i, j]
-
+    """Copy the degrees <= remove_deg of C_lm, S_lm into the estimates. Accepts
+    dense [l][m] arrays or PackedCoefficients (pass None for the S arrays).
+    Either way, the updated (C, S) arrays are returned in the input layout."""
+    if isinstance(C_lm_hat, PackedCoefficients):
+        packed = C_lm_hat.populate_removed_degrees(C_lm, remove_deg)
+        return packed.C, packed.S
+
+    rows, cols = np.tril_indices(remove_deg + 1)
+    C_lm_hat[rows, cols] = C_lm[rows, cols]
+    S_lm_hat[rows, cols] = S_lm[rows, cols]
     return C_lm_hat, S_lm_hat
 
 
@@ -177,11 +174,21 @@ def save(file_name, planet, C_lm, S_lm):
 
 class RegressSolution:
     def __init__(self, results, regress_deg, remove_deg, planet):
-        C_lm, S_lm = format_coefficients(results, regress_deg, remove_deg)
-        self.C_lm = C_lm
-        self.S_lm = S_lm
+        self.coefficients = PackedCoefficients.from_solution(
+            results,
+            regress_deg,
+            remove_deg,
+        )
         self.planet = planet
 
+    @property
+    def C_lm(self):
+        return unpack(self.coefficients.C, self.coefficients.degree)
+
+    @property
+    def S_lm(self):
+        return unpack(self.coefficients.S, self.coefficients.degree)
+
 
 def preprocess_data(x_dumb, a_dumb, acc_noise, pos_noise):
     x_dumb = np.array(x_dumb)
@@ -0,0 +1,140 @@
+import os
+import pickle
+import sys
+import tempfile
+
+import numpy as np
+
+
+def little_endian(array):
+    "array with a little-endian (or byte order free) dtype"
+    array = np.asarray(array)
+    if array.dtype.byteorder == ">" or (
+        array.dtype.byteorder == "=" and sys.byteorder == "big"
+    ):
+        array = array.astype(array.dtype.newbyteorder("<"))
+    return array
+
+
+def save_array(path, array):
+    """Store an array as a .npy file: a small header (dtype, shape, order)
+    followed by the raw little-endian values, so the file can be memory mapped
+    by load_array. The file is written to a temporary name and moved into place
+    so readers never observe a partially written array.
+
+    Args:
+        path (str): destination of the array (.npy)
+        array (np.array): numeric array to store
+    """
+    array = little_endian(array)
+    if array.dtype.hasobject:
+        raise TypeError(f"Cannot store an array of Python objects at {path}")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array, allow_pickle=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_array(path, rows=None, columns=None):
+    """Memory map an array written by save_array. Nothing is read until the
+    values are accessed, and requesting a row range (slice) or columns of a
+    2D array only touches the corresponding pages. The map is copy-on-write:
+    in place modifications stay in memory and never reach the file.
+
+    Args:
+        path (str): location of the array (.npy)
+        rows (slice or array, optional): rows to return. Defaults to all.
+        columns (int, slice or array, optional): columns to return. Defaults to
+            all.
+
+    Returns:
+        np.memmap: the requested rows and columns (a view unless fancy indexing
+            is used)
+    """
+    array = np.load(path, mmap_mode="c", allow_pickle=False)
+    if rows is not None:
+        array = array[rows]
+    if columns is not None:
+        array = array[:, columns]
+    return array
+
+
+def read_pickles(pickle_file):
+    "All of the objects dumped sequentially into pickle_file"
+    objects = []
+    with open(pickle_file, "rb") as f:
+        while True:
+            try:
+                objects.append(pickle.load(f))
+            except EOFError:
+                break
+    return objects
+
+
+def migrate_pickle(pickle_file, array_files):
+    """One time conversion of a pickle file (written by the former save methods)
+    into arrays stored by save_array. The i-th pickled object is written to the
+    i-th entry of array_files; missing or None objects are skipped. The pickle
+    is left in place so older versions of the code can still read it.
+
+    Args:
+        pickle_file (str): file holding one or more pickled arrays
+        array_files (list): destination of each pickled object (.npy)
+
+    Returns:
+        bool: True if the first array file now exists
+    """
+    if not os.path.exists(pickle_file):
+        return False
+    for obj, array_file in zip(read_pickles(pickle_file), array_files):
+        if obj is None or os.path.exists(array_file):
+            continue
+        save_array(array_file, np.asarray(obj))
+    return os.path.exists(array_files[0])
+
+
+# Former pickle file -> array files replacing it
+PICKLE_MIGRATIONS = {
+    "acceleration.data": ["acceleration.npy"],
+    "potential.data": ["potential.npy"],
+    "trajectory.data": ["positions.npy", "times.npy"],
+}
+
+
+def migrate_directory(root):
+    """Convert every pickled trajectory, acceleration and potential below root
+
+    Args:
+        root (str): directory to search recursively
+
+    Returns:
+        int: number of converted pickle files
+    """
+    converted = 0
+    for directory, _, files in os.walk(root):
+        for pickle_name, array_names in PICKLE_MIGRATIONS.items():
+            if pickle_name not in files:
+                continue
+            array_files = [os.path.join(directory, name) for name in array_names]
+            if os.path.exists(array_files[0]):
+                continue
+            if migrate_pickle(os.path.join(directory, pickle_name), array_files):
+                converted += 1
+    return converted
+
+
+if __name__ == "__main__":
+    import GravNN
+
+    default_root = os.path.join(os.path.dirname(GravNN.__file__), "Files")
+    root = sys.argv[1] if len(sys.argv) > 1 else default_root
+    n_files = migrate_directory(root)
+    print(f"Converted {n_files} pickle files below {root}")
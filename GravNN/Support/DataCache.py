@@ -0,0 +1,241 @@
+import hashlib
+import json
+import numbers
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from GravNN.Support.FileLease import FileLease
+from GravNN.Support.ShapeModelRegistry import file_digest
+
+# Root of the generated trajectories and gravity data
+DATA_DIRECTORY = os.path.abspath(
+    os.path.dirname(__file__) + "/../Files/Trajectories/",
+)
+
+# Disk budget of the cache in bytes (unbounded if unset)
+BUDGET_VARIABLE = "GRAVNN_CACHE_BUDGET"
+
+_data_cache = None
+
+
+def canonical(value):
+    """JSON serializable form of a parameter that ignores cosmetic differences:
+    numbers are written with 12 significant digits whatever their type (so 0,
+    0.0 and np.float32(0) agree), sequences and arrays become lists, existing
+    files are replaced by the digest of their contents and celestial bodies by
+    their name."""
+    if value is None or isinstance(value, (bool, np.bool_)):
+        return None if value is None else bool(value)
+    if isinstance(value, numbers.Real):
+        return f"{float(value):.12g}"
+    if isinstance(value, str):
+        if os.path.isfile(value):
+            return "sha256:" + file_digest(value)
+        return value
+    if isinstance(value, dict):
+        return {str(key): canonical(item) for key, item in value.items()}
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if hasattr(value, "body_name"):
+        return {"body_name": value.body_name}
+    return value.__class__.__name__
+
+
+def canonical_hash(*values):
+    "SHA256 digest of the canonical form of values"
+    data = json.dumps(canonical(list(values)), sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_data_cache():
+    """Shared DataCache of the generated data. The disk budget is read from the
+    GRAVNN_CACHE_BUDGET environment variable (bytes, suffixes K/M/G/T accepted)."""
+    global _data_cache
+    if _data_cache is None:
+        _data_cache = DataCache(
+            DATA_DIRECTORY,
+            parse_size(os.environ.get(BUDGET_VARIABLE)),
+        )
+    return _data_cache
+
+
+def parse_size(size):
+    "Number of bytes of a size such as 5e8, 500M or 20G (None if unset)"
+    if size is None or str(size).strip() == "":
+        return None
+    size = str(size).strip().upper().rstrip("B")
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size))
+
+
+class DataCache:
+    def __init__(self, root, budget=None):
+        """Index of the generated trajectories and gravity data below root,
+        keyed by a canonical hash of the parameters that produced them (see
+        canonical_hash) rather than by their formatted directory names.
+
+        Each entry records the directory and files holding the data, their size
+        and the last time they were used. Once the entries exceed budget bytes,
+        the least recently used ones are deleted; entries derived from another
+        (e.g. accelerations of a trajectory) record it as their parent and are
+        deleted along with it. Updates of the index hold a lease on
+        cache_index.json.lock so concurrent processes do not drop each other's
+        entries.
+
+        Args:
+            root (str): directory containing the cached data and the index
+            budget (int, optional): disk budget in bytes. Defaults to None
+                (unbounded).
+        """
+        self.root = os.path.abspath(root)
+        self.budget = budget
+        self.index_file = os.path.join(self.root, "cache_index.json")
+
+    def read_index(self):
+        if not os.path.exists(self.index_file):
+            return {}
+        try:
+            with open(self.index_file, "r") as f:
+                return json.load(f)
+        except ValueError:
+            # Unreadable index, the entries are registered again when loaded
+            return {}
+
+    def write_index(self, index):
+        # Write to a temporary file first so a partial index is never picked up
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_file)
+
+    def index_lease(self):
+        "Lease held while reading, modifying and writing the index"
+        return FileLease(
+            self.index_file + ".lock",
+            lease=60.0,
+            poll_interval=0.05,
+            verbose=False,
+        )
+
+    def entry_directory(self, entry):
+        return os.path.join(self.root, entry["directory"]) + "/"
+
+    def lookup(self, key):
+        """Directory holding the data of key, marking it (and its parents) as used
+
+        Returns:
+            str: directory of the entry, or None if key is not cached
+        """
+        with self.index_lease():
+            index = self.read_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+
+            directory = self.entry_directory(entry)
+            if not any(os.path.exists(directory + file) for file in entry["files"]):
+                # Deleted outside of the cache
+                del index[key]
+                self.write_index(index)
+                return None
+
+            now = time.time()
+            while entry is not None:
+                entry["last_access"] = now
+                entry = index.get(entry.get("parent"))
+            self.write_index(index)
+            return directory
+
+    def register(self, key, directory, files, parent=None, family=None, points=None):
+        """Record (or refresh) the files of key stored in directory, then evict
+        the least recently used entries beyond the budget
+
+        Args:
+            key (str): canonical hash of the parameters of the data
+            directory (str): directory holding the files
+            files (list): names of the files belonging to the entry
+            parent (str, optional): key of the entry the data derives from.
+                Defaults to None.
+            family (str, optional): key shared by entries whose data are
+                prefixes of one another (see find_family). Defaults to None.
+            points (int, optional): number of points of the entry. Defaults to
+                None.
+        """
+        directory = os.path.abspath(directory)
+        files = [file for file in files if os.path.exists(f"{directory}/{file}")]
+        with self.index_lease():
+            index = self.read_index()
+            index[key] = {
+                "directory": os.path.relpath(directory, self.root),
+                "files": files,
+                "size": sum(os.path.getsize(f"{directory}/{file}") for file in files),
+                "last_access": time.time(),
+                "parent": parent,
+                "family": family,
+                "points": points,
+            }
+            self.evict(index, keep=(key, parent))
+            self.write_index(index)
+
+    def find_family(self, family, exclude=None):
+        """Entries of a family, largest number of points first
+
+        Returns:
+            list: (directory, points, parent directory) of each entry whose files
+                still exist; the parent directory is None without a parent
+        """
+        index = self.read_index()
+        members = []
+        for key, entry in index.items():
+            if key == exclude or entry.get("family") != family:
+                continue
+            directory = self.entry_directory(entry)
+            if not all(os.path.exists(directory + file) for file in entry["files"]):
+                continue
+            parent = index.get(entry.get("parent"))
+            parent_directory = None if parent is None else self.entry_directory(parent)
+            members.append((directory, entry["points"], parent_directory))
+        return sorted(members, key=lambda member: -member[1])
+
+    def size(self):
+        "Total size in bytes of the cached entries"
+        return sum(entry["size"] for entry in self.read_index().values())
+
+    def remove(self, key, index=None):
+        """Delete the files of key and of every entry derived from it"""
+        if index is None:
+            with self.index_lease():
+                index = self.read_index()
+                self.remove(key, index)
+                self.write_index(index)
+            return
+
+        entry = index.pop(key, None)
+        if entry is not None:
+            directory = self.entry_directory(entry)
+            for file in entry["files"]:
+                if os.path.exists(directory + file):
+                    os.remove(directory + file)
+            children = [k for k, e in index.items() if e.get("parent") == key]
+            for child in children:
+                self.remove(child, index)
+
+    def evict(self, index, keep=()):
+        "Remove the least recently used entries of index until it fits the budget"
+        if self.budget is None:
+            return
+        by_age = sorted(index, key=lambda k: index[k]["last_access"])
+        for key in by_age:
+            if sum(entry["size"] for entry in index.values()) <= self.budget:
+                break
+            if key in keep or key not in index:
+                continue
+            self.remove(key, index)
@@ -0,0 +1,177 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+# Seconds without refresh after which a lock of another host is taken over
+DEFAULT_LEASE = 600.0
+
+
+class FileLease:
+    # Leases held by this process, see refresh_held
+    _held = set()
+
+    def __init__(self, path, lease=None, poll_interval=1.0, verbose=True):
+        """Lock shared by processes (and nodes) through a file of the common file
+        system, e.g. so that a single process generates some data while the
+        others wait for it.
+
+        The lock file is created exclusively and holds the owner's host, pid and
+        a random token. A lock of a process of the same host is taken over once
+        that process exited. Processes of other hosts cannot be checked, so the
+        owner refreshes the modification time of the lock every lease/4 seconds
+        from a background thread and a lock that was not refreshed for lease
+        seconds is taken over. The gravity kernels release the GIL (nogil) so
+        the refresh runs while they compute; code holding the GIL for long
+        refreshes its leases itself (see refresh_held).
+
+        A lock is taken over by renaming it to a name unique to this lease and
+        checking that the renamed file is the abandoned one: a lock acquired by
+        another process in the meantime is moved back rather than removed. If
+        yet another process created a lock before it could be moved back, the
+        renamed file is left in place, so no lock of a live process is removed.
+
+        Args:
+            path (str): lock file, relative paths may go through directories
+                that do not exist (e.g. "Model/../Files/"), it is normalized
+            lease (float, optional): seconds without refresh after which the lock
+                of another host is considered abandoned. Defaults to None
+                (DEFAULT_LEASE, 600).
+            poll_interval (float, optional): seconds between attempts while
+                waiting. Defaults to 1.
+            verbose (bool, optional): report when waiting for another process.
+                Defaults to True.
+        """
+        self.path = os.path.abspath(path)
+        self.lease = DEFAULT_LEASE if lease is None else float(lease)
+        self.poll_interval = poll_interval
+        self.verbose = verbose
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self._stop = None
+        self._heartbeat = None
+
+    def owner(self):
+        "Contents of the lock file, None if it does not exist"
+        try:
+            with open(self.path, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def try_acquire(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self.remove_if_abandoned():
+                return self.try_acquire()
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(self.token)
+        FileLease._held.add(self)
+        self.start_heartbeat()
+        return True
+
+    def abandoned(self, owner):
+        "Whether the owner of the lock stopped without releasing it"
+        host, pid, _ = (owner.split(":") + ["", "", ""])[:3]
+        if host == socket.gethostname() and pid.isdigit():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+            return False
+        try:
+            return time.time() - os.path.getmtime(self.path) > self.lease
+        except FileNotFoundError:
+            return False
+
+    def remove_if_abandoned(self):
+        "Remove the lock if its owner stopped, returns True if it was removed"
+        owner = self.owner()
+        if owner is None or not self.abandoned(owner):
+            return False
+
+        # The rename is atomic, so the renamed file is the lock at that instant,
+        # which may have been released and acquired again since it was read
+        stale_path = f"{self.path}.{self.token.split(':')[-1]}.stale"
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return False
+        with open(stale_path, "r") as f:
+            renamed = f.read()
+        if renamed != owner:
+            # Restore the live lock. If yet another process created one in the
+            # meantime, keep the renamed file rather than removing a lock: the
+            # lock in place belongs to a live process
+            try:
+                os.link(stale_path, self.path)
+            except FileExistsError:
+                return False
+            os.remove(stale_path)
+            return False
+
+        if self.verbose:
+            print(f"Taking over abandoned lock {self.path} of {owner}")
+        os.remove(stale_path)
+        return True
+
+    def acquire(self, blocking=True):
+        """Acquire the lock, waiting for other owners if blocking
+
+        Returns:
+            bool: True if the lock is held
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        reported = False
+        while not self.try_acquire():
+            if not blocking:
+                return False
+            if self.verbose and not reported:
+                print(f"Waiting for {self.path} held by {self.owner()}")
+                reported = True
+            time.sleep(self.poll_interval)
+        return True
+
+    def release(self):
+        FileLease._held.discard(self)
+        if self._stop is not None:
+            self._stop.set()
+            self._heartbeat.join()
+            self._stop = None
+        if self.owner() == self.token:
+            os.remove(self.path)
+
+    def start_heartbeat(self):
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self.beat, daemon=True)
+        self._heartbeat.start()
+
+    def beat(self):
+        while not self._stop.wait(self.lease / 4.0):
+            self.refresh()
+
+    def refresh(self):
+        "Refresh the modification time of the lock if this lease still holds it"
+        try:
+            if self.owner() == self.token:
+                os.utime(self.path)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def refresh_held(cls):
+        """Refresh every lease held by this process, e.g. between the chunks of
+        a long generation in case the heartbeat could not run"""
+        for lease in list(cls._held):
+            lease.refresh()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
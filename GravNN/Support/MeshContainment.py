@@ -0,0 +1,271 @@
+import numpy as np
+from numba import njit, prange
+
+
+def compute_winding_numbers(points, vertices, faces):
+    """Sum of the facet solid angles seen from each point (w_f of Werner and
+    Scheeres, see GetPerformanceFactor) divided by 4 pi, i.e. 1 inside a closed
+    mesh and 0 outside. The vertex offsets are shared by the facets of a point."""
+    N = len(points)
+    winding = np.zeros((N,))
+    for i in prange(N):
+        rel = vertices - points[i]
+        dist = np.sqrt(rel[:, 0] ** 2 + rel[:, 1] ** 2 + rel[:, 2] ** 2)
+        omega = 0.0
+        for f in range(len(faces)):
+            a, b, c = faces[f, 0], faces[f, 1], faces[f, 2]
+            ax, ay, az = rel[a, 0], rel[a, 1], rel[a, 2]
+            bx, by, bz = rel[b, 0], rel[b, 1], rel[b, 2]
+            cx, cy, cz = rel[c, 0], rel[c, 1], rel[c, 2]
+            triple = (
+                ax * (by * cz - bz * cy)
+                + ay * (bz * cx - bx * cz)
+                + az * (bx * cy - by * cx)
+            )
+            denominator = (
+                dist[a] * dist[b] * dist[c]
+                + dist[a] * (bx * cx + by * cy + bz * cz)
+                + dist[b] * (ax * cx + ay * cy + az * cz)
+                + dist[c] * (ax * bx + ay * by + az * bz)
+            )
+            omega += 2.0 * np.arctan2(triple, denominator)
+        winding[i] = omega / (4.0 * np.pi)
+    return winding
+
+
+@njit(cache=True)
+def mark_surface_cells(vertices, faces, origin, cell_size, shape):
+    "Flag every cell overlapped by the bounding box of a facet"
+    surface = np.zeros(shape, dtype=np.bool_)
+    eps = 1e-6 * cell_size
+    for f in range(len(faces)):
+        lo = np.zeros((3,), dtype=np.int64)
+        hi = np.zeros((3,), dtype=np.int64)
+        for k in range(3):
+            v_min = min(
+                vertices[faces[f, 0], k],
+                vertices[faces[f, 1], k],
+                vertices[faces[f, 2], k],
+            )
+            v_max = max(
+                vertices[faces[f, 0], k],
+                vertices[faces[f, 1], k],
+                vertices[faces[f, 2], k],
+            )
+            lo[k] = max(int(np.floor((v_min - eps - origin[k]) / cell_size)), 0)
+            hi[k] = min(
+                int(np.floor((v_max + eps - origin[k]) / cell_size)),
+                shape[k] - 1,
+            )
+        for i in range(lo[0], hi[0] + 1):
+            for j in range(lo[1], hi[1] + 1):
+                for k in range(lo[2], hi[2] + 1):
+                    surface[i, j, k] = True
+    return surface
+
+
+@njit(cache=True)
+def classify_cells(surface):
+    """Label each cell as exterior (0), enclosed (1), or surface (2). The exterior
+    is flood filled from every boundary cell of the (padded) grid that doesn't
+    touch the surface, any other cell not touching the surface is enclosed by
+    it. Enclosed cells are not necessarily inside of the mesh, e.g. those of a
+    cavity or of a concavity with an opening narrower than a few cells (see
+    label_enclosed_components)."""
+    nx, ny, nz = surface.shape
+    labels = np.ones(surface.shape, dtype=np.int8)
+    stack = np.zeros((nx * ny * nz, 3), dtype=np.int64)
+    n = 0
+    for i in range(nx):
+        for j in range(ny):
+            for k in range(nz):
+                if surface[i, j, k]:
+                    labels[i, j, k] = 2
+                elif (
+                    i == 0
+                    or j == 0
+                    or k == 0
+                    or i == nx - 1
+                    or j == ny - 1
+                    or k == nz - 1
+                ):
+                    labels[i, j, k] = 0
+                    stack[n, 0], stack[n, 1], stack[n, 2] = i, j, k
+                    n += 1
+
+    while n > 0:
+        n -= 1
+        i, j, k = stack[n, 0], stack[n, 1], stack[n, 2]
+        for d in range(6):
+            a, b, c = i, j, k
+            if d == 0:
+                a -= 1
+            elif d == 1:
+                a += 1
+            elif d == 2:
+                b -= 1
+            elif d == 3:
+                b += 1
+            elif d == 4:
+                c -= 1
+            else:
+                c += 1
+            if a < 0 or b < 0 or c < 0 or a >= nx or b >= ny or c >= nz:
+                continue
+            if labels[a, b, c] == 1:
+                labels[a, b, c] = 0
+                stack[n, 0], stack[n, 1], stack[n, 2] = a, b, c
+                n += 1
+    return labels
+
+
+@njit(cache=True)
+def label_enclosed_components(labels):
+    """Number the 6-connected components of the enclosed cells (label 1). No
+    facet crosses a component, so all of its cells are on the same side of the
+    surface. Returns the component of each cell (-1 if not enclosed) and the
+    flat index of one cell per component."""
+    nx, ny, nz = labels.shape
+    components = np.full(labels.shape, -1, dtype=np.int32)
+    representatives = np.zeros((nx * ny * nz,), dtype=np.int64)
+    stack = np.zeros((nx * ny * nz, 3), dtype=np.int64)
+    n_components = 0
+    for i0 in range(nx):
+        for j0 in range(ny):
+            for k0 in range(nz):
+                if labels[i0, j0, k0] != 1 or components[i0, j0, k0] != -1:
+                    continue
+                components[i0, j0, k0] = n_components
+                representatives[n_components] = (i0 * ny + j0) * nz + k0
+                stack[0, 0], stack[0, 1], stack[0, 2] = i0, j0, k0
+                n = 1
+                while n > 0:
+                    n -= 1
+                    i, j, k = stack[n, 0], stack[n, 1], stack[n, 2]
+                    for d in range(6):
+                        a, b, c = i, j, k
+                        if d == 0:
+                            a -= 1
+                        elif d == 1:
+                            a += 1
+                        elif d == 2:
+                            b -= 1
+                        elif d == 3:
+                            b += 1
+                        elif d == 4:
+                            c -= 1
+                        else:
+                            c += 1
+                        if a < 0 or b < 0 or c < 0 or a >= nx or b >= ny or c >= nz:
+                            continue
+                        if labels[a, b, c] == 1 and components[a, b, c] == -1:
+                            components[a, b, c] = n_components
+                            stack[n, 0], stack[n, 1], stack[n, 2] = a, b, c
+                            n += 1
+                n_components += 1
+    return components, representatives[:n_components].copy()
+
+
+class MeshContainment:
+    def __init__(self, mesh, resolution=128, parallel=True):
+        """Inside / outside classifier of a closed shape model built on the
+        polyhedral solid angles, which sum to 4 pi inside the mesh and vanish
+        outside.
+
+        Evaluating the solid angles costs O(F) per point, so the classifier
+        caches a voxel grid over the bounding box of the mesh: cells away from
+        the surface are labelled once (flood fill from outside the mesh, then
+        one exact evaluation per region the fill could not reach) and only
+        points falling in cells crossed by the surface are evaluated exactly.
+        Points outside of the grid are exterior. Meshes that are not watertight
+        skip the grid and evaluate every point.
+
+        Args:
+            mesh (trimesh.Trimesh): shape model, in the units of the queried points
+            resolution (int, optional): number of cells along the longest side
+                of the bounding box. Defaults to 128.
+            parallel (bool, optional): Evaluate the solid angles across all numba
+                threads. Defaults to True.
+        """
+        self.vertices = np.ascontiguousarray(mesh.vertices, dtype=np.float64)
+        self.faces = np.ascontiguousarray(mesh.faces, dtype=np.int64)
+        self.parallel = parallel
+
+        self.labels = None
+        if mesh.is_watertight:
+            bounds = np.array(mesh.bounds)
+            self.cell_size = np.max(bounds[1] - bounds[0]) / resolution
+
+            # Pad by two cells on each side so the facets (whose bounding boxes
+            # are slightly widened) never reach the boundary of the grid and the
+            # flood fill can go around the mesh
+            self.origin = bounds[0] - 2 * self.cell_size
+            shape = np.ceil((bounds[1] - self.origin) / self.cell_size) + 2
+            surface = mark_surface_cells(
+                self.vertices,
+                self.faces,
+                self.origin,
+                self.cell_size,
+                tuple(int(n) for n in shape),
+            )
+            self.labels = classify_cells(surface)
+
+            # Enclosed regions may be exterior pockets walled off by the surface,
+            # the solid angles at one cell center label the whole region
+            components, representatives = label_enclosed_components(self.labels)
+            if len(representatives) > 0:
+                cells = np.stack(
+                    np.unravel_index(representatives, self.labels.shape),
+                    axis=1,
+                )
+                centers = self.origin + (cells + 0.5) * self.cell_size
+                inside = self.winding_numbers(centers) > 0.5
+                enclosed = components >= 0
+                self.labels[enclosed] = inside[components[enclosed]]
+
+    def winding_numbers(self, points):
+        kernel = (
+            compute_winding_numbers_parallel
+            if self.parallel
+            else compute_winding_numbers_jit
+        )
+        points = np.ascontiguousarray(points, dtype=np.float64).reshape((-1, 3))
+        return kernel(points, self.vertices, self.faces)
+
+    def contains(self, points):
+        """Flag the points inside of the mesh
+
+        Args:
+            points (np.array): positions in the units of the mesh (N x 3)
+
+        Returns:
+            np.array: boolean mask (N,)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+        if self.labels is None:
+            return self.winding_numbers(points) > 0.5
+
+        index = np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+        in_grid = np.all((index >= 0) & (index < self.labels.shape), axis=1)
+        labels = np.zeros((len(points),), dtype=np.int8)
+        labels[in_grid] = self.labels[tuple(index[in_grid].T)]
+
+        mask = labels == 1
+        near_surface = labels == 2
+        if np.any(near_surface):
+            mask[near_surface] = self.winding_numbers(points[near_surface]) > 0.5
+        return mask
+
+
+compute_winding_numbers_jit = njit(
+    compute_winding_numbers,
+    parallel=False,
+    nogil=True,
+    cache=True,
+)
+compute_winding_numbers_parallel = njit(
+    compute_winding_numbers,
+    parallel=True,
+    nogil=True,
+    cache=True,
+)
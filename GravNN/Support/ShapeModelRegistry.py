@@ -0,0 +1,193 @@
+import hashlib
+import os
+import types
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import trimesh
+
+import GravNN
+
+# Shape models alive in this process, keyed by the digest of the file contents.
+# A shape model is released once nothing but the registry refers to it ...
+_shape_models = weakref.WeakValueDictionary()
+
+# ... except for the most recently requested ones, which are kept alive
+MAX_RECENT_SHAPE_MODELS = 4
+_recent_shape_models = OrderedDict()
+
+# Digest of each file, keyed by (path, modification time, size) so unchanged
+# files are not read again
+_file_digests = {}
+
+
+def file_digest(obj_file):
+    "SHA256 digest of the contents of a shape model file"
+    stat = os.stat(obj_file)
+    key = (os.path.realpath(obj_file), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_digests:
+        digest = hashlib.sha256()
+        with open(obj_file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _file_digests[key] = digest.hexdigest()
+    return _file_digests[key]
+
+
+def code_digest(compute, version=None):
+    """Digest of the bytecode, names and constants of compute and of the
+    functions of its module it calls (e.g. its numba kernels), combined with
+    version. It is part of the cache file names so that changing how a quantity
+    is derived invalidates the cached values; pass a new version for changes the
+    code of the module doesn't show (e.g. in a dependency)."""
+    digest = hashlib.sha256(repr(version).encode())
+    pending = [getattr(compute, "py_func", compute)]
+    seen = set()
+    while pending:
+        function = pending.pop()
+        if function in seen or not hasattr(function, "__code__"):
+            continue
+        seen.add(function)
+        codes = [function.__code__]
+        while codes:
+            code = codes.pop()
+            digest.update(code.co_code)
+            digest.update(repr(code.co_names).encode())
+            for const in code.co_consts:
+                if isinstance(const, types.CodeType):
+                    codes.append(const)
+                elif isinstance(const, frozenset):
+                    digest.update(repr(sorted(map(repr, const))).encode())
+                else:
+                    digest.update(repr(const).encode())
+            for name in code.co_names:
+                callee = function.__globals__.get(name)
+                callee = getattr(callee, "py_func", callee)
+                if (
+                    isinstance(callee, types.FunctionType)
+                    and callee.__module__ == function.__module__
+                ):
+                    pending.append(callee)
+    return digest.hexdigest()[:16]
+
+
+def get_shape_model(obj_file):
+    """Shared ShapeModel of a shape model file. Files with identical contents map
+    to the same instance while it is in use, so the mesh and every derived
+    quantity are computed at most once per process (and once overall thanks to
+    the disk cache). Shape models no longer in use are released, apart from the
+    MAX_RECENT_SHAPE_MODELS most recently requested.
+
+    Args:
+        obj_file (str): path to the shape model
+
+    Returns:
+        ShapeModel: the registered shape model
+    """
+    digest = file_digest(obj_file)
+    shape_model = _shape_models.get(digest)
+    if shape_model is None:
+        shape_model = ShapeModel(obj_file, digest)
+        _shape_models[digest] = shape_model
+
+    _recent_shape_models[digest] = shape_model
+    _recent_shape_models.move_to_end(digest)
+    while len(_recent_shape_models) > MAX_RECENT_SHAPE_MODELS:
+        _recent_shape_models.popitem(last=False)
+    return shape_model
+
+
+class ShapeModel:
+    def __init__(self, obj_file, digest):
+        """Vertices and faces of a shape model plus the quantities derived from
+        them (see derived). Everything is memoized in memory and persisted as
+        .npz files in Files/ShapeModels/Cache/, so later processes skip the
+        parsing and processing of the mesh entirely. The shared arrays and mesh
+        must be treated as read only.
+
+        Args:
+            obj_file (str): path to the shape model
+            digest (str): SHA256 digest of the file contents
+        """
+        self.obj_file = obj_file
+        self.digest = digest
+        name = os.path.splitext(os.path.basename(obj_file))[0]
+        self.cache_directory = (
+            f"{os.path.dirname(GravNN.__file__)}/Files/ShapeModels/Cache/"
+            f"{name}_{digest[:16]}/"
+        )
+        self._mesh = None
+        self._derived = {}
+        self.vertices, self.faces = self.derived("mesh", load_mesh_arrays)
+
+    @property
+    def mesh(self):
+        "trimesh.Trimesh of the cached arrays (processed when first loaded)"
+        if self._mesh is None:
+            self._mesh = trimesh.Trimesh(self.vertices, self.faces, process=False)
+        return self._mesh
+
+    @property
+    def edges_unique(self):
+        return self.derived("edges_unique", lambda shape: shape.mesh.edges_unique)
+
+    @property
+    def volume(self):
+        return float(self.derived("volume", lambda shape: shape.mesh.volume))
+
+    def derived(self, name, compute, version=None):
+        """Value of compute(self), an array or tuple of arrays, stored under name.
+        It is computed once, then served from memory or from the disk cache. The
+        cached value is keyed by the code of compute (see code_digest), so it is
+        computed again once the derivation changes.
+
+        Args:
+            name (str): unique name of the quantity (part of the cache file name)
+            compute (callable): function of the ShapeModel computing the quantity
+            version (optional): changed to invalidate the cached values when
+                compute changes in a way its code doesn't show. Defaults to None.
+
+        Returns:
+            np.array or tuple: the quantity
+        """
+        key = f"{name}_{code_digest(compute, version)}"
+        if key in self._derived:
+            return self._derived[key]
+
+        cache_file = self.cache_directory + key + ".npz"
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as data:
+                if "value" in data.files:
+                    value = data["value"]
+                else:
+                    value = tuple(data[f"value_{i}"] for i in range(len(data.files)))
+        else:
+            value = compute(self)
+            if isinstance(value, tuple):
+                value = tuple(np.asarray(v) for v in value)
+                arrays = {f"value_{i}": v for i, v in enumerate(value)}
+            else:
+                value = np.asarray(value)
+                arrays = {"value": value}
+
+            # Write to a temporary file first so a partial file is never picked up
+            os.makedirs(self.cache_directory, exist_ok=True)
+            tmp_file = self.cache_directory + f"{key}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_file, **arrays)
+            os.replace(tmp_file, cache_file)
+
+        self._derived[key] = value
+        return value
+
+
+def load_mesh_arrays(shape):
+    """Vertices and faces of the processed mesh parsed from the shape model file.
+    The parsed mesh itself is dropped, the mesh property rebuilds it from the
+    arrays when needed."""
+    _, file_extension = os.path.splitext(shape.obj_file)
+    mesh = trimesh.load_mesh(shape.obj_file, file_type=file_extension[1:])
+    return (
+        np.array(mesh.vertices, dtype=np.float64),
+        np.array(mesh.faces, dtype=np.int64),
+    )
@@ -26,3 +26,30 @@ def print_slurm_info():
         print(f"Threads per core:{num_threads / (cores_per_nodes * num_nodes)}")
     except Exception:
         pass
+
+
+def get_shard_index():
+    """Index of this task within a SLURM array job or a multi-task job step,
+    used to assign it a shard of a sharded data generation. None outside of
+    SLURM or for single task jobs."""
+    try:
+        task_id = int(os.environ["SLURM_ARRAY_TASK_ID"])
+        return task_id - int(os.environ.get("SLURM_ARRAY_TASK_MIN", 0))
+    except Exception:
+        pass
+    try:
+        if int(os.environ["SLURM_NTASKS"]) > 1:
+            return int(os.environ["SLURM_PROCID"])
+    except Exception:
+        pass
+    return None
+
+
+def get_run_id():
+    """Identifier shared by the tasks of a SLURM job (the array job id for array
+    jobs), e.g. so that a sharded data generation is overridden once per job
+    rather than once per task. None outside of SLURM."""
+    for variable in ["SLURM_ARRAY_JOB_ID", "SLURM_JOB_ID"]:
+        if variable in os.environ:
+            return os.environ[variable]
+    return None
@@ -6,6 +6,8 @@ from GravNN.Trajectories.TrajectoryBase import TrajectoryBase
 
 
 class ExponentialDist(TrajectoryBase):
+    cache_attributes = ("scale_parameter", "invert", "seed")
+
     def __init__(self, celestial_body, radiusBounds, points, **kwargs):
         """Distribution with samples drawn from an exponential distribution.
 
@@ -17,6 +19,9 @@ class ExponentialDist(TrajectoryBase):
             points (int): number of samples to be drawn
             scale_parameter (float): b in 1/b*exp(-x/b) such that small scale parameter leads to narrower distributions
             invert (bool): invert the distribution such that samples decay in frequency from the higher to the lower altitudes
+            dist_seed (int, optional): seed making the samples reproducible, the
+                first K samples are then shared by every number of points >= K
+                (see TrajectoryBase.generate_seeded). Defaults to None.
         """
         # scale_parameter = beta -- e^(x/beta)
         self.radiusBounds = radiusBounds
@@ -28,6 +33,7 @@ class ExponentialDist(TrajectoryBase):
         self.invert = kwargs["invert"][
             0
         ]  # if true, higher probabilities occur at higher altitude TODO: Make this a required param
+        self.seed = kwargs.get("dist_seed", [None])[0]
 
         super().__init__()
 
@@ -47,6 +53,8 @@ class ExponentialDist(TrajectoryBase):
             + "_invert"
             + str(self.invert)
         )
+        if self.seed is not None:
+            self.trajectory_name += f"_Seed_{self.seed}"
         self.file_directory += self.trajectory_name + "/"
         pass
 
@@ -55,33 +63,40 @@ class ExponentialDist(TrajectoryBase):
         pull radius samples from an exponential distribution defined by
         the scale parameter.
         """
+        if self.seed is not None:
+            self.positions = self.generate_seeded(self.points)
+        else:
+            self.positions = self.sample_block(np.random, self.points)
+        return self.positions.copy()
+
+    def sample_block(self, rng, points):
+        "Samples drawn from rng (the np.random module or a Generator)"
         X = []
         Y = []
         Z = []
         idx = 0
-        X.extend(np.zeros((self.points,)).tolist())
-        Y.extend(np.zeros((self.points,)).tolist())
-        Z.extend(np.zeros((self.points,)).tolist())
+        X.extend(np.zeros((points,)).tolist())
+        Y.extend(np.zeros((points,)).tolist())
+        Z.extend(np.zeros((points,)).tolist())
 
-        for i in range(self.points):
-            phi = np.random.uniform(0, np.pi)
-            theta = np.random.uniform(0, 2 * np.pi)
+        for i in range(points):
+            phi = rng.uniform(0, np.pi)
+            theta = rng.uniform(0, 2 * np.pi)
 
             # If the curve is inverted, make sure the position isn't inside of the body.
             # If it is, resample until its within bounds.
             if self.invert:
-                alt = -1.0 * np.random.exponential(self.scale_parameter)
+                alt = -1.0 * rng.exponential(self.scale_parameter)
                 r = self.radiusBounds[1] + alt
                 while r < self.radiusBounds[0]:
-                    alt = -1.0 * np.random.exponential(self.scale_parameter)
+                    alt = -1.0 * rng.exponential(self.scale_parameter)
                     r = self.radiusBounds[1] + alt
             else:
-                alt = np.random.exponential(self.scale_parameter)
+                alt = rng.exponential(self.scale_parameter)
                 r = self.radiusBounds[0] + alt
 
             X[idx] = r * np.sin(phi) * np.cos(theta)
             Y[idx] = r * np.sin(phi) * np.sin(theta)
             Z[idx] = r * np.cos(phi)
             idx += 1
-        self.positions = np.transpose(np.array([X, Y, Z]))
         return np.transpose(np.array([X, Y, Z]))
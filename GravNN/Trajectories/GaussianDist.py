@@ -6,6 +6,8 @@ from GravNN.Trajectories.TrajectoryBase import TrajectoryBase
 
 
 class GaussianDist(TrajectoryBase):
+    cache_attributes = ("mu", "sigma", "seed")
+
     def __init__(self, celestial_body, radius_bounds, points, **kwargs):
         """Distribution drawn from a gaussian density profile.
 
@@ -15,12 +17,16 @@ class GaussianDist(TrajectoryBase):
             points (int): number of samples to be drawn
             mu (float): center of the distribution
             sigma (float): 1-sigma value for the gaussian distribution
+            dist_seed (int, optional): seed making the samples reproducible, the
+                first K samples are then shared by every number of points >= K
+                (see TrajectoryBase.generate_seeded). Defaults to None.
         """
         self.radius_bounds = radius_bounds
         self.points = points
         self.celestial_body = celestial_body
         self.mu = kwargs["mu"][0]
         self.sigma = kwargs["sigma"][0]
+        self.seed = kwargs.get("dist_seed", [None])[0]
         super().__init__()
         pass
 
@@ -38,28 +44,37 @@ class GaussianDist(TrajectoryBase):
             + "_sigma"
             + str(self.sigma)
         )
+        if self.seed is not None:
+            self.trajectory_name += f"_Seed_{self.seed}"
         self.file_directory += self.trajectory_name + "/"
         pass
 
     def generate(self):
+        if self.seed is not None:
+            self.positions = self.generate_seeded(self.points)
+        else:
+            self.positions = self.sample_block(np.random, self.points)
+        return self.positions.copy()
+
+    def sample_block(self, rng, points):
+        "Samples drawn from rng (the np.random module or a Generator)"
         X = []
         Y = []
         Z = []
         idx = 0
-        X.extend(np.zeros((self.points,)).tolist())
-        Y.extend(np.zeros((self.points,)).tolist())
-        Z.extend(np.zeros((self.points,)).tolist())
+        X.extend(np.zeros((points,)).tolist())
+        Y.extend(np.zeros((points,)).tolist())
+        Z.extend(np.zeros((points,)).tolist())
 
-        for i in range(self.points):
-            phi = np.random.uniform(0, np.pi)
-            theta = np.random.uniform(0, 2 * np.pi)
-            r = np.random.normal(self.mu, self.sigma)
+        for i in range(points):
+            phi = rng.uniform(0, np.pi)
+            theta = rng.uniform(0, 2 * np.pi)
+            r = rng.normal(self.mu, self.sigma)
             while r > self.radius_bounds[1] or r < self.radius_bounds[0]:
-                r = np.random.normal(self.mu, self.sigma)
+                r = rng.normal(self.mu, self.sigma)
 
             X[idx] = r * np.sin(phi) * np.cos(theta)
             Y[idx] = r * np.sin(phi) * np.sin(theta)
             Z[idx] = r * np.cos(phi)
             idx += 1
-        self.positions = np.transpose(np.array([X, Y, Z]))
         return np.transpose(np.array([X, Y, Z]))
@@ -1,13 +1,16 @@
 import os
 
 import numpy as np
-import trimesh
 
+from GravNN.Support.MeshContainment import MeshContainment
 from GravNN.Support.PathTransformations import make_windows_path_posix
+from GravNN.Support.ShapeModelRegistry import get_shape_model
 from GravNN.Trajectories.TrajectoryBase import TrajectoryBase
 
 
 class RandomDist(TrajectoryBase):
+    cache_attributes = ("uniform_volume", "obj_file", "seed")
+
     def __init__(self, celestial_body, radius_bounds, points, **kwargs):
         """A distribution that samples uniformly in a spherical volume.
 
@@ -15,6 +18,11 @@ class RandomDist(TrajectoryBase):
             celestial_body (Celestial Body): Planet about which samples should be taken
             radius_bounds (list): range of radii from which the sample can be drawn
             points (int): number of samples
+            uniform_volume (bool, optional): sample uniformly in volume rather than
+                in radius. Defaults to False.
+            dist_seed (int, optional): seed making the samples reproducible, the
+                first K samples are then shared by every number of points >= K
+                (see TrajectoryBase.generate_seeded). Defaults to None.
         """
         self.radius_bounds = radius_bounds
         self.points = int(points)
@@ -25,6 +33,11 @@ class RandomDist(TrajectoryBase):
             uniform_volume = uniform_volume[0]
         self.uniform_volume = uniform_volume
 
+        seed = kwargs.get("dist_seed", None)
+        if isinstance(seed, list):
+            seed = seed[0]
+        self.seed = seed
+
         self.populate_obj_file(**kwargs)
         super().__init__(**kwargs)
 
@@ -55,12 +68,8 @@ class RandomDist(TrajectoryBase):
         # If the file was saved on windows but we are running on mac, load the mac path.
         self.obj_file = make_windows_path_posix(self.obj_file)
 
-        _, file_extension = os.path.splitext(self.obj_file)
         self.filename = os.path.basename(self.obj_file)
-        self.obj_mesh = trimesh.load_mesh(
-            self.obj_file,
-            file_type=file_extension[1:],
-        )
+        self.obj_mesh = get_shape_model(self.obj_file).mesh
 
     def generate_full_file_directory(self):
         directory_name = os.path.splitext(os.path.basename(__file__))[0]
@@ -82,9 +91,11 @@ class RandomDist(TrajectoryBase):
             bounds_str = bounds_str.replace("[0,", "[0.0,")
 
         self.trajectory_name += f"_RadBounds{bounds_str}_UVol_{uniform_vol}"
+        if self.seed is not None:
+            self.trajectory_name += f"_Seed_{self.seed}"
         self.file_directory += self.trajectory_name + "/"
 
-    def sample_volume(self, points):
+    def sample_volume(self, points, rng=np.random):
         X = []
         Y = []
         Z = []
@@ -92,8 +103,8 @@ class RandomDist(TrajectoryBase):
         Y.extend(np.zeros((points,)).tolist())
         Z.extend(np.zeros((points,)).tolist())
 
-        theta = np.random.uniform(0, 2 * np.pi, size=(points,))
-        cosphi = np.random.uniform(-1, 1, size=(points,))
+        theta = rng.uniform(0, 2 * np.pi, size=(points,))
+        cosphi = rng.uniform(-1, 1, size=(points,))
         R_min = self.radius_bounds[0]
         R_max = self.radius_bounds[1]
 
@@ -103,12 +114,12 @@ class RandomDist(TrajectoryBase):
             u_max = 1.0
 
             # want distribution to be uniform across volume the sphere
-            u = np.random.uniform(u_min, u_max, size=(points,))
+            u = rng.uniform(u_min, u_max, size=(points,))
 
             # convert the uniform volume length into physical radius
             r = R_max * u ** (1.0 / 3.0)
         else:
-            r = np.random.uniform(R_min, R_max, size=(points,))
+            r = rng.uniform(R_min, R_max, size=(points,))
         phi = np.arccos(cosphi)
 
         X = r * np.sin(phi) * np.cos(theta)
@@ -118,17 +129,10 @@ class RandomDist(TrajectoryBase):
         return np.transpose(np.array([X, Y, Z]))  # [N x 3]
 
     def identify_interior_points(self, positions):
-        # Necessary to cap memory footprint
-        N = len(positions)
-        step = 500
-        mask = np.full((N,), False)
-        rayObject = trimesh.ray.ray_triangle.RayMeshIntersector(self.obj_mesh)
-        for i in range(0, N, step):
-            end_idx = (i // step + 1) * step
-            position_subset = positions[i:end_idx] / 1e3
-            mask[i:end_idx] = rayObject.contains_points(position_subset)
-            print(i / N)
-        return mask
+        # The classifier caches a voxel grid of the shape model, build it once
+        if not hasattr(self, "containment"):
+            self.containment = MeshContainment(self.obj_mesh)
+        return self.containment.contains(positions / 1e3)
 
     def assess_skip_condition(self):
         """These bodies shapes are currently spheres so there
@@ -155,12 +159,30 @@ class RandomDist(TrajectoryBase):
             positions[mask] = self.recursively_remove_interior_points(new_positions)
         return positions
 
+    def sample_block(self, rng, points):
+        "Samples drawn from rng, redrawing the interior points from the same stream"
+        positions = self.sample_volume(points, rng)
+        if self.assess_skip_condition():
+            return positions
+
+        mask = self.identify_interior_points(positions)
+        while np.any(mask):
+            resampled = self.sample_volume(int(np.sum(mask)), rng)
+            positions[mask] = resampled
+            mask[mask] = self.identify_interior_points(resampled)
+        return positions
+
     def generate(self):
         """Randomly sample from uniform latitude, longitude, and radial distributions
 
         Returns:
             np.array: cartesian positions of the samples
         """
+        if self.seed is not None:
+            positions = self.generate_seeded(self.points)
+            self.positions = positions
+            return positions.copy()
+
         positions = self.sample_volume(self.points)
         positions = self.recursively_remove_interior_points(positions)
         self.positions = positions
@@ -1,8 +1,8 @@
 import os
 
 import numpy as np
-import trimesh
 
+from GravNN.Support.ShapeModelRegistry import get_shape_model
 from GravNN.Trajectories.TrajectoryBase import TrajectoryBase
 
 
@@ -31,9 +31,8 @@ class SurfaceDHGridDist(TrajectoryBase):
         self.file_directory += self.trajectory_name + "/"
 
     def load_obj_file(self, shape_file):
-        filename, file_extension = os.path.splitext(shape_file)
         self.shape_file = shape_file
-        self.obj_file = trimesh.load_mesh(shape_file, file_type=file_extension[1:])
+        self.obj_file = get_shape_model(shape_file).mesh
 
     def generate(self):
         """Sample the grid at uniform intervals defined by the maximum
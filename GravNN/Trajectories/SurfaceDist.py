@@ -1,8 +1,8 @@
 import os
 
 import numpy as np
-import trimesh
 
+from GravNN.Support.ShapeModelRegistry import get_shape_model
 from GravNN.Trajectories.TrajectoryBase import TrajectoryBase
 
 
@@ -15,8 +15,7 @@ class SurfaceDist(TrajectoryBase):
             celestial_body (CelestialBody): body from which points will be sampled
             obj_file (str): path to the file that contains the shape model
         """
-        filename, file_extension = os.path.splitext(obj_file)
-        self.mesh = trimesh.load_mesh(obj_file, file_type=file_extension[1:])
+        self.mesh = get_shape_model(obj_file).mesh
         self.points = len(self.mesh.faces)  # + self.mesh.vertices)
         self.celestial_body = celestial_body
         self.obj_file = obj_file
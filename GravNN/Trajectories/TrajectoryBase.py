@@ -1,31 +1,108 @@
+import inspect
 import os
-import pickle
 from abc import ABC, abstractmethod
 
+import numpy as np
+
+from GravNN.Support.ArrayStorage import load_array, migrate_pickle, save_array
+from GravNN.Support.DataCache import canonical_hash, get_data_cache
+from GravNN.Support.FileLease import FileLease
+
 
 class TrajectoryBase(ABC):
+    # Files of a distribution tracked by the data cache
+    cache_files = ["positions.npy", "times.npy", "trajectory.data"]
+
+    # Attributes defining the distribution besides the arguments of __init__
+    cache_attributes = ()
+
+    # Number of points drawn from each random stream of a seeded distribution
+    seed_block_size = 1024
+
     def __init__(self, **kwargs):
         """Base class for all trajectories and distributions used in GravNN"""
-        # positions
+        # positions, the path is normalized so that creating it (or a lock in it)
+        # doesn't depend on directories named after the modules
         self.file_directory = (
-            os.path.splitext(__file__)[0] + "/../../Files/Trajectories/"
+            os.path.abspath(os.path.dirname(__file__) + "/../Files/Trajectories")
+            + "/"
         )
         self.generate_full_file_directory()
+        self.cache_key = canonical_hash(
+            self.__class__.__name__,
+            self.cache_parameters(),
+        )
+        self.prefix_key = self.generate_prefix_key()
         self.load(override=kwargs.get("override", [False])[0])
         return
 
+    def cache_parameters(self):
+        """Parameters identifying the distribution in the data cache: the
+        arguments of __init__ stored as attributes of the same name plus
+        cache_attributes"""
+        names = list(inspect.signature(self.__init__).parameters)
+        names += list(self.cache_attributes)
+        return {name: getattr(self, name) for name in names if hasattr(self, name)}
+
+    def generate_prefix_key(self):
+        """Key shared by the seeded distributions that only differ by their number
+        of points, whose positions are prefixes of one another (see
+        generate_seeded). None for distributions without a seed."""
+        if getattr(self, "seed", None) is None:
+            return None
+        parameters = self.cache_parameters()
+        parameters.pop("points", None)
+        return canonical_hash(self.__class__.__name__, parameters)
+
+    def generate_seeded(self, points):
+        """Positions of a seeded distribution. Blocks of seed_block_size points
+        are drawn with sample_block from the streams default_rng([seed, block]),
+        always in full, so the first K points are identical for every number of
+        points >= K.
+
+        Args:
+            points (int): number of points
+
+        Returns:
+            np.array: cartesian positions of the samples (points x 3)
+        """
+        n_blocks = (int(points) + self.seed_block_size - 1) // self.seed_block_size
+        blocks = [np.zeros((0, 3))]
+        for block in range(n_blocks):
+            rng = np.random.default_rng([int(self.seed), block])
+            blocks.append(self.sample_block(rng, self.seed_block_size))
+        return np.concatenate(blocks)[: int(points)]
+
+    def sample_block(self, rng, points):
+        """Draw points positions from the random generator rng (required by
+        seeded distributions)"""
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support seeded generation",
+        )
+
     def save(self):
         """Save the distribution positions in the directory generated by `generate_full_file_directory`."""
         if not os.path.exists(self.file_directory):
             os.makedirs(self.file_directory, exist_ok=True)
-        with open(self.file_directory + "trajectory.data", "wb") as f:
-            pickle.dump(self.positions, f)
-            try:
-                pickle.dump(self.times, f)
-            except:
-                pass
+        save_array(self.file_directory + "positions.npy", self.positions)
+        if getattr(self, "times", None) is not None:
+            save_array(self.file_directory + "times.npy", self.times)
+        get_data_cache().register(self.cache_key, self.file_directory, self.cache_files)
         return
 
+    def saved(self):
+        """Check for stored positions, converting a trajectory.data pickle left by
+        earlier versions on first access"""
+        return os.path.exists(self.file_directory + "positions.npy") or migrate_pickle(
+            self.file_directory + "trajectory.data",
+            [self.file_directory + "positions.npy", self.file_directory + "times.npy"],
+        )
+
+    def load_positions(self, rows=None, columns=None):
+        """Memory map the stored positions, optionally restricted to a row range
+        and / or columns (see ArrayStorage.load_array)"""
+        return load_array(self.file_directory + "positions.npy", rows, columns)
+
     def load(self, override=False):
         """Load the distribution if it exists, or generate (and then save) a new distribution
 
@@ -35,20 +112,32 @@ class TrajectoryBase(ABC):
         Returns:
             np.array: cartesian position vectors of distribution
         """
-        # Check if the file exists and either load the positions or generate the position
-        if os.path.exists(self.file_directory + "trajectory.data") and not override:
-            with open(self.file_directory + "trajectory.data", "rb") as f:
-                self.positions = pickle.load(f)
-                try:
-                    self.times = pickle.load(f)
-                except:
-                    pass
-            return self.positions
-
-        else:
-            self.generate()
-            self.save()
-            return self.positions
+        # Data cached under the same parameters is reused even if the directory
+        # name was formatted differently when it was generated
+        cached_directory = get_data_cache().lookup(self.cache_key)
+        if cached_directory is not None:
+            self.file_directory = cached_directory
+
+        if override or not self.saved():
+            # Processes requesting the same distribution wait for the first one
+            # to generate it rather than saving positions of their own
+            with FileLease(self.file_directory + "generation.lock"):
+                if override or not self.saved():
+                    self.generate()
+                    self.save()
+                    return self.positions
+
+        # Stored earlier, possibly by another process
+        self.positions = self.load_positions()
+        if os.path.exists(self.file_directory + "times.npy"):
+            self.times = load_array(self.file_directory + "times.npy")
+        if cached_directory is None:
+            get_data_cache().register(
+                self.cache_key,
+                self.file_directory,
+                self.cache_files,
+            )
+        return self.positions
 
     @abstractmethod
     def generate_full_file_directory(self):
@@ -2,7 +2,7 @@ import numpy as np
 import pandas as pd
 
 from GravNN.CelestialBodies.Planets import Earth, Moon
-from GravNN.GravityModels.SphericalHarmonics import get_sh_data
+from GravNN.GravityModels.SphericalHarmonics import SphericalHarmonicsDegRemoved
 from GravNN.Support.StateObject import StateObject
 from GravNN.Support.Statistics import sigma_mask
 from GravNN.Trajectories import FibonacciDist
@@ -45,8 +45,10 @@ def main():
     for i, alt in enumerate(alt_list):
         trajectory = FibonacciDist(planet, planet.radius + alt, points=points)
 
-        x, a, u = get_sh_data(trajectory, sh_file, max_deg=max_deg, deg_removed=2)
-        grid_true = StateObject(trajectory=trajectory, accelerations=a)
+        # All truncation degrees (and the truth) come from a single sweep
+        sh_model = SphericalHarmonicsDegRemoved(sh_file, max_deg, 2, trajectory)
+        a_truncated, _ = sh_model.compute_truncated(np.append(deg_list, max_deg))
+        grid_true = StateObject(trajectory=trajectory, accelerations=a_truncated[-1])
 
         rse_mean_array = np.zeros((1, len(deg_list)))
         sigma_1_f_mean_array = np.zeros((1, len(deg_list)))
@@ -57,10 +59,7 @@ def main():
         sigma_3_c_mean_array = np.zeros((1, len(deg_list)))
 
         for j in range(len(deg_list)):
-            deg = deg_list[j]
-
-            x, a, u = get_sh_data(trajectory, sh_file, max_deg=deg, deg_removed=2)
-            grid_pred = StateObject(trajectory=trajectory, accelerations=a)
+            grid_pred = StateObject(trajectory=trajectory, accelerations=a_truncated[j])
             diff = grid_pred - grid_true
 
             sigma_1_mask, sigma_1_mask_compliment = sigma_mask(grid_true.total, 1)
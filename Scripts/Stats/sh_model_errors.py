@@ -2,7 +2,7 @@ import numpy as np
 import pandas as pd
 
 from GravNN.CelestialBodies.Planets import Earth
-from GravNN.GravityModels.SphericalHarmonics import get_sh_data
+from GravNN.GravityModels.SphericalHarmonics import SphericalHarmonics
 from GravNN.Support.StateObject import StateObject
 from GravNN.Support.Statistics import mean_std_median, sigma_mask
 from GravNN.Trajectories import FibonacciDist
@@ -32,19 +32,22 @@ def main():
     # df_file = "Data/Dataframes/sh_stats_GEO.data"
     # trajectory = DHGridDist(planet, planet.radius + 35786000.0, degree=density_deg)
 
-    x, acc_sh, u = get_sh_data(
-        trajectory,
-        sh_file,
-        max_deg=max_deg,
-        deg_removed=deg_removed,
-    )
-    grid_true = StateObject(trajectory=trajectory, accelerations=acc_sh)
-
     deg_list = np.linspace(1, 150, 150, dtype=int)[1:]
     deg_list = np.append(deg_list, [175, 200, 215, 250, 300, 400, 500, 700, 900])
+
+    # Evaluate every truncation (and the truth) from a single sweep of the model
+    sh_model = SphericalHarmonics(sh_file, max_deg, trajectory)
+    acc_truncated, _ = sh_model.compute_truncated(
+        np.append(deg_list, [max(deg_removed, 0), max_deg]),
+    )
+    acc_true = acc_truncated[-1]
+    if deg_removed >= 0:
+        acc_true = acc_true - acc_truncated[-2]
+    grid_true = StateObject(trajectory=trajectory, accelerations=acc_true)
+
     df_all = pd.DataFrame()
-    for deg in deg_list:
-        x, acc_sh, u = get_sh_data(trajectory, sh_file, max_deg=deg, deg_removed=-1)
+    for i, deg in enumerate(deg_list):
+        acc_sh = acc_truncated[i]
 
         grid_pred = StateObject(trajectory=trajectory, accelerations=acc_sh)
         diff = grid_pred - grid_true
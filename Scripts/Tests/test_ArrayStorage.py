@@ -0,0 +1,90 @@
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from GravNN.Support.ArrayStorage import (
+    load_array,
+    migrate_directory,
+    migrate_pickle,
+    save_array,
+)
+
+
+def test_memory_mapped_roundtrip():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "acceleration.npy")
+        values = np.random.default_rng(0).normal(size=(1000, 3))
+        save_array(path, values.astype(">f8"))
+        assert os.listdir(directory) == ["acceleration.npy"]
+
+        array = load_array(path)
+        assert isinstance(array, np.memmap)
+        assert array.dtype == np.dtype("<f8")
+        assert np.array_equal(array, values)
+        assert np.array_equal(load_array(path, slice(10, 20), 1), values[10:20, 1])
+        assert np.array_equal(load_array(path, columns=[0, 2]), values[:, [0, 2]])
+
+        # Copy-on-write: modifications never reach the file
+        array[0] = 0.0
+        del array
+        assert np.array_equal(load_array(path)[0], values[0])
+
+        try:
+            save_array(path, np.array([None, 1.0]))
+            assert False, "arrays of objects should be rejected"
+        except TypeError:
+            pass
+        assert np.array_equal(load_array(path), values)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_migrate_pickles():
+    directory = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(1)
+        positions = rng.normal(size=(10, 3))
+        accelerations = rng.normal(size=(10, 3))
+        trajectory_directory = os.path.join(directory, "Trajectory")
+        model_directory = os.path.join(directory, "Model")
+        os.makedirs(trajectory_directory)
+        os.makedirs(model_directory)
+
+        # Trajectories without times pickled None after the positions
+        with open(os.path.join(trajectory_directory, "trajectory.data"), "wb") as f:
+            pickle.dump(positions, f)
+            pickle.dump(None, f)
+        with open(os.path.join(model_directory, "acceleration.data"), "wb") as f:
+            pickle.dump(accelerations, f)
+
+        assert migrate_pickle(
+            os.path.join(model_directory, "acceleration.data"),
+            [os.path.join(model_directory, "acceleration.npy")],
+        )
+        assert not migrate_pickle(
+            os.path.join(model_directory, "potential.data"),
+            [os.path.join(model_directory, "potential.npy")],
+        )
+        assert migrate_directory(directory) == 1
+
+        stored = load_array(os.path.join(trajectory_directory, "positions.npy"))
+        assert np.array_equal(stored, positions)
+        assert not os.path.exists(os.path.join(trajectory_directory, "times.npy"))
+        stored = load_array(os.path.join(model_directory, "acceleration.npy"))
+        assert np.array_equal(stored, accelerations)
+
+        # The pickles are kept for older versions
+        assert os.path.exists(os.path.join(trajectory_directory, "trajectory.data"))
+        assert migrate_directory(directory) == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_memory_mapped_roundtrip()
+    test_migrate_pickles()
+    print("Passed!")
@@ -0,0 +1,105 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+import GravNN
+from GravNN.GravityModels.CompositeGravityModel import (
+    Component,
+    CompositeGravityModel,
+)
+from GravNN.GravityModels.HeterogeneousPoly import generate_heterogeneous_model
+from GravNN.GravityModels.PointMass import PointMass
+from GravNN.GravityModels.Polyhedral import Polyhedral
+
+obj_file = os.path.dirname(GravNN.__file__) + "/Files/ShapeModels/Moon/Moon.obj"
+body = SimpleNamespace(mu=4.902799e12, radius=1738100.0, density=3346.0)
+
+
+def generate_positions(N, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(N, 3))
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x * rng.uniform(1.1, 3.0, size=(N, 1)) * body.radius
+
+
+def count_calls(model):
+    "Record the number of points of every compute_batch call of model"
+    calls = []
+    compute_batch = model.compute_batch
+
+    def counted(positions):
+        calls.append(len(positions))
+        return compute_batch(positions)
+
+    model.compute_batch = counted
+    return calls
+
+
+def point_mass_field(mu, offset, positions):
+    dr = positions - np.reshape(offset, (1, 3))
+    r = np.linalg.norm(dr, axis=1)
+    return -mu * dr / r[:, None] ** 3, -mu / r
+
+
+def test_components_cached():
+    positions = generate_positions(100)
+    models = [PointMass(SimpleNamespace(mu=mu)) for mu in [1.0, 2.0]]
+    offset = np.array([1e5, 0.0, 0.0])
+    composite = CompositeGravityModel(
+        body,
+        [models[0], Component(models[1], offset, scale=0.5)],
+    )
+    calls = [count_calls(model) for model in models]
+
+    def expected():
+        acc_0, pot_0 = point_mass_field(models[0].mu, np.zeros(3), positions)
+        acc_1, pot_1 = point_mass_field(models[1].mu, offset, positions)
+        return acc_0 + 0.5 * acc_1, pot_0 + 0.5 * pot_1
+
+    acc = composite.compute_acceleration(positions)
+    assert np.allclose(acc, expected()[0], rtol=1e-14, atol=0.0)
+    assert np.allclose(composite.potentials, expected()[1], rtol=1e-14, atol=0.0)
+    assert calls == [[100], [100]]
+
+    # Only the component whose mass or offset changed is evaluated again
+    models[1].mu = 3.0
+    composite.compute_acceleration(positions)
+    offset[1] = 1e4
+    acc = composite.compute_acceleration(positions)
+    assert calls == [[100], [100, 100, 100]]
+    assert np.allclose(acc, expected()[0], rtol=1e-14, atol=0.0)
+
+    composite.components[0].invalidate()
+    composite.compute_acceleration(positions)
+    composite.compute_acceleration(positions[:10])
+    assert calls == [[100, 100, 10], [100, 100, 100, 10]]
+
+
+def test_heterogeneous_poly():
+    positions = generate_positions(100)
+    model = generate_heterogeneous_model(body, obj_file, symmetric=True)
+    calls = count_calls(model.homogeneous_poly)
+
+    reference = Polyhedral(body, obj_file)
+    acc_ref = reference.compute_acceleration(positions)
+    pot_ref = reference.potentials.copy()
+    for point_mass, offset in zip(model.point_mass_list, model.offset_list):
+        acc, pot = point_mass_field(point_mass.mu, offset, positions)
+        acc_ref += acc
+        pot_ref += pot
+
+    acc = model.compute_acceleration(positions)
+    assert np.allclose(acc, acc_ref, rtol=1e-12, atol=0.0)
+    assert np.allclose(model.potentials, pot_ref, rtol=1e-12, atol=0.0)
+
+    # Sweeping the point masses reuses the polyhedral values
+    model.point_mass_list[1].mu *= 2.0
+    assert not np.allclose(model.compute_acceleration(positions), acc)
+    assert calls == [100]
+
+
+if __name__ == "__main__":
+    test_components_cached()
+    test_heterogeneous_poly()
+    print("Passed!")
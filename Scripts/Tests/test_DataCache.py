@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from GravNN.Support.ArrayStorage import save_array
+from GravNN.Support.DataCache import DataCache, canonical_hash, parse_size
+
+
+def test_canonical_keys():
+    # Cosmetic differences in the parameters give the same key
+    assert canonical_hash("RandomDist", {"radius_bounds": [0, 2e6], "points": 10}) == (
+        canonical_hash("RandomDist", {"points": 10.0, "radius_bounds": (0.0, 2e6)})
+    )
+    assert canonical_hash(np.float32(0.5), np.array([1, 2])) == canonical_hash(
+        0.5,
+        [1.0, 2.0],
+    )
+    earth = SimpleNamespace(body_name="earth", radius=1.0)
+    assert canonical_hash(earth) == canonical_hash(SimpleNamespace(body_name="earth"))
+    assert canonical_hash({"points": 10}) != canonical_hash({"points": 11})
+    assert canonical_hash(True) != canonical_hash(1)
+
+    # Files are identified by their contents rather than their path
+    directory = tempfile.mkdtemp()
+    try:
+        files = [os.path.join(directory, name) for name in ["a.obj", "b.obj"]]
+        for file in files:
+            with open(file, "w") as f:
+                f.write("v 0 0 0\n")
+        assert canonical_hash(files[0]) == canonical_hash(files[1])
+    finally:
+        shutil.rmtree(directory)
+
+    assert parse_size("500M") == 500 << 20
+    assert parse_size("1.5 GB") == int(1.5 * (1 << 30))
+    assert parse_size("5e8") == 500000000 and parse_size("") is None
+
+
+def add_entry(cache, name, parent=None):
+    "Register a directory holding a single 8 kB array"
+    directory = os.path.join(cache.root, name)
+    save_array(os.path.join(directory, "values.npy"), np.zeros((1000,)))
+    cache.register(name, directory, ["values.npy"], parent=parent)
+    time.sleep(0.01)
+    return directory + "/"
+
+
+def test_lru_eviction():
+    root = tempfile.mkdtemp()
+    try:
+        entry_size = os.path.getsize(add_entry(DataCache(root), "size") + "values.npy")
+        shutil.rmtree(root)
+        cache = DataCache(root, budget=3 * entry_size)
+
+        # b derives from a, which is used again after c was added
+        add_entry(cache, "a")
+        add_entry(cache, "b", parent="a")
+        add_entry(cache, "c")
+        assert cache.lookup("b") == os.path.join(root, "b") + "/"
+        assert cache.size() == 3 * entry_size
+
+        # Adding d evicts the least recently used entry: c
+        add_entry(cache, "d")
+        assert cache.lookup("c") is None
+        assert not os.path.exists(os.path.join(root, "c", "values.npy"))
+        assert cache.size() == 3 * entry_size
+
+        # Evicting a parent evicts the entries derived from it
+        cache.lookup("d")
+        add_entry(cache, "e")
+        assert cache.lookup("a") is None and cache.lookup("b") is None
+        assert cache.lookup("d") is not None and cache.lookup("e") is not None
+
+        # Data deleted outside of the cache is dropped from the index
+        os.remove(os.path.join(root, "e", "values.npy"))
+        assert cache.lookup("e") is None
+        assert cache.size() == entry_size
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    test_canonical_keys()
+    test_lru_eviction()
+    print("Passed!")
@@ -0,0 +1,154 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from GravNN.Support.FileLease import FileLease
+
+
+def write_lock(path, owner, age=0.0):
+    with open(path, "w") as f:
+        f.write(owner)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_exited_owner_taken_over():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "generation.lock")
+        write_lock(path, f"{socket.gethostname()}:{exited_pid()}:token")
+        lease = FileLease(path, verbose=False)
+        assert lease.acquire(blocking=False)
+        assert lease.owner() == lease.token
+        lease.release()
+        assert not os.path.exists(path)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_remote_owner_taken_over_once_stale():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "generation.lock")
+        write_lock(path, "other-host:1:token", age=5.0)
+        lease = FileLease(path, lease=60.0, verbose=False)
+        assert not lease.acquire(blocking=False)
+        assert lease.owner() == "other-host:1:token"
+
+        write_lock(path, "other-host:1:token", age=120.0)
+        assert lease.acquire(blocking=False)
+        lease.release()
+        assert os.listdir(directory) == []
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_lock_acquired_during_takeover_kept():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "generation.lock")
+        write_lock(path, "other-host:1:token", age=120.0)
+        lease = FileLease(path, lease=60.0, verbose=False)
+
+        # Another process takes the lock over and acquires it between the moment
+        # this one found it abandoned and its own takeover
+        abandoned = lease.abandoned
+
+        def acquired_meanwhile(owner):
+            result = abandoned(owner)
+            write_lock(path, "other-host:2:fresh")
+            return result
+
+        lease.abandoned = acquired_meanwhile
+        assert not lease.remove_if_abandoned()
+        assert lease.owner() == "other-host:2:fresh"
+        assert os.listdir(directory) == ["generation.lock"]
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_lock_created_during_restore_kept():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "generation.lock")
+        write_lock(path, "other-host:1:token", age=120.0)
+        lease = FileLease(path, lease=60.0, verbose=False)
+
+        # A second process acquires the lock before the takeover renames it, and
+        # a third creates one before it is moved back
+        abandoned = lease.abandoned
+        rename = os.rename
+
+        def acquired_meanwhile(owner):
+            result = abandoned(owner)
+            write_lock(path, "other-host:2:fresh")
+            return result
+
+        def created_after_rename(src, dst):
+            rename(src, dst)
+            write_lock(path, "other-host:3:third")
+
+        lease.abandoned = acquired_meanwhile
+        os.rename = created_after_rename
+        try:
+            assert not lease.remove_if_abandoned()
+        finally:
+            os.rename = rename
+        assert lease.owner() == "other-host:3:third"
+
+        # Neither lock is removed
+        stale = [name for name in os.listdir(directory) if name.endswith(".stale")]
+        assert len(stale) == 1
+        with open(os.path.join(directory, stale[0]), "r") as f:
+            assert f.read() == "other-host:2:fresh"
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_path_through_missing_directory():
+    directory = tempfile.mkdtemp()
+    try:
+        # As the file directories built from the module paths, e.g.
+        # .../TrajectoryBase/../../Files/
+        path = os.path.join(directory, "Missing", "..", "Data", "generation.lock")
+        with FileLease(path, verbose=False) as lease:
+            assert lease.path == os.path.join(directory, "Data", "generation.lock")
+            assert lease.owner() == lease.token
+        assert os.listdir(directory) == ["Data"]
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_refresh_held():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "generation.lock")
+        lease = FileLease(path, lease=60.0, verbose=False)
+        with lease:
+            old = time.time() - 120.0
+            os.utime(path, (old, old))
+            FileLease.refresh_held()
+            assert time.time() - os.path.getmtime(path) < 60.0
+        assert lease not in FileLease._held
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_exited_owner_taken_over()
+    test_remote_owner_taken_over_once_stale()
+    test_lock_acquired_during_takeover_kept()
+    test_lock_created_during_restore_kept()
+    test_path_through_missing_directory()
+    test_refresh_held()
+    print("Passed!")
@@ -0,0 +1,332 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from GravNN.GravityModels.PointMass import PointMass
+from GravNN.Support import DataCache
+from GravNN.Support.FileLease import FileLease
+from GravNN.Trajectories.TrajectoryBase import TrajectoryBase
+
+body = SimpleNamespace(mu=4.46e5, radius=16e3, body_name="TestBody")
+
+
+class SeededDist(TrajectoryBase):
+    # Directory holding the generated data of the tests
+    root = None
+
+    def __init__(self, points, seed=None, **kwargs):
+        """Points drawn uniformly in a shell around body, written below root"""
+        self.points = int(points)
+        self.seed = seed
+        super().__init__(**kwargs)
+
+    def generate_full_file_directory(self):
+        self.file_directory = (
+            f"{self.root}/SeededDist_N{self.points}_Seed{self.seed}/"
+        )
+
+    def sample_block(self, rng, points):
+        x = rng.normal(size=(points, 3))
+        x /= np.linalg.norm(x, axis=1, keepdims=True)
+        return x * rng.uniform(1.0, 3.0, size=(points, 1)) * body.radius
+
+    def generate(self):
+        if self.seed is not None:
+            self.positions = self.generate_seeded(self.points)
+        else:
+            self.positions = self.sample_block(np.random, self.points)
+        return self.positions
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(model, n_calls):
+    """Record the number of points of every compute_batch call of model and
+    raise Interrupted on call n_calls + 1 (never if None)"""
+    calls = []
+    compute_batch = model.compute_batch
+
+    def counted(positions):
+        if n_calls is not None and len(calls) == n_calls:
+            raise Interrupted()
+        calls.append(len(positions))
+        return compute_batch(positions)
+
+    model.compute_batch = counted
+    return calls
+
+
+def temporary_cache(budget=None):
+    "Redirect the generated data and the data cache to a temporary directory"
+    root = tempfile.mkdtemp()
+    SeededDist.root = root
+    DataCache._data_cache = DataCache.DataCache(root, budget)
+    return root
+
+
+def remove_cache(root):
+    DataCache._data_cache = None
+    shutil.rmtree(root)
+
+
+def reference(trajectory):
+    model = PointMass(body, trajectory=trajectory, parallel=False)
+    return model.compute_batch(np.asarray(trajectory.positions))
+
+
+def test_chunked_resume():
+    root = temporary_cache()
+    try:
+        trajectory = SeededDist(5000)
+        model = PointMass(body, trajectory=trajectory)
+        interrupt_after(model, 2)
+        try:
+            model.load(chunk_size=1000)
+            assert False, "the generation should have been interrupted"
+        except Interrupted:
+            pass
+        with open(model.file_directory + "generation_progress.json", "r") as f:
+            assert json.load(f)["completed"] == 2
+
+        # Only the remaining chunks are computed
+        model = PointMass(body, trajectory=trajectory)
+        calls = interrupt_after(model, None)
+        model.load(chunk_size=1000)
+        assert calls == [1000, 1000, 1000]
+        assert not os.path.exists(model.file_directory + "generation_progress.json")
+
+        acc, pot = reference(trajectory)
+        assert np.allclose(model.accelerations, acc, rtol=1e-14)
+        assert np.allclose(model.potentials, pot, rtol=1e-14)
+    finally:
+        remove_cache(root)
+
+
+def test_prefix_reuse():
+    root = temporary_cache()
+    try:
+        small = SeededDist(2000, seed=3)
+        PointMass(body, trajectory=small).load()
+
+        # Seeded positions are prefixes of one another
+        trajectory = SeededDist(5000, seed=3)
+        assert np.array_equal(trajectory.positions[:2000], small.positions)
+
+        # Only the missing tail is computed
+        model = PointMass(body, trajectory=trajectory)
+        calls = interrupt_after(model, None)
+        model.load()
+        assert calls == [3000]
+        acc, pot = reference(trajectory)
+        assert np.allclose(model.accelerations, acc, rtol=1e-14)
+        assert np.allclose(model.potentials, pot, rtol=1e-14)
+
+        # A smaller trajectory is copied entirely from the largest one
+        model = PointMass(body, trajectory=SeededDist(1000, seed=3))
+        calls = interrupt_after(model, None)
+        model.load()
+        assert calls == []
+        assert np.array_equal(model.accelerations, acc[:1000])
+
+        # Another seed draws other positions
+        model = PointMass(body, trajectory=SeededDist(1000, seed=4))
+        calls = interrupt_after(model, None)
+        model.load()
+        assert calls == [1000]
+    finally:
+        remove_cache(root)
+
+
+def test_prefix_resume():
+    root = temporary_cache()
+    try:
+        PointMass(body, trajectory=SeededDist(2000, seed=3)).load()
+
+        # The prefix is copied and the tail computed in checkpointed chunks
+        trajectory = SeededDist(5000, seed=3)
+        model = PointMass(body, trajectory=trajectory)
+        interrupt_after(model, 1)
+        try:
+            model.load(chunk_size=1000)
+            assert False, "the generation should have been interrupted"
+        except Interrupted:
+            pass
+        with open(model.file_directory + "generation_progress.json", "r") as f:
+            progress = json.load(f)
+        assert progress["start"] == 2000 and progress["completed"] == 1
+
+        model = PointMass(body, trajectory=trajectory)
+        calls = interrupt_after(model, None)
+        model.load(chunk_size=1000)
+        assert calls == [1000, 1000]
+
+        acc, pot = reference(trajectory)
+        assert np.allclose(model.accelerations, acc, rtol=1e-14)
+        assert np.allclose(model.potentials, pot, rtol=1e-14)
+    finally:
+        remove_cache(root)
+
+
+def test_sharded_merge():
+    root = temporary_cache()
+    try:
+        trajectory = SeededDist(1003)
+        acc, pot = reference(trajectory)
+
+        model = PointMass(body, trajectory=trajectory, parallel=False)
+        model.generate_sharded(4, poll_interval=0.01)
+        model.load()
+        assert np.array_equal(model.accelerations, acc)
+        assert np.array_equal(model.potentials, pot)
+        assert not os.path.exists(model.file_directory + "shards_4/")
+
+        # The merge doesn't depend on which process computed which shard, or when
+        model.discard_values()
+        for shard in [2, 0, 1]:
+            model.generate_shard(shard, 3)
+        assert model.missing_shards(3) == []
+        assert model.merge_shards(3)
+        model.load()
+        assert np.array_equal(model.accelerations, acc)
+        assert np.array_equal(model.potentials, pot)
+    finally:
+        remove_cache(root)
+
+
+def test_shard_lease_refreshed_per_chunk():
+    root = temporary_cache()
+    try:
+        trajectory = SeededDist(1000)
+        acc, pot = reference(trajectory)
+        model = PointMass(body, trajectory=trajectory, parallel=False)
+
+        refreshed = []
+        refresh = FileLease.refresh
+
+        def counted(lease):
+            refreshed.append(os.path.basename(lease.path))
+            refresh(lease)
+
+        calls = interrupt_after(model, None)
+        FileLease.refresh = counted
+        try:
+            model.generate_shard(1, 2, chunk_size=200)
+        finally:
+            FileLease.refresh = refresh
+        assert calls == [200, 200, 100]
+        assert refreshed == ["shard_00001.lock"] * 3
+
+        model.generate_shard(0, 2, chunk_size=300)
+        assert model.merge_shards(2)
+        model.load()
+        assert np.array_equal(model.accelerations, acc)
+        assert np.array_equal(model.potentials, pot)
+    finally:
+        remove_cache(root)
+
+
+def test_sharded_override_once_per_run():
+    root = temporary_cache()
+    try:
+        trajectory = SeededDist(900)
+        acc, pot = reference(trajectory)
+        model = PointMass(body, trajectory=trajectory, parallel=False)
+
+        # Stale values, including a pickle left by an earlier version
+        os.makedirs(model.file_directory, exist_ok=True)
+        with open(model.file_directory + "acceleration.data", "wb") as f:
+            pickle.dump(np.zeros((900, 3)), f)
+        with open(model.file_directory + "potential.data", "wb") as f:
+            pickle.dump(np.zeros((900,)), f)
+
+        # The first task of the run discards them, then computes its shard and
+        # the shards no other task took
+        calls = interrupt_after(model, None)
+        model.generate_sharded(
+            3,
+            shard=1,
+            override=True,
+            run_id="1",
+            poll_interval=0.01,
+        )
+        assert sorted(calls) == [300, 300, 300]
+
+        # A task of the same run starting after the merge keeps the new values
+        late = PointMass(body, trajectory=trajectory, parallel=False)
+        calls = interrupt_after(late, None)
+        late.generate_sharded(
+            3,
+            shard=2,
+            override=True,
+            run_id="1",
+            poll_interval=0.01,
+        )
+        assert calls == []
+        late.load()
+        assert np.array_equal(late.accelerations, acc)
+        assert np.array_equal(late.potentials, pot)
+
+        # A new run overrides again
+        calls = interrupt_after(late, None)
+        late.generate_sharded(
+            3,
+            shard=0,
+            override=True,
+            run_id="2",
+            poll_interval=0.01,
+        )
+        assert sorted(calls) == [300, 300, 300]
+    finally:
+        remove_cache(root)
+
+
+def test_concurrent_load_computed_once():
+    root = temporary_cache()
+    try:
+        trajectory = SeededDist(1000)
+        models = [PointMass(body, trajectory=trajectory) for _ in range(3)]
+        calls = []
+        for model in models:
+            compute_batch = model.compute_batch
+
+            def slow(positions, compute_batch=compute_batch):
+                calls.append(len(positions))
+                time.sleep(0.5)
+                return compute_batch(positions)
+
+            model.compute_batch = slow
+
+        # The other loads wait for the first one and read its values
+        threads = [threading.Thread(target=model.load) for model in models]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert calls == [1000]
+
+        acc, pot = reference(trajectory)
+        for model in models:
+            assert np.allclose(model.accelerations, acc, rtol=1e-14)
+            assert np.allclose(model.potentials, pot, rtol=1e-14)
+        assert not os.path.exists(model.file_directory + "generation.lock")
+    finally:
+        remove_cache(root)
+
+
+if __name__ == "__main__":
+    test_chunked_resume()
+    test_prefix_reuse()
+    test_prefix_resume()
+    test_sharded_merge()
+    test_sharded_override_once_per_run()
+    test_concurrent_load_computed_once()
+    print("Passed!")
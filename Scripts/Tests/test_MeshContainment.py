@@ -0,0 +1,84 @@
+import numpy as np
+import trimesh
+
+from GravNN.Support.MeshContainment import MeshContainment
+
+
+def sample_points(mesh, N, seed=0):
+    "Points in the bounding box of the mesh enlarged by 30%"
+    rng = np.random.default_rng(seed)
+    center = np.mean(mesh.bounds, axis=0)
+    half_width = 1.3 * (mesh.bounds[1] - mesh.bounds[0]) / 2.0
+    return rng.uniform(center - half_width, center + half_width, size=(N, 3))
+
+
+def voxel_mesh(solid):
+    """Closed mesh of the boundary faces of the solid unit voxels, oriented
+    from the solid toward the empty voxels"""
+    padded = np.pad(solid, 1)
+    vertices, faces = [], []
+    for axis in range(3):
+        b, c = np.eye(3)[(axis + 1) % 3], np.eye(3)[(axis + 2) % 3]
+        for sign in [-1, 1]:
+            neighbors = np.roll(padded, -sign, axis=axis)[1:-1, 1:-1, 1:-1]
+            for voxel in np.argwhere(solid & ~neighbors):
+                p = voxel + (sign > 0) * np.eye(3)[axis]
+                n = len(vertices)
+                vertices += [p, p + b, p + b + c, p + c]
+                if sign > 0:
+                    faces += [[n, n + 1, n + 2], [n, n + 2, n + 3]]
+                else:
+                    faces += [[n, n + 2, n + 1], [n, n + 3, n + 2]]
+    return trimesh.Trimesh(np.array(vertices), np.array(faces))
+
+
+def check_matches_winding_numbers(mesh, resolution=32):
+    containment = MeshContainment(mesh, resolution=resolution)
+    assert containment.labels is not None
+
+    # The grid is padded so the exterior surrounds the mesh
+    labels = containment.labels
+    for boundary in [labels[0], labels[-1], labels[:, 0], labels[:, -1]]:
+        assert np.all(boundary == 0)
+    assert np.all(labels[:, :, 0] == 0) and np.all(labels[:, :, -1] == 0)
+
+    points = sample_points(mesh, 20000)
+    inside = containment.contains(points)
+    assert np.array_equal(inside, containment.winding_numbers(points) > 0.5)
+    assert np.any(inside) and not np.all(inside)
+    return containment
+
+
+def test_box():
+    # Axis aligned faces lie exactly on the bounds of the grid
+    check_matches_winding_numbers(trimesh.creation.box())
+
+
+def test_torus():
+    # The hole is exterior but only reachable around the mesh
+    check_matches_winding_numbers(trimesh.creation.torus(1.0, 0.3))
+
+
+def test_narrow_neck():
+    # A cavity open to the outside through a neck one voxel wide
+    solid = np.ones((7, 7, 7), dtype=bool)
+    solid[2:5, 2:5, 2:5] = False
+    solid[3, 3, 5:] = False
+    mesh = voxel_mesh(solid)
+    assert mesh.is_watertight and mesh.volume > 0
+
+    center = np.array([[3.5, 3.5, 3.5]])
+    for resolution in [32, 10]:
+        containment = check_matches_winding_numbers(mesh, resolution)
+        assert not containment.contains(center)[0]
+
+    # The coarse grid walls the neck off, the cavity is still labelled exterior
+    cell = np.floor((center[0] - containment.origin) / containment.cell_size)
+    assert containment.labels[tuple(cell.astype(int))] == 0
+
+
+if __name__ == "__main__":
+    test_box()
+    test_torus()
+    test_narrow_neck()
+    print("Passed!")
@@ -0,0 +1,482 @@
+import os
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+
+from GravNN.GravityModels.PinesAlgorithm import (
+    compute_acc,
+    compute_acc_adaptive,
+    compute_acc_adaptive_blocks_jit,
+    compute_acc_degrees,
+    compute_acc_grid,
+    compute_acc_low_memory,
+    compute_acc_shells,
+    compute_acc_thread,
+    compute_n_matrices,
+    truncation_degree,
+)
+from GravNN.GravityModels.SHCoefficients import (
+    PackedCoefficients,
+    lm_index,
+    order_index,
+    to_order_major,
+)
+from GravNN.GravityModels.SphericalHarmonics import (
+    SphericalHarmonics,
+    coefficient_cache_path,
+)
+from GravNN.Regression.utils import (
+    format_coefficients,
+    populate_removed_degrees,
+    save,
+)
+
+mu = 0.3986004415e15
+radius = 6378136.6
+
+
+def generate_coefficients(degree, seed=0):
+    """Random (decaying) Stokes coefficients so the tests don't depend on the
+    gravity files being downloaded"""
+    rng = np.random.default_rng(seed)
+    C_lm = np.zeros((degree + 3, degree + 3))
+    S_lm = np.zeros((degree + 3, degree + 3))
+    for l in range(degree + 3):  # noqa: E741
+        C_lm[l, : l + 1] = rng.normal(size=(l + 1,)) * 1e-6 / (l + 1) ** 2
+        S_lm[l, 1 : l + 1] = rng.normal(size=(l,)) * 1e-6 / (l + 1) ** 2
+    C_lm[0, 0] = 1.0
+    C_lm[2, 0] = -4.84e-4
+    return C_lm, S_lm
+
+
+def generate_positions(N, seed=1):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(N, 3))
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x * rng.uniform(1.0, 2.0, size=(N, 1)) * radius
+
+
+def test_batched_matches_thread():
+    degree = 30
+    C_lm, S_lm = generate_coefficients(degree)
+    packed = PackedCoefficients.from_dense(C_lm, S_lm)
+    n1, n2, n1q, n2q = compute_n_matrices(degree)
+    positions = generate_positions(20)
+
+    for parallel in [True, False]:
+        acc, pot = compute_acc(
+            positions.reshape((-1,)),
+            degree,
+            mu,
+            radius,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            C_lm,
+            S_lm,
+            parallel=parallel,
+        )
+        acc = acc.reshape((-1, 3))
+        for i in range(len(positions)):
+            acc_i, pot_i = compute_acc_thread(
+                positions[i],
+                degree,
+                mu,
+                radius,
+                n1,
+                n2,
+                n1q,
+                n2q,
+                packed.C,
+                packed.S,
+            )
+            assert np.allclose(acc[i], acc_i, rtol=1e-12, atol=0.0)
+            assert np.isclose(pot[i], pot_i, rtol=1e-12, atol=0.0)
+
+
+def test_low_memory():
+    for degree in [0, 1, 2, 30]:
+        C_lm, S_lm = generate_coefficients(degree)
+        n1, n2, n1q, n2q = compute_n_matrices(degree)
+        positions = generate_positions(20).reshape((-1,))
+        args = (degree, mu, radius, n1, n2, n1q, n2q, C_lm, S_lm)
+
+        acc, pot = compute_acc(positions, *args)
+        acc_lm, pot_lm = compute_acc_low_memory(positions, *args)
+
+        assert np.allclose(acc, acc_lm, rtol=1e-12, atol=1e-20)
+        assert np.allclose(pot, pot_lm, rtol=1e-12, atol=0.0)
+
+
+def test_degree_band():
+    degree = 30
+    C_lm, S_lm = generate_coefficients(degree)
+    positions = generate_positions(20).reshape((-1,))
+    n_matrices = compute_n_matrices(degree)
+
+    for deg_removed in [0, 2, 10]:
+        acc_hf, pot_hf = compute_acc(
+            positions,
+            degree,
+            mu,
+            radius,
+            *n_matrices,
+            C_lm,
+            S_lm,
+        )
+        acc_lf, pot_lf = compute_acc(
+            positions,
+            deg_removed,
+            mu,
+            radius,
+            *compute_n_matrices(deg_removed),
+            C_lm,
+            S_lm,
+        )
+        for fcn in [compute_acc, compute_acc_low_memory]:
+            acc, pot = fcn(
+                positions,
+                degree,
+                mu,
+                radius,
+                *n_matrices,
+                C_lm,
+                S_lm,
+                deg_removed=deg_removed,
+            )
+            assert np.allclose(acc, acc_hf - acc_lf, rtol=1e-8, atol=1e-14)
+            assert np.allclose(pot, pot_hf - pot_lf, rtol=1e-6, atol=1e-6)
+
+
+def test_degree_truncations():
+    degree = 30
+    C_lm, S_lm = generate_coefficients(degree)
+    positions = generate_positions(20).reshape((-1,))
+    degrees = [30, 0, 4, 17, 4]
+
+    acc_all, pot_all = compute_acc_degrees(
+        positions,
+        degrees,
+        mu,
+        radius,
+        *compute_n_matrices(degree),
+        C_lm,
+        S_lm,
+    )
+    for i, deg in enumerate(degrees):
+        acc, pot = compute_acc(
+            positions,
+            deg,
+            mu,
+            radius,
+            *compute_n_matrices(deg),
+            C_lm,
+            S_lm,
+        )
+        assert np.allclose(acc_all[i], acc, rtol=1e-12, atol=1e-20)
+        assert np.allclose(pot_all[i], pot, rtol=1e-12, atol=0.0)
+
+
+def test_dh_grid():
+    degree = 30
+    C_lm, S_lm = generate_coefficients(degree)
+    n1, n2, n1q, n2q = compute_n_matrices(degree)
+
+    # Grid coarser than the expansion so the longitude folding is exercised
+    N_lat, N_lon = 8, 16
+    r = 1.2 * radius
+    phi = np.linspace(0, np.pi, N_lat, endpoint=True)
+    theta = np.linspace(0, 2 * np.pi, N_lon, endpoint=True)
+    positions = np.zeros((N_lon, N_lat, 3))
+    positions[:, :, 0] = r * np.outer(np.cos(theta), np.sin(phi))
+    positions[:, :, 1] = r * np.outer(np.sin(theta), np.sin(phi))
+    positions[:, :, 2] = r * np.outer(np.ones_like(theta), np.cos(phi))
+
+    for deg_removed in [-1, 2]:
+        acc_true, pot_true = compute_acc(
+            positions.reshape((-1,)),
+            degree,
+            mu,
+            radius,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            C_lm,
+            S_lm,
+            deg_removed=deg_removed,
+        )
+        acc, pot = compute_acc_grid(
+            phi,
+            N_lon,
+            r,
+            degree,
+            mu,
+            radius,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            C_lm,
+            S_lm,
+            deg_removed=deg_removed,
+        )
+        scale = np.max(np.abs(acc_true))
+        assert np.allclose(acc.reshape((-1,)), acc_true, rtol=0, atol=1e-12 * scale)
+        assert np.allclose(pot.reshape((-1,)), pot_true, rtol=1e-12)
+
+
+def test_radial_shells():
+    degree = 30
+    C_lm, S_lm = generate_coefficients(degree)
+    n1, n2, n1q, n2q = compute_n_matrices(degree)
+    positions = generate_positions(20)
+    directions = positions / np.linalg.norm(positions, axis=1, keepdims=True)
+    radii = radius * np.array([1.0, 1.3, 2.0])
+
+    for deg_removed in [-1, 2]:
+        acc, pot = compute_acc_shells(
+            directions,
+            radii,
+            degree,
+            mu,
+            radius,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            C_lm,
+            S_lm,
+            deg_removed=deg_removed,
+        )
+        for i, r in enumerate(radii):
+            acc_true, pot_true = compute_acc(
+                (directions * r).reshape((-1,)),
+                degree,
+                mu,
+                radius,
+                n1,
+                n2,
+                n1q,
+                n2q,
+                C_lm,
+                S_lm,
+                deg_removed=deg_removed,
+            )
+            assert np.allclose(acc[i].reshape((-1,)), acc_true, rtol=1e-10)
+            assert np.allclose(pot[i], pot_true, rtol=1e-10)
+
+
+def test_adaptive_truncation():
+    degree = 60
+    C_lm, S_lm = generate_coefficients(degree)
+    n1, n2, n1q, n2q = compute_n_matrices(degree)
+    positions = generate_positions(50)
+    positions *= np.linspace(1.0, 5.0, len(positions)).reshape((-1, 1))
+
+    acc_true, pot_true = compute_acc(
+        positions.reshape((-1,)),
+        degree,
+        mu,
+        radius,
+        n1,
+        n2,
+        n1q,
+        n2q,
+        C_lm,
+        S_lm,
+    )
+    for tol in [1e-6, 1e-9]:
+        acc, pot, degrees = compute_acc_adaptive(
+            positions.reshape((-1,)),
+            degree,
+            mu,
+            radius,
+            n1,
+            n2,
+            n1q,
+            n2q,
+            C_lm,
+            S_lm,
+            tol,
+            return_degrees=True,
+        )
+        da = np.linalg.norm((acc - acc_true).reshape((-1, 3)), axis=1)
+        assert np.sqrt(np.mean(da**2)) < tol
+        assert np.all(degrees <= degree)
+        # Higher altitude samples need fewer degrees
+        assert degrees[-1] < degrees[0]
+
+    # A zero tolerance keeps the full expansion
+    acc, pot = compute_acc_adaptive(
+        positions.reshape((-1,)),
+        degree,
+        mu,
+        radius,
+        n1,
+        n2,
+        n1q,
+        n2q,
+        C_lm,
+        S_lm,
+        0.0,
+    )
+    assert np.allclose(acc, acc_true, rtol=1e-12)
+    assert np.allclose(pot, pot_true, rtol=1e-12)
+
+    # Integer and non-contiguous positions are converted like in compute_acc
+    # rather than compiling the kernel for them
+    args = (degree, mu, radius, n1, n2, n1q, n2q, C_lm, S_lm, 1e-9)
+    rounded = np.round(positions.reshape((-1,)))
+    strided = np.zeros((2 * len(rounded),))
+    strided[::2] = rounded
+    acc, pot = compute_acc_adaptive(rounded, *args, parallel=False)
+    signatures = len(compute_acc_adaptive_blocks_jit.signatures)
+    for converted in [rounded.astype(np.int64), strided[::2]]:
+        acc_converted, pot_converted = compute_acc_adaptive(
+            converted,
+            *args,
+            parallel=False,
+        )
+        assert np.array_equal(acc_converted, acc)
+        assert np.array_equal(pot_converted, pot)
+    assert len(compute_acc_adaptive_blocks_jit.signatures) == signatures
+
+
+def test_truncation_degree():
+    # Only degree 2 contributes, so the truncation degree must stay 2 however
+    # small (a/r)^N gets for a high degree or a distant point
+    weights = np.zeros((1001,))
+    weights[2] = 1e-3
+    for N, r in [(100, 10 * radius), (400, 10 * radius), (1000, 3 * radius)]:
+        term = mu / r**2 * (radius / r) ** 2 * weights[2]
+        assert truncation_degree(r, N, mu, radius, weights, 0.5 * term) == 2
+        assert truncation_degree(r, N, mu, radius, weights, 2.0 * term) == 0
+
+    # Agrees with the direct sum of the tail where it doesn't underflow
+    N, r = 60, 1.5 * radius
+    weights = np.abs(np.random.default_rng(0).normal(size=(N + 1,))) * 1e-3
+    terms = mu / r**2 * (radius / r) ** np.arange(N + 1) * weights
+    tails = np.cumsum(terms[::-1])[::-1]
+    for tol in [1e-3, 1e-6, 1e-9]:
+        expected = max([L for L in range(1, N + 1) if tails[L] >= tol] + [0])
+        assert truncation_degree(r, N, mu, radius, weights, tol) == expected
+
+def test_hessian():
+    for degree, deg_removed in [(0, -1), (2, -1), (30, -1), (30, 1)]:
+        C_lm, S_lm = generate_coefficients(degree)
+        positions = generate_positions(20)
+        args = (degree, mu, radius, *compute_n_matrices(degree), C_lm, S_lm)
+
+        acc, pot = compute_acc(positions.reshape((-1,)), *args, deg_removed=deg_removed)
+        acc_h, pot_h, hessian = compute_acc(
+            positions.reshape((-1,)),
+            *args,
+            deg_removed=deg_removed,
+            return_hessian=True,
+        )
+        assert np.allclose(acc, acc_h, rtol=1e-13, atol=0.0)
+        assert np.allclose(pot, pot_h, rtol=1e-13, atol=0.0)
+
+        # Central differences of the acceleration
+        eps = 1.0
+        hessian_fd = np.zeros_like(hessian)
+        for j in range(3):
+            dx = np.zeros((3,))
+            dx[j] = eps
+            acc_p, _ = compute_acc(
+                (positions + dx).reshape((-1,)),
+                *args,
+                deg_removed=deg_removed,
+            )
+            acc_m, _ = compute_acc(
+                (positions - dx).reshape((-1,)),
+                *args,
+                deg_removed=deg_removed,
+            )
+            hessian_fd[:, :, j] = ((acc_p - acc_m) / (2 * eps)).reshape((-1, 3))
+
+        scale = np.max(np.abs(hessian_fd))
+        assert np.max(np.abs(hessian - hessian_fd)) < 1e-6 * scale
+        assert np.allclose(hessian, np.transpose(hessian, (0, 2, 1)))
+        assert np.max(np.abs(np.trace(hessian, axis1=1, axis2=2))) < 1e-12 * scale
+
+
+def test_packed_coefficients():
+    degree, remove_deg = 6, 1
+    C_lm, S_lm = generate_coefficients(degree)
+    packed = PackedCoefficients.from_dense(C_lm, S_lm, degree)
+    assert packed.C[lm_index(4, 3)] == C_lm[4, 3]
+    assert packed.S[lm_index(6, 6)] == S_lm[6, 6]
+
+    C_dense, S_dense = packed.to_dense()
+    assert np.array_equal(C_dense, np.tril(C_lm[: degree + 1, : degree + 1]))
+    assert np.array_equal(S_dense, np.tril(S_lm[: degree + 1, : degree + 1]))
+
+    # Round trip through the parameter vector estimated by the regressors
+    solution = packed.to_solution(remove_deg)
+    C_hat, S_hat = format_coefficients(solution, degree, remove_deg)
+    assert np.array_equal(C_hat[remove_deg + 1 :], C_dense[remove_deg + 1 :])
+    assert np.array_equal(S_hat[remove_deg + 1 :], S_dense[remove_deg + 1 :])
+    assert C_hat[0, 0] == 1.0
+
+    # Order-major copy read by the low memory kernel, zero beyond the degree
+    order_major = to_order_major(packed.C, degree + 1)
+    for l in range(degree + 2):  # noqa: E741
+        for m in range(l + 1):
+            expected = C_lm[l, m] if l <= degree else 0.0
+            assert order_major[order_index(l, m, degree + 1)] == expected
+
+    # The removed degrees are restored the same way in both layouts
+    C_hat, S_hat = populate_removed_degrees(C_hat, S_hat, C_lm, S_lm, remove_deg)
+    estimate = PackedCoefficients.from_solution(solution, degree, remove_deg)
+    C_packed, S_packed = populate_removed_degrees(
+        estimate,
+        None,
+        packed,
+        None,
+        remove_deg,
+    )
+    assert np.array_equal(C_hat, C_dense)
+    assert np.array_equal(S_hat, S_dense)
+    assert np.array_equal(C_packed, packed.C)
+    assert np.array_equal(S_packed, packed.S)
+
+
+def test_coefficient_cache():
+    degree = 10
+    C_lm, S_lm = generate_coefficients(degree)
+    planet = SimpleNamespace(mu=mu, radius=radius)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sh_file = f"{tmp_dir}/coefficients.csv"
+        save(sh_file, planet, C_lm, S_lm)
+        cache_file = coefficient_cache_path(sh_file, degree)
+        try:
+            parsed = SphericalHarmonics(sh_file, degree)
+            assert os.path.exists(cache_file)
+            cached = SphericalHarmonics(sh_file, degree)
+            assert isinstance(cached.coefficients.C, np.memmap)
+            assert np.array_equal(parsed.C_lm, cached.C_lm)
+            assert np.array_equal(parsed.S_lm, cached.S_lm)
+            assert parsed.mu == cached.mu
+            assert parsed.radEquator == cached.radEquator
+        finally:
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+
+
+if __name__ == "__main__":
+    test_batched_matches_thread()
+    test_low_memory()
+    test_degree_band()
+    test_degree_truncations()
+    test_dh_grid()
+    test_radial_shells()
+    test_adaptive_truncation()
+    test_truncation_degree()
+    test_hessian()
+    test_packed_coefficients()
+    test_coefficient_cache()
+    print("Passed!")
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+
+from GravNN.GravityModels.Mascons import Mascons
+from GravNN.GravityModels.PointMass import PointMass, compute_point_masses
+
+
+def direct_sum(positions, mass_positions, masses_mu):
+    "N x M broadcast of the point mass field"
+    dr = positions[:, None, :] - mass_positions[None, :, :]
+    r = np.linalg.norm(dr, axis=2)
+    accelerations = -np.sum(masses_mu[None, :, None] * dr / r[:, :, None] ** 3, axis=1)
+    potentials = -np.sum(masses_mu[None, :] / r, axis=1)
+    return accelerations, potentials
+
+
+def test_tiled_kernel():
+    rng = np.random.default_rng(0)
+    positions = rng.normal(size=(301, 3)) * 30e3
+    mass_positions = rng.normal(size=(97, 3)) * 5e3
+    masses_mu = rng.uniform(0.0, 1.0, size=(97,))
+    acc_ref, pot_ref = direct_sum(positions, mass_positions, masses_mu)
+
+    # Tiles dividing the masses unevenly, or larger than all of them
+    for tile in [1, 7, 256]:
+        for parallel in [True, False]:
+            acc, pot = compute_point_masses(
+                positions,
+                mass_positions,
+                masses_mu,
+                parallel=parallel,
+                tile=tile,
+            )
+            assert np.allclose(acc, acc_ref, rtol=1e-12, atol=0.0)
+            assert np.allclose(pot, pot_ref, rtol=1e-12, atol=0.0)
+
+    # Fewer positions than threads
+    acc, pot = compute_point_masses(positions[:1], mass_positions, masses_mu)
+    assert np.allclose(acc, acc_ref[:1], rtol=1e-12, atol=0.0)
+
+
+def test_models():
+    rng = np.random.default_rng(1)
+    positions = rng.normal(size=(50, 3)) * 30e3
+
+    model = PointMass(SimpleNamespace(mu=3.0))
+    acc = model.compute_acceleration(positions)
+    acc_ref = np.array([model.compute_acceleration_value(x) for x in positions])
+    pot_ref = np.array([model.compute_potential_value(x) for x in positions])
+    assert np.allclose(acc, acc_ref, rtol=1e-14, atol=0.0)
+    assert np.allclose(model.potentials, pot_ref, rtol=1e-14, atol=0.0)
+
+    directory = tempfile.mkdtemp()
+    try:
+        mass_csv = os.path.join(directory, "masses.csv")
+        masses = np.hstack(
+            [rng.uniform(0.0, 1.0, size=(20, 1)), rng.normal(size=(20, 3)) * 5e3],
+        )
+        np.savetxt(mass_csv, masses, delimiter=",", header="mu,x,y,z")
+        model = Mascons(SimpleNamespace(mu=1.0), mass_csv)
+        acc = model.compute_acceleration(positions)
+        acc_ref = np.array([model.compute_acceleration_value(x) for x in positions])
+        pot_ref = np.array([model.compute_potential_value(x) for x in positions])
+        assert np.allclose(acc, acc_ref, rtol=1e-12, atol=0.0)
+        assert np.allclose(model.potentials, pot_ref, rtol=1e-12, atol=0.0)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_tiled_kernel()
+    test_models()
+    print("Passed!")
@@ -0,0 +1,216 @@
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+import trimesh
+
+import GravNN
+from GravNN.GravityModels.Polyhedral import Polyhedral
+from GravNN.GravityModels.Polyhedral_2 import Polyhedral_2
+from GravNN.GravityModels.PolyhedralLOD import PolyhedralLOD
+from GravNN.GravityModels.PolyhedralSH import (
+    PolyhedralHybrid,
+    get_polyhedral_sh_file,
+    polyhedron_stokes_coefficients,
+)
+from GravNN.GravityModels.PolyhedralTreecode import PolyhedralTreecode
+from GravNN.GravityModels.SHCoefficients import lm_index
+from GravNN.Support.ShapeModelRegistry import get_shape_model
+
+obj_file = os.path.dirname(GravNN.__file__) + "/Files/ShapeModels/Moon/Moon.obj"
+body = SimpleNamespace(mu=4.902799e12, radius=1738100.0, density=3346.0)
+
+
+def generate_positions(N, seed=0):
+    "Points inside and around the body, up to three radii"
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(N, 3))
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x * rng.uniform(0.2, 3.0, size=(N, 1)) * body.radius
+
+
+def test_multi_point_kernel():
+    positions = generate_positions(50)
+    for parallel in [True, False]:
+        model = Polyhedral(body, obj_file, parallel=parallel)
+        acc = model.compute_acceleration(positions)
+        pot = model.potentials
+
+        # One point at a time through the per-facet / per-edge loops
+        values = [model.compute_values(position) for position in positions]
+        acc_ref = np.array([a for a, _ in values])
+        pot_ref = np.array([u for _, u in values])
+        assert np.allclose(acc, acc_ref, rtol=1e-12, atol=0.0)
+        assert np.allclose(pot, pot_ref, rtol=1e-12, atol=0.0)
+
+    # Outside the (nearly spherical) body the field is that of a point mass
+    r = np.linalg.norm(positions, axis=1)
+    outside = r > 1.01 * body.radius
+    acc_pm = -body.mu * positions / r[:, None] ** 3
+    error = np.linalg.norm(acc - acc_pm, axis=1) / np.linalg.norm(acc_pm, axis=1)
+    assert np.all(error[outside] < 2e-3)
+
+
+def test_polyhedral_2_geometry():
+    positions = generate_positions(50)
+    reference = Polyhedral(body, obj_file, parallel=False)
+    acc_ref = reference.compute_acceleration(positions)
+    pot_ref = reference.potentials
+
+    for parallel in [True, False]:
+        model = Polyhedral_2(body, obj_file, parallel=parallel)
+        acc = model.compute_acceleration(positions)
+        assert np.allclose(acc, acc_ref, rtol=1e-10, atol=0.0)
+        assert np.allclose(model.potentials, pot_ref, rtol=1e-10, atol=0.0)
+        acc_point, pot_point = model.compute_values(positions[7])
+        assert np.allclose(acc_point, acc[7], rtol=1e-12, atol=0.0)
+        assert np.isclose(pot_point, model.potentials[7], rtol=1e-12, atol=0.0)
+
+    # Reduced precision geometry
+    model = Polyhedral_2(body, obj_file, geometry_dtype=np.float32)
+    assert model.edge_dyads.dtype == np.float32
+    acc = model.compute_acceleration(positions)
+    error = np.linalg.norm(acc - acc_ref, axis=1) / np.linalg.norm(acc_ref, axis=1)
+    assert np.all(error < 1e-5)
+
+
+def relative_errors(acc, pot, acc_ref, pot_ref):
+    acc_error = np.linalg.norm(acc - acc_ref, axis=1) / np.linalg.norm(acc_ref, axis=1)
+    pot_error = np.abs(pot - pot_ref) / np.abs(pot_ref)
+    return np.max(acc_error), np.max(pot_error)
+
+
+def test_treecode_accuracy():
+    positions = generate_positions(300)
+    reference = Polyhedral(body, obj_file)
+    acc_ref = reference.compute_acceleration(positions)
+    pot_ref = reference.potentials
+
+    # Without opening angle every leaf is evaluated exactly
+    model = PolyhedralTreecode(body, obj_file, theta=0.0, order=4, leaf_size=16)
+    acc = model.compute_acceleration(positions)
+    assert max(relative_errors(acc, model.potentials, acc_ref, pot_ref)) < 1e-12
+
+    # The error decreases with the order of the expansions
+    previous = np.inf
+    for order in [4, 8, 12]:
+        errors = []
+        for parallel in [True, False]:
+            model = PolyhedralTreecode(
+                body,
+                obj_file,
+                parallel=parallel,
+                theta=0.4,
+                order=order,
+                leaf_size=16,
+            )
+            acc = model.compute_acceleration(positions)
+            errors += relative_errors(acc, model.potentials, acc_ref, pot_ref)
+        assert max(errors) < previous / 10.0
+        previous = max(errors)
+    assert previous < 1e-7
+
+    for theta, order in [(1.0, 12), (0.4, -1)]:
+        try:
+            PolyhedralTreecode(body, obj_file, theta=theta, order=order)
+            assert False, "invalid parameters should be rejected"
+        except ValueError:
+            pass
+
+
+def test_box_stokes_coefficients():
+    # Second degree moments of a homogeneous box of half widths a, b, c
+    a, b, c, R = 3.0, 2.0, 1.0, 4.0
+    C_20 = (c**2 - (a**2 + b**2) / 2.0) / (3.0 * R**2) / np.sqrt(5.0)
+    C_22 = (a**2 - b**2) / (12.0 * R**2) / np.sqrt(5.0 / 12.0)
+
+    box = trimesh.creation.box(extents=[2.0 * a, 2.0 * b, 2.0 * c])
+    for parallel in [True, False]:
+        coefficients = polyhedron_stokes_coefficients(
+            box.vertices,
+            box.faces,
+            6,
+            R,
+            parallel=parallel,
+        )
+        C = coefficients.C.copy()
+        assert np.isclose(C[lm_index(0, 0)], 1.0, rtol=1e-14)
+        assert np.isclose(C[lm_index(2, 0)], C_20, rtol=1e-12)
+        assert np.isclose(C[lm_index(2, 2)], C_22, rtol=1e-12)
+
+        # The symmetries of the box cancel every other coefficient of degree <= 3
+        C[[lm_index(0, 0), lm_index(2, 0), lm_index(2, 2)]] = 0.0
+        assert np.all(np.abs(C[: lm_index(3, 3) + 1]) < 1e-15)
+        assert np.all(np.abs(coefficients.S) < 1e-15)
+
+
+def test_hybrid_far_field():
+    positions = 2.0 * generate_positions(300)
+    reference = Polyhedral(body, obj_file)
+    acc_ref = reference.compute_acceleration(positions)
+    pot_ref = reference.potentials
+
+    model = PolyhedralHybrid(body, obj_file, degree=10)
+    try:
+        acc = model.compute_acceleration(positions)
+        far = np.linalg.norm(positions, axis=1) > model.sh_radius
+        assert np.any(far) and not np.all(far)
+        assert np.array_equal(acc[~far], acc_ref[~far])
+        assert max(relative_errors(acc, model.potentials, acc_ref, pot_ref)) < 1e-7
+    finally:
+        os.remove(model.sh_file)
+
+
+def test_lod_error_bound():
+    # Shape models are resolved below the GravNN directory
+    directory = tempfile.mkdtemp(
+        dir=os.path.dirname(GravNN.__file__) + "/Files/ShapeModels",
+    )
+    asteroid = SimpleNamespace(mu=4.46e5, radius=16e3, density=2670.0)
+    files = []
+    for subdivisions in [1, 2, 3]:
+        mesh = trimesh.creation.icosphere(subdivisions=subdivisions)
+        mesh.vertices *= np.array([17.0, 6.0, 5.5])
+        files.append(os.path.join(directory, f"ellipsoid_{subdivisions}.obj"))
+        mesh.export(files[-1])
+
+    try:
+        rng = np.random.default_rng(0)
+        positions = rng.normal(size=(2000, 3))
+        positions /= np.linalg.norm(positions, axis=1, keepdims=True)
+        positions *= rng.uniform(5e3, 300e3, size=(2000, 1))
+        r = np.linalg.norm(positions, axis=1)
+        acc_ref = Polyhedral(asteroid, files[-1]).compute_acceleration(positions)
+
+        for tolerance in [1e-2, 1e-3, 1e-4]:
+            model = PolyhedralLOD(
+                asteroid,
+                files[-1],
+                coarse_obj_files=files[:2],
+                tolerance=tolerance,
+            )
+            acc = model.compute_acceleration(positions)
+            error = np.linalg.norm(acc - acc_ref, axis=1) / (asteroid.mu / r**2)
+            assert np.all(error <= tolerance)
+            assert np.any(model.point_levels < 2)
+
+            # The full resolution mesh is used inside the Brillouin sphere
+            inside = r <= model.brillouin_radius
+            assert np.any(inside) and np.all(model.point_levels[inside] == 2)
+    finally:
+        for obj_file in files:
+            os.remove(get_polyhedral_sh_file(asteroid, obj_file, 16))
+            shutil.rmtree(get_shape_model(obj_file).cache_directory)
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_multi_point_kernel()
+    test_polyhedral_2_geometry()
+    test_treecode_accuracy()
+    test_box_stokes_coefficients()
+    test_hybrid_far_field()
+    test_lod_error_bound()
+    print("Passed!")
@@ -0,0 +1,110 @@
+import gc
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import trimesh
+
+from GravNN.Support import ShapeModelRegistry
+from GravNN.Support.ShapeModelRegistry import get_shape_model
+
+
+def write_spheres(directory, N):
+    files = []
+    for i in range(N):
+        obj_file = os.path.join(directory, f"sphere_{i}.obj")
+        trimesh.creation.icosphere(subdivisions=1, radius=1.0 + i).export(obj_file)
+        files.append(obj_file)
+    return files
+
+
+def remove_caches(files):
+    for obj_file in files:
+        shutil.rmtree(get_shape_model(obj_file).cache_directory, ignore_errors=True)
+
+
+def test_shared_by_contents():
+    directory = tempfile.mkdtemp()
+    try:
+        obj_file = write_spheres(directory, 1)[0]
+        copy_file = os.path.join(directory, "copy.obj")
+        shutil.copy(obj_file, copy_file)
+
+        shape_model = get_shape_model(obj_file)
+        assert get_shape_model(copy_file) is shape_model
+
+        # The parsed mesh is not kept, the mesh property rebuilds it
+        assert shape_model._mesh is None
+        mesh = trimesh.load_mesh(obj_file)
+        assert np.allclose(shape_model.mesh.vertices, mesh.vertices)
+        assert np.isclose(shape_model.volume, mesh.volume)
+        remove_caches([obj_file])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_released_when_unused():
+    directory = tempfile.mkdtemp()
+    N = ShapeModelRegistry.MAX_RECENT_SHAPE_MODELS + 2
+    try:
+        files = write_spheres(directory, N)
+        held = get_shape_model(files[0])
+        for obj_file in files[1:]:
+            get_shape_model(obj_file)
+        gc.collect()
+
+        # Only the models in use and the most recent ones stay registered
+        digests = [ShapeModelRegistry.file_digest(obj_file) for obj_file in files]
+        alive = [digest in ShapeModelRegistry._shape_models for digest in digests]
+        assert alive[0] and not alive[1] and all(alive[2:])
+        assert get_shape_model(files[0]) is held
+        remove_caches(files)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_derived_keyed_by_code():
+    directory = tempfile.mkdtemp()
+    try:
+        obj_file = write_spheres(directory, 1)[0]
+        shape_model = get_shape_model(obj_file)
+        assert np.array_equal(
+            shape_model.derived("check", lambda shape: np.zeros(3)),
+            np.zeros(3),
+        )
+
+        # A changed derivation is computed again rather than served from cache
+        assert np.array_equal(
+            shape_model.derived("check", lambda shape: np.ones(3)),
+            np.ones(3),
+        )
+        assert np.array_equal(
+            shape_model.derived("check", lambda shape: np.ones(3), version=2),
+            np.ones(3),
+        )
+
+        # The unchanged derivation is read back from disk by a new ShapeModel
+        calls = []
+
+        def compute(shape):
+            calls.append(shape)
+            return np.zeros(3)
+
+        first = ShapeModelRegistry.ShapeModel(obj_file, shape_model.digest)
+        first.derived("counted", compute)
+        second = ShapeModelRegistry.ShapeModel(obj_file, shape_model.digest)
+        second.derived("counted", compute)
+        assert len(calls) == 1
+        cached = os.listdir(shape_model.cache_directory)
+        assert len([name for name in cached if name.startswith("check_")]) == 3
+        remove_caches([obj_file])
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_shared_by_contents()
+    test_released_when_unused()
+    test_derived_keyed_by_code()
+    print("Passed!")
@@ -1,9 +1,18 @@
+import inspect
+import os
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+
 from GravNN.CelestialBodies.Asteroids import Eros
 from GravNN.CelestialBodies.Planets import Earth
 from GravNN.GravityModels.Polyhedral import Polyhedral
 from GravNN.GravityModels.SphericalHarmonics import SphericalHarmonics
+from GravNN.Trajectories.FibonacciDist import FibonacciDist
 from GravNN.Trajectories.PlanesDist import PlanesDist
 from GravNN.Trajectories.RandomDist import RandomDist
+from GravNN.Trajectories.TrajectoryBase import TrajectoryBase
 
 
 def Random():
@@ -48,6 +57,24 @@ def Planes():
     shutil.rmtree(file_name_int)
 
 
+def test_fibonacci_fresh_tree():
+    # Earlier versions built the file directories through a TrajectoryBase/
+    # directory, which doesn't exist in a fresh tree (and must not be needed)
+    stray = os.path.splitext(inspect.getfile(TrajectoryBase))[0]
+    if os.path.isdir(stray) and not os.listdir(stray):
+        os.rmdir(stray)
+
+    body = SimpleNamespace(body_name="FreshTreeCheck", radius=1e6, mu=1.0)
+    traj = FibonacciDist(body, 1.1e6, 100)
+    try:
+        assert traj.positions.shape == (100, 3)
+        assert not os.path.exists(stray)
+        assert np.array_equal(FibonacciDist(body, 1.1e6, 100).positions, traj.positions)
+    finally:
+        shutil.rmtree(traj.file_directory)
+
+
 if __name__ == "__main__":
     Random()
     Planes()
+    test_fibonacci_fresh_tree()